@@ -0,0 +1,62 @@
+import functools
+import typing
+
+from .data_types import Column
+
+FieldEncoder = typing.Callable[[typing.Any], bytes]
+
+
+class CacheStats(typing.NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    size: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class EncodedValueCache:
+    """Bounded LRU cache of encoded column values keyed by (column, value)
+
+    Columns with the same definition, like the `account` column shared by many tables,
+    encode values the same way, so they share the same key and cached values.
+
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._column_keys: dict[Column, int] = {}
+        self._encoders: list[FieldEncoder] = []
+        self.lookup = functools.lru_cache(maxsize=maxsize)(self._encode)
+
+    def _encode(self, column_key: int, value: typing.Any) -> bytes:
+        return self._encoders[column_key](value)
+
+    def register(self, column: Column, encoder: FieldEncoder) -> int:
+        """Register encoder of a column and return the column key for `lookup`
+
+        :param column: the column
+        :param encoder: function encoding a value of the column into a whole field
+        :return: column key
+        """
+        column_key = self._column_keys.get(column)
+        if column_key is None:
+            column_key = len(self._encoders)
+            self._encoders.append(encoder)
+            self._column_keys[column] = column_key
+        return column_key
+
+    def stats(self) -> CacheStats:
+        info = self.lookup.cache_info()
+        return CacheStats(
+            hits=info.hits,
+            misses=info.misses,
+            maxsize=info.maxsize,
+            size=info.currsize,
+        )
+
+    def clear(self):
+        self.lookup.cache_clear()
@@ -0,0 +1,251 @@
+import enum
+import queue
+import threading
+import typing
+import uuid
+
+from beancount.core import data
+
+from .configs import ENTRY_TYPE_CONFIGS
+from .writers import DEFAULT_MAX_PENDING_CHUNKS
+from .writers import partition_of
+from .writers import PartitionBy
+
+# Max number of connections of COPY commands, well below the default
+# `max_connections` of PostgreSQL, which is 100
+DEFAULT_MAX_CONNECTIONS = 32
+
+
+@enum.unique
+class CommitMode(enum.StrEnum):
+    # each COPY is committed on its own, tables loaded successfully stay even if
+    # others fail
+    TABLE = "TABLE"
+    # all COPY commands are committed only after all of them succeed, otherwise all
+    # of them are rolled back
+    ALL = "ALL"
+    # same as ALL, with all transactions prepared before any of them is committed,
+    # so that a failed commit can't leave some of the tables loaded. Requires
+    # `max_prepared_transactions` of PostgreSQL to be set
+    TWO_PHASE = "TWO_PHASE"
+
+
+class CopyStream:
+    """File-like object streaming data written into it to a `COPY ... FROM STDIN`
+    command, running on its own connection and thread
+
+    Written chunks go through a bounded queue, which the COPY command reads from.
+    If the COPY command fails, the error is raised by the next `write` call.
+
+    """
+
+    def __init__(
+        self,
+        connection: typing.Any,
+        statement: str,
+        max_pending_chunks: int = DEFAULT_MAX_PENDING_CHUNKS,
+    ):
+        self.connection = connection
+        self.statement = statement
+        self.error: BaseException | None = None
+        self._queue: queue.Queue[bytes | None] = queue.Queue(maxsize=max_pending_chunks)
+        self._eof = False
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="pgcopy-copy", daemon=True
+        )
+
+    def _run(self):
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.copy_expert(self.statement, self)
+        except BaseException as exc:
+            self.error = exc
+            # keep draining the queue, so that write never blocks forever
+            while not self._eof:
+                self.read()
+
+    def start(self):
+        self._thread.start()
+
+    def read(self, size: int = -1) -> bytes:
+        # psycopg2 sends whatever is returned no matter the size it asks for
+        chunk = self._queue.get()
+        if chunk is None:
+            self._eof = True
+            return b""
+        return chunk
+
+    def write(self, data: bytes) -> int:
+        if self.error is not None:
+            raise self.error
+        # the buffer passed in is reused by the writer, take a copy
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        """End the COPY data and wait for the command to finish"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+
+def count_connections(
+    entries: data.Entries,
+    shards: int = 1,
+    partition_by: PartitionBy | None = None,
+    dimension_count: int = 0,
+) -> int:
+    """Number of COPY connections exporting the entries opens, one for each shard
+    of each table in each partition
+
+    :param dimension_count: number of dimension tables, which are not partitioned
+    """
+    if partition_by is None:
+        # all the tables are opened up front
+        return (2 + len(ENTRY_TYPE_CONFIGS) + dimension_count) * shards
+    # tables of a partition are opened for their first row
+    tables: set[tuple[str, typing.Hashable]] = set()
+    last_date = None
+    partition = ""
+    for entry in entries:
+        if entry.date != last_date:
+            last_date = entry.date
+            partition = partition_of(partition_by, last_date)
+            tables.add((partition, "entry_base"))
+        tables.add((partition, type(entry)))
+        if isinstance(entry, data.Transaction) and entry.postings:
+            tables.add((partition, "posting"))
+    return (len(tables) + dimension_count) * shards
+
+
+class CopyTarget:
+    """Loads tables into PostgreSQL with concurrent COPY commands, one connection
+    for each table (or each shard of a table)
+
+    The number of connections is capped by `max_connections`, as each of them
+    stays open until all the COPY commands are committed. Use `count_connections`
+    for checking whether an export fits before starting it.
+
+    """
+
+    def __init__(
+        self,
+        database_url: str,
+        commit_mode: CommitMode = CommitMode.TABLE,
+        schema: str | None = None,
+        max_pending_chunks: int = DEFAULT_MAX_PENDING_CHUNKS,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    ):
+        self.database_url = database_url
+        self.commit_mode = commit_mode
+        self.schema = schema
+        self.max_pending_chunks = max_pending_chunks
+        self.max_connections = max_connections
+        self.streams: list[CopyStream] = []
+        # global transaction id of two-phase commit
+        self._gtrid = f"beancount-exporter-{uuid.uuid4()}"
+        self._done = False
+
+    def table_name(self, table: str, partition: str | None = None) -> str:
+        """Name of the table to load, partitions go into `{table}_{partition}`"""
+        if partition is None:
+            return table
+        return f"{table}_{partition.replace('-', '_')}"
+
+    def open(self, table: str, partition: str | None = None) -> CopyStream:
+        """Start a COPY command of a table on a new connection
+
+        :raise ValueError: if it would exceed `max_connections`
+        """
+        import psycopg2
+        from psycopg2 import sql
+
+        if len(self.streams) >= self.max_connections:
+            raise ValueError(
+                f"Loading {self.table_name(table, partition)} exceeds the max number "
+                f"of {self.max_connections} COPY connections"
+            )
+        connection = psycopg2.connect(self.database_url)
+        if self.commit_mode == CommitMode.TWO_PHASE:
+            connection.tpc_begin(connection.xid(0, self._gtrid, str(len(self.streams))))
+        identifier = sql.Identifier(self.table_name(table, partition))
+        if self.schema is not None:
+            identifier = sql.Identifier(self.schema, self.table_name(table, partition))
+        statement = sql.SQL("COPY {} FROM STDIN WITH (FORMAT BINARY)").format(
+            identifier
+        )
+        stream = CopyStream(
+            connection,
+            statement.as_string(connection),
+            max_pending_chunks=self.max_pending_chunks,
+        )
+        stream.start()
+        self.streams.append(stream)
+        return stream
+
+    def _close_connections(self):
+        for stream in self.streams:
+            stream.connection.close()
+        self._done = True
+
+    def commit(self):
+        """Finish all COPY commands and commit them according to the commit mode,
+        the first COPY error is raised
+
+        """
+        for stream in self.streams:
+            stream.close()
+        errors = [stream.error for stream in self.streams if stream.error is not None]
+        try:
+            if self.commit_mode == CommitMode.TABLE:
+                for stream in self.streams:
+                    if stream.error is None:
+                        stream.connection.commit()
+                    else:
+                        stream.connection.rollback()
+            elif errors:
+                for stream in self.streams:
+                    self._rollback(stream)
+            elif self.commit_mode == CommitMode.ALL:
+                for stream in self.streams:
+                    stream.connection.commit()
+            elif self.commit_mode == CommitMode.TWO_PHASE:
+                prepared = []
+                try:
+                    for stream in self.streams:
+                        stream.connection.tpc_prepare()
+                        prepared.append(stream)
+                except BaseException:
+                    for stream in self.streams:
+                        self._rollback(stream)
+                    raise
+                for stream in prepared:
+                    stream.connection.tpc_commit()
+        finally:
+            self._close_connections()
+        if errors:
+            raise errors[0]
+
+    def _rollback(self, stream: CopyStream):
+        if self.commit_mode == CommitMode.TWO_PHASE:
+            stream.connection.tpc_rollback()
+        else:
+            stream.connection.rollback()
+
+    def abort(self):
+        """Roll back all COPY commands unless they are committed already, it's safe
+        to call after `commit`, so that it can be used for cleaning up after failures
+
+        """
+        if self._done:
+            return
+        for stream in self.streams:
+            stream.close()
+        try:
+            for stream in self.streams:
+                self._rollback(stream)
+        finally:
+            self._close_connections()
@@ -0,0 +1,265 @@
+import hashlib
+import logging
+import pathlib
+import typing
+import uuid
+
+import orjson
+
+from .encoders import compile_row_encoder
+from .schema import qualified_name
+from .schema import quote_identifier
+from .schema import quote_literal
+from .schema import TableSchema
+from .tables import ENTRY_BASE_KEY
+from .tables import ID_COLUMN
+from .tables import POSTING_KEY
+from .writers import ShardedTableWriter
+from .writers import TableWriter
+
+FINGERPRINTS_FILENAME = "fingerprints.json"
+# bump it whenever the fingerprints are no longer comparable with older ones
+FINGERPRINTS_VERSION = 1
+# tables whose rows carry the location of entries, fingerprinted apart from the
+# content of entries
+LOCATION_TABLE_KEYS = frozenset([ENTRY_BASE_KEY, POSTING_KEY])
+DELETED_ENTRIES_TABLE = "deleted_entries"
+DELETED_ENTRIES_FILENAME = f"{DELETED_ENTRIES_TABLE}.bin"
+APPLY_DELTA_FILENAME = "apply_delta.sql"
+
+logger = logging.getLogger(__name__)
+
+# Fingerprints of the content and the location of an entry
+Fingerprint = list[str]
+
+
+def make_fingerprint_header(
+    table_schemas: list[TableSchema], **settings: typing.Any
+) -> dict[str, typing.Any]:
+    """Header of fingerprints, previous fingerprints with a different header are not
+    comparable, like the ones exported with different tables or id strategy
+
+    :param table_schemas: schemas of the tables exported
+    :param settings: other settings affecting the rows, like `strip_paths`
+    """
+    schema_hash = hashlib.blake2b(
+        repr([tuple(table_schema) for table_schema in table_schemas]).encode(),
+        digest_size=16,
+    ).hexdigest()
+    return dict(version=FINGERPRINTS_VERSION, schema=schema_hash, **settings)
+
+
+def load_fingerprints(
+    path: pathlib.Path, header: dict[str, typing.Any]
+) -> dict[str, Fingerprint] | None:
+    """Load fingerprints of the previous export, None if they are missing or not
+    compatible with the header of this export
+
+    """
+    if not path.exists():
+        logger.warning("No fingerprints at %s, falling back to full export", path)
+        return None
+    fingerprints = orjson.loads(path.read_bytes())
+    if fingerprints.get("header") != header:
+        logger.warning(
+            "Fingerprints at %s are from an incompatible export, falling back to "
+            "full export",
+            path,
+        )
+        return None
+    return fingerprints["entries"]
+
+
+class DeltaTracker:
+    """Fingerprints entries by their encoded rows, and writes only the rows of entries
+    new or changed since the previous export
+
+    Rows written during an entry are held until `finish_entry`, then the fingerprint
+    of the entry is compared with the previous one of the same id. Ids have to stay
+    the same for unchanged entries, see `ContentAllocator`.
+
+    Rows of `entry_base` and `posting` are fingerprinted apart from the others, as
+    they carry `filename` and `lineno`, which change for every entry below a line
+    inserted into a file. Their other columns come from the content of the entry,
+    which the content id in the row of the entry type table covers. Entries only
+    moved around keep their rows of the entry type table, and have only their
+    `entry_base` and `posting` rows written, which replace the previous ones, see
+    `make_apply_delta_sql`.
+
+    """
+
+    def __init__(self, previous: dict[str, Fingerprint] | None = None):
+        self.previous = previous
+        self.fingerprints: dict[str, Fingerprint] = {}
+        self.unchanged_count = 0
+        self.moved_count = 0
+        self._pending: list[
+            tuple[TableWriter | ShardedTableWriter, bytes, typing.Hashable, tuple, bool]
+        ] = []
+        self._digest = hashlib.blake2b(digest_size=16)
+        self._location_digest = hashlib.blake2b(digest_size=16)
+
+    def wrap(
+        self, writers: dict[typing.Hashable, TableWriter | ShardedTableWriter]
+    ) -> "DeltaWriters":
+        return DeltaWriters(self, writers)
+
+    def finish_entry(self, entry_id: uuid.UUID):
+        id_key = str(entry_id)
+        fingerprint = [self._digest.hexdigest(), self._location_digest.hexdigest()]
+        self._digest = hashlib.blake2b(digest_size=16)
+        self._location_digest = hashlib.blake2b(digest_size=16)
+        self.fingerprints[id_key] = fingerprint
+        previous = self.previous.get(id_key) if self.previous is not None else None
+        if previous == fingerprint:
+            self.unchanged_count += 1
+        elif previous is not None and previous[0] == fingerprint[0]:
+            self.moved_count += 1
+            for writer, row, key, sort_key, location in self._pending:
+                if location:
+                    writer.write(row, key, sort_key)
+        else:
+            for writer, row, key, sort_key, _ in self._pending:
+                writer.write(row, key, sort_key)
+        self._pending.clear()
+
+    def deleted_ids(self) -> list[uuid.UUID]:
+        """Ids of entries gone or changed since the previous export, changed entries
+        are deleted before they are inserted again, while moved ones are updated
+
+        """
+        if self.previous is None:
+            return []
+        return [
+            uuid.UUID(id_key)
+            for id_key, (content, _) in self.previous.items()
+            if self.fingerprints.get(id_key, [None])[0] != content
+        ]
+
+    def dump(self, header: dict[str, typing.Any]) -> bytes:
+        return orjson.dumps(dict(header=header, entries=self.fingerprints))
+
+
+class PendingWriter:
+    def __init__(
+        self,
+        tracker: DeltaTracker,
+        writer: TableWriter | ShardedTableWriter,
+        location: bool = False,
+    ):
+        """
+        :param location: rows of the table carry the location of entries
+        """
+        self.tracker = tracker
+        self.writer = writer
+        self.location = location
+
+    def write(self, row: bytes, key: typing.Hashable = None, sort_key: tuple = ()):
+        if self.location:
+            self.tracker._location_digest.update(row)
+        else:
+            self.tracker._digest.update(row)
+        self.tracker._pending.append((self.writer, row, key, sort_key, self.location))
+
+
+class DeltaWriters(dict):
+    """Writers of a partition holding the rows for `DeltaTracker`"""
+
+    def __init__(
+        self,
+        tracker: DeltaTracker,
+        writers: dict[typing.Hashable, TableWriter | ShardedTableWriter],
+    ):
+        super().__init__()
+        self.tracker = tracker
+        self.writers = writers
+
+    def __missing__(self, key: typing.Hashable) -> PendingWriter:
+        writer = self[key] = PendingWriter(
+            self.tracker,
+            self.writers[key],
+            location=key in LOCATION_TABLE_KEYS,
+        )
+        return writer
+
+
+def write_deleted_ids(file: typing.BinaryIO, ids: list[uuid.UUID]):
+    encoder = compile_row_encoder("utf8", (ID_COLUMN,))
+    writer = TableWriter(file)
+    writer.start()
+    for entry_id in ids:
+        writer.write(encoder((entry_id,)))
+    writer.stop()
+
+
+def make_apply_delta_sql(
+    table_schemas: list[TableSchema],
+    table_files: list[tuple[str, str]],
+    schema: str | None = None,
+) -> str:
+    """Make a psql script applying the delta files in one transaction, entries to
+    delete and rows to insert are loaded into temporary tables first, then applied
+    with one DELETE and one INSERT for each table
+
+    Rows of `entry_base` and `posting` replace the existing ones with the same id,
+    which are the rows of entries only moved since the previous export.
+
+    :param table_schemas: schemas of the tables, referenced tables come first
+    :param table_files: table name and file name of the delta files, see
+        `list_table_files`
+    :param schema: PostgreSQL schema of the tables, `search_path` is used if None
+    """
+    deleted = quote_identifier(DELETED_ENTRIES_TABLE)
+    lines = [
+        "-- Generated by beancount-exporter, run it with psql in this directory",
+        "\\set ON_ERROR_STOP on",
+        "BEGIN;",
+        f"CREATE TEMPORARY TABLE {deleted} (id uuid PRIMARY KEY) ON COMMIT DROP;",
+        f"\\copy {deleted} FROM {quote_literal(DELETED_ENTRIES_FILENAME)} "
+        "WITH (FORMAT BINARY)",
+    ]
+    dimension_tables = {
+        table_schema.name for table_schema in table_schemas if table_schema.dimension
+    }
+    # rows referencing entries are deleted first, postings go with their transactions
+    for table_schema in reversed(table_schemas):
+        if table_schema.dimension:
+            continue
+        column = next(
+            (
+                column
+                for column, referenced in table_schema.foreign_keys
+                if column != "id" and referenced not in dimension_tables
+            ),
+            "id",
+        )
+        lines.append(
+            f"DELETE FROM {qualified_name(table_schema.name, schema)} "
+            f"WHERE {quote_identifier(column)} IN (SELECT id FROM {deleted});"
+        )
+    for table_schema in table_schemas:
+        name = qualified_name(table_schema.name, schema)
+        staging = quote_identifier(f"delta_{table_schema.name}")
+        lines.append(f"CREATE TEMPORARY TABLE {staging} (LIKE {name}) ON COMMIT DROP;")
+        lines.extend(
+            f"\\copy {staging} FROM {quote_literal(filename)} WITH (FORMAT BINARY)"
+            for table, filename in table_files
+            if table == table_schema.name
+        )
+        conflict = ""
+        if table_schema.dimension:
+            # dimension rows are written in full, the ones loaded before are kept
+            conflict = " ON CONFLICT (id) DO NOTHING"
+        elif table_schema.name in LOCATION_TABLE_KEYS:
+            columns = [
+                quote_identifier(column.attname)
+                for column in table_schema.table
+                if column.attname != "id"
+            ]
+            conflict = (
+                f" ON CONFLICT (id) DO UPDATE SET ({', '.join(columns)}) = "
+                f"ROW({', '.join(f'EXCLUDED.{column}' for column in columns)})"
+            )
+        lines.append(f"INSERT INTO {name} SELECT * FROM {staging}{conflict};")
+    lines.extend(["COMMIT;", ""])
+    return "\n".join(lines)
@@ -0,0 +1,192 @@
+import enum
+import hashlib
+import typing
+
+from .data_types import Table
+from .meta_columns import MetaColumn
+from .tables import ENTRY_BASE_KEY
+from .tables import POSTING_KEY
+from .tables import SOURCE_FILE_ID_COLUMN
+
+# int8's type oid, element type of the arrays of keys
+INT8_OID = 20
+
+
+@enum.unique
+class Dimension(enum.StrEnum):
+    # values are the names of the dimension tables
+    ACCOUNT = "account"
+    CURRENCY = "currency"
+    SOURCE_FILE = "source_file"
+
+
+# Columns replaced by keys of dimensions in normalized tables by table name, then
+# by column name, along with the name of the column holding the keys
+DIMENSION_COLUMNS: dict[str, dict[str, tuple[Dimension, str]]] = {
+    "open": {
+        "account": (Dimension.ACCOUNT, "account_id"),
+        "currencies": (Dimension.CURRENCY, "currency_ids"),
+    },
+    "close": {
+        "account": (Dimension.ACCOUNT, "account_id"),
+    },
+    "commodity": {
+        "currency": (Dimension.CURRENCY, "currency_id"),
+    },
+    "pad": {
+        "account": (Dimension.ACCOUNT, "account_id"),
+        "source_account": (Dimension.ACCOUNT, "source_account_id"),
+    },
+    "balance": {
+        "account": (Dimension.ACCOUNT, "account_id"),
+        "amount_currency": (Dimension.CURRENCY, "amount_currency_id"),
+        "diff_currency": (Dimension.CURRENCY, "diff_currency_id"),
+    },
+    "note": {
+        "account": (Dimension.ACCOUNT, "account_id"),
+    },
+    "price": {
+        "currency": (Dimension.CURRENCY, "currency_id"),
+        "amount_currency": (Dimension.CURRENCY, "amount_currency_id"),
+    },
+    "document": {
+        "account": (Dimension.ACCOUNT, "account_id"),
+    },
+    POSTING_KEY: {
+        "account": (Dimension.ACCOUNT, "account_id"),
+        "units_currency": (Dimension.CURRENCY, "units_currency_id"),
+        "price_currency": (Dimension.CURRENCY, "price_currency_id"),
+        "cost_currency": (Dimension.CURRENCY, "cost_currency_id"),
+    },
+}
+# Tables with the source file of their rows in meta, normalized tables have it in
+# the `source_file_id` column instead
+SOURCE_FILE_TABLES = frozenset([ENTRY_BASE_KEY, POSTING_KEY])
+
+# Dictionaries of all dimensions
+Dictionaries = dict[Dimension, "DimensionDictionary"]
+# Names of each dimension in the order they are first seen
+DimensionNames = dict[Dimension, list[str]]
+
+
+def dimension_key(name: str) -> int:
+    """Key of a name in a dimension, it's derived from the name only, so that the
+    same name gets the same key in every export, without keeping any state between
+    them
+
+    """
+    return int.from_bytes(
+        hashlib.blake2b(name.encode("utf8"), digest_size=8).digest(),
+        "big",
+        signed=True,
+    )
+
+
+class DimensionDictionary:
+    """Keys of the names of a dimension seen so far"""
+
+    def __init__(self):
+        self.keys: dict[str, int] = {}
+        self._names: dict[int, str] = {}
+
+    def key(self, name: str) -> int:
+        key = self.keys.get(name)
+        if key is not None:
+            return key
+        key = dimension_key(name)
+        other = self._names.get(key)
+        if other is not None:
+            raise ValueError(f"{other!r} and {name!r} have the same key {key}")
+        self.keys[name] = key
+        self._names[key] = name
+        return key
+
+
+def make_dictionaries() -> Dictionaries:
+    return {dimension: DimensionDictionary() for dimension in Dimension}
+
+
+def normalize_table(name: str, table: Table) -> Table:
+    """Replace the columns of dimension values with int8 keys, and add
+    `source_file_id` to the tables with the source file in meta
+
+    """
+    columns = DIMENSION_COLUMNS.get(name, {})
+    normalized = []
+    for column in table:
+        dimension_column = columns.get(column.attname)
+        if dimension_column is None:
+            normalized.append(column)
+            continue
+        _, attname = dimension_column
+        is_array = column.typelem != 0
+        normalized.append(
+            column._replace(
+                attname=attname,
+                type_category="A" if is_array else "N",
+                type_name="int8",
+                type_mod=-1,
+                typelem=INT8_OID if is_array else 0,
+            )
+        )
+    if name in SOURCE_FILE_TABLES:
+        normalized.append(SOURCE_FILE_ID_COLUMN)
+    return tuple(normalized)
+
+
+def dimension_foreign_keys(name: str, table: Table) -> tuple[tuple[str, str], ...]:
+    """Columns of a normalized table referencing dimension tables, along with the
+    tables they reference, arrays of keys can't have foreign keys
+
+    """
+    references = {
+        attname: dimension
+        for dimension, attname in DIMENSION_COLUMNS.get(name, {}).values()
+    }
+    if name in SOURCE_FILE_TABLES:
+        references[SOURCE_FILE_ID_COLUMN.attname] = Dimension.SOURCE_FILE
+    return tuple(
+        (column.attname, references[column.attname].value)
+        for column in table
+        if column.attname in references and column.typelem == 0
+    )
+
+
+def normalize_meta_columns(
+    meta_columns: tuple[MetaColumn, ...]
+) -> tuple[MetaColumn, ...]:
+    """Meta columns of normalized tables, the filename is in `source_file_id`"""
+    return tuple(
+        meta_column for meta_column in meta_columns if meta_column.key != "filename"
+    )
+
+
+def make_normalizer(
+    name: str, table: Table, dictionaries: Dictionaries
+) -> typing.Callable[[tuple], tuple] | None:
+    """Make the function replacing dimension values in rows of a table with their
+    keys, None if the table has none of them
+
+    :param name: name of the table
+    :param table: the table before being normalized
+    :param dictionaries: dictionaries of the dimensions
+    """
+    columns = DIMENSION_COLUMNS.get(name, {})
+    lookups = [
+        (index, dictionaries[columns[column.attname][0]].key, column.typelem != 0)
+        for index, column in enumerate(table)
+        if column.attname in columns
+    ]
+    if not lookups:
+        return None
+
+    def normalize(values: tuple) -> tuple:
+        normalized = list(values)
+        for index, key, is_array in lookups:
+            value = normalized[index]
+            if value is None:
+                continue
+            normalized[index] = list(map(key, value)) if is_array else key(value)
+        return tuple(normalized)
+
+    return normalize
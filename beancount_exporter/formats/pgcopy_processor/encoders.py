@@ -0,0 +1,345 @@
+import datetime
+import decimal
+import functools
+import struct
+import typing
+
+from .cache import EncodedValueCache
+from .data_types import Column
+from .data_types import Table
+from .numeric import encode_numeric
+from .utils import compile_formatter
+from .utils import serialize_row
+
+RowEncoder = typing.Callable[[tuple], bytes]
+
+# Same epoch as `pgcopy.copy.psql_epoch_date`, dates are encoded as days since it
+PSQL_EPOCH_DATE = datetime.date(2000, 1, 1)
+NULL_FIELD = struct.pack(">i", -1)
+# Types going through `pgcopy.copy.encode` before being formatted
+TEXT_TYPE_NAMES = frozenset(["varchar", "text", "json"])
+# Fixed width types, mapped to the struct format of their value
+FIXED_TYPE_FORMATS = {
+    "bool": "?",
+    "int2": "h",
+    "int4": "i",
+    "int8": "q",
+    "float4": "f",
+    "float8": "d",
+}
+ARRAY_TYPES = (list, tuple, set, frozenset)
+
+_INT = struct.Struct(">i")
+# total size, number of dimensions, has null, element type, length, lower bound
+_ARRAY_HEADER = struct.Struct(">i3i2i")
+_ARRAY_HEADER_SIZE = _ARRAY_HEADER.size - _INT.size
+_DATE = struct.Struct(">ii")
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_struct(fmt: str) -> struct.Struct:
+    return struct.Struct(fmt)
+
+
+def _pack_formatted(formatter: typing.Callable, value: typing.Any) -> bytes:
+    fmt, values = formatter(value)
+    return _get_struct(">" + fmt).pack(*values)
+
+
+def compile_text_array_encoder(
+    encoding: str, column: Column
+) -> typing.Callable[[typing.Any], bytes]:
+    """Compile encoder for one dimension text array column, the returned function
+    produces the whole field including the length prefix. Anything else than a flat
+    collection of strings or None raises so that the caller can fall back to
+    pgcopy's generic array formatter.
+
+    """
+    typelem = column.typelem
+
+    def encode_text_array(value: typing.Any) -> bytes:
+        if not isinstance(value, ARRAY_TYPES):
+            raise TypeError(f"{value!r} is not an array type")
+        chunks = []
+        has_null = False
+        for element in value:
+            if element is None:
+                has_null = True
+                chunks.append(NULL_FIELD)
+                continue
+            data = element.encode(encoding)
+            chunks.append(_INT.pack(len(data)))
+            chunks.append(data)
+        body = b"".join(chunks)
+        return (
+            _ARRAY_HEADER.pack(
+                _ARRAY_HEADER_SIZE + len(body), 1, has_null, typelem, len(value), 1
+            )
+            + body
+        )
+
+    return encode_text_array
+
+
+def compile_text_encoder(
+    encoding: str, column: Column
+) -> typing.Callable[[typing.Any], bytes]:
+    """Compile encoder for text or enum column, the returned function produces the
+    whole field including the length prefix
+
+    """
+    if column.type_name in ("varchar", "bpchar") and column.type_mod >= 0:
+        # postgres reports size + 4
+        size = column.type_mod - 4
+
+        def encode_text(value: str) -> bytes:
+            data = value[:size].encode(encoding)
+            return _INT.pack(len(data)) + data
+
+    else:
+
+        def encode_text(value: str) -> bytes:
+            data = value.encode(encoding)
+            return _INT.pack(len(data)) + data
+
+    return encode_text
+
+
+def encode_date(value: datetime.date) -> bytes:
+    return _DATE.pack(4, (value - PSQL_EPOCH_DATE).days)
+
+
+def encode_numeric_text(value: str) -> bytes:
+    return encode_numeric(decimal.Decimal(value))
+
+
+class _RowEncoderBuilder:
+    """Generates the source code of a row encoder function for a table.
+
+    Fixed width fields (including the length prefix of variable width fields) of
+    NOT NULL columns are accumulated and merged into one precompiled `struct.Struct`,
+    variable width payloads and nullable columns become separate byte pieces. All
+    pieces are joined once at the end of the function.
+
+    """
+
+    def __init__(
+        self,
+        encoding: str,
+        table: Table,
+        value_cache: EncodedValueCache | None = None,
+    ):
+        self.encoding = encoding
+        self.table = table
+        self.value_cache = value_cache
+        self.namespace: dict[str, typing.Any] = dict(
+            _EPOCH=PSQL_EPOCH_DATE,
+            _NULL=NULL_FIELD,
+            _numeric=encode_numeric,
+            _encoding=encoding,
+            _Decimal=decimal.Decimal,
+            _ARRAY_TYPES=ARRAY_TYPES,
+        )
+        if value_cache is not None:
+            self.namespace["_lookup"] = value_cache.lookup
+        self.lines: list[str] = []
+        self.pieces: list[str] = []
+        self.struct_fmt: list[str] = []
+        self.struct_args: list[str] = []
+
+    def add_global(self, name: str, value: typing.Any) -> str:
+        self.namespace[name] = value
+        return name
+
+    def add_fields(self, fmt: str, *args: str):
+        self.struct_fmt.append(fmt)
+        self.struct_args.extend(args)
+
+    def add_piece(self, expr: str):
+        self.flush_fields()
+        self.pieces.append(expr)
+
+    def flush_fields(self):
+        if not self.struct_fmt:
+            return
+        name = self.add_global(
+            f"_s{len(self.pieces)}", struct.Struct(">" + "".join(self.struct_fmt))
+        )
+        self.pieces.append(f"{name}.pack({', '.join(self.struct_args)})")
+        self.struct_fmt = []
+        self.struct_args = []
+
+    def add_column(self, index: int, column: Column):
+        value = f"v{index}"
+        if self.value_cache is not None and self.add_cached(index, column):
+            return
+        if column.type_category == "A":
+            if column.type_name in TEXT_TYPE_NAMES and column.type_mod < 0:
+                encoder = self.add_global(
+                    f"_a{index}", compile_text_array_encoder(self.encoding, column)
+                )
+                self.add_nullable_chunk(index, column, f"{encoder}({value})")
+            else:
+                self.add_generic(index, column)
+        elif column.type_category == "E" or column.type_name in TEXT_TYPE_NAMES:
+            if column.type_name in ("varchar", "bpchar") and column.type_mod >= 0:
+                # postgres reports size + 4
+                value = f"{value}[:{column.type_mod - 4}]"
+            self.add_variable(index, column, f"{value}.encode(_encoding)")
+        elif column.type_name == "jsonb":
+            # first byte is the version of jsonb binary format
+            if column.not_null:
+                self.lines.append(f"if {value} is None: raise ValueError")
+                self.add_fields("ib", f"len({value}) + 1", "1")
+                self.add_piece(value)
+            else:
+                self.add_variable(index, column, f"b'\\x01' + {value}")
+        elif column.type_name == "uuid":
+            self.add_fixed(index, column, "16s", f"{value}.bytes")
+        elif column.type_name == "date":
+            self.add_fixed(index, column, "i", f"({value} - _EPOCH).days")
+        elif column.type_name == "numeric":
+            self.add_nullable_chunk(index, column, f"_numeric({value})")
+        elif column.type_name in FIXED_TYPE_FORMATS:
+            self.add_fixed(index, column, FIXED_TYPE_FORMATS[column.type_name], value)
+        else:
+            self.add_generic(index, column)
+
+    def add_cached(self, index: int, column: Column) -> bool:
+        """Add column encoded through the value cache, returns False if the column
+        type is not worth caching, like uuid or jsonb which are mostly unique
+
+        """
+        value = f"v{index}"
+        if column.type_category == "A":
+            if column.type_name not in TEXT_TYPE_NAMES or column.type_mod >= 0:
+                return False
+            array_encoder = compile_text_array_encoder(self.encoding, column)
+            encoder = self.add_global(f"_a{index}", array_encoder)
+            key = self.value_cache.register(column, array_encoder)
+            # sets are not hashable, tuple keeps the same element order
+            expr = (
+                f"_lookup({key}, tuple({value})) "
+                f"if isinstance({value}, _ARRAY_TYPES) else {encoder}({value})"
+            )
+        elif column.type_category == "E" or column.type_name in TEXT_TYPE_NAMES:
+            key = self.value_cache.register(
+                column, compile_text_encoder(self.encoding, column)
+            )
+            expr = f"_lookup({key}, {value})"
+        elif column.type_name == "date":
+            key = self.value_cache.register(column, encode_date)
+            expr = f"_lookup({key}, {value})"
+        elif column.type_name == "numeric":
+            # Equal decimals like 1.0 and 1.00 are encoded differently, so they are
+            # keyed by their string form instead
+            key = self.value_cache.register(column, encode_numeric_text)
+            expr = (
+                f"_lookup({key}, str({value})) "
+                f"if {value}.__class__ is _Decimal else _numeric({value})"
+            )
+        else:
+            return False
+        self.add_nullable_chunk(index, column, expr)
+        return True
+
+    def add_fixed(self, index: int, column: Column, fmt: str, expr: str):
+        size = struct.calcsize(">" + fmt)
+        value = f"v{index}"
+        if column.not_null:
+            self.lines.append(f"if {value} is None: raise ValueError")
+            self.add_fields("i" + fmt, str(size), expr)
+        else:
+            packer = self.add_global(f"_f{index}", struct.Struct(">i" + fmt))
+            self.add_nullable_chunk(index, column, f"{packer}.pack({size}, {expr})")
+
+    def add_variable(self, index: int, column: Column, expr: str):
+        value = f"v{index}"
+        data = f"b{index}"
+        if column.not_null:
+            self.lines.append(f"if {value} is None: raise ValueError")
+            self.lines.append(f"{data} = {expr}")
+            self.add_fields("i", f"len({data})")
+        else:
+            self.lines.append(f"if {value} is None:")
+            self.lines.append(f"    l{index} = -1")
+            self.lines.append(f"    {data} = b''")
+            self.lines.append("else:")
+            self.lines.append(f"    {data} = {expr}")
+            self.lines.append(f"    l{index} = len({data})")
+            self.add_fields("i", f"l{index}")
+        self.add_piece(data)
+
+    def add_nullable_chunk(self, index: int, column: Column, expr: str):
+        value = f"v{index}"
+        if column.not_null:
+            self.lines.append(f"if {value} is None: raise ValueError")
+            self.add_piece(expr)
+        else:
+            self.lines.append(f"c{index} = _NULL if {value} is None else {expr}")
+            self.add_piece(f"c{index}")
+
+    def add_generic(self, index: int, column: Column):
+        formatter = self.add_global(
+            f"_g{index}",
+            functools.partial(
+                _pack_formatted, compile_formatter(self.encoding, column)
+            ),
+        )
+        if column.not_null:
+            self.add_piece(f"{formatter}(v{index})")
+        else:
+            self.add_nullable_chunk(index, column, f"{formatter}(v{index})")
+
+    def build(self) -> str:
+        self.add_fields("h", str(len(self.table)))
+        for index, column in enumerate(self.table):
+            self.add_column(index, column)
+        self.flush_fields()
+        values = "".join(f"v{index}, " for index in range(len(self.table)))
+        body = [f"{values}= values", *self.lines]
+        if len(self.pieces) == 1:
+            body.append(f"return {self.pieces[0]}")
+        else:
+            body.append(f"return b''.join(({', '.join(self.pieces)},))")
+        indent = " " * 8
+        return "\n".join(
+            [
+                "def encode_row(values):",
+                "    try:",
+                *(indent + line for line in body),
+                "    except Exception:",
+                # Let the generic formatter chain deal with whatever the generated
+                # code cannot handle, it also raises the same errors as before
+                "        return _fallback(values)",
+            ]
+        )
+
+
+def compile_row_encoder(
+    encoding: str,
+    table: Table,
+    value_cache: EncodedValueCache | None = None,
+) -> RowEncoder:
+    """Compile a function encoding a row of the given table into PGCOPY binary
+    format. The output is identical to `serialize_row` with formatters from
+    `compile_formatter`, which is also used as the fallback for values the
+    generated code doesn't handle
+
+    :param encoding: encoding for text values
+    :param table: table of the rows
+    :param value_cache: optional cache for encoded values of text, enum, date,
+        numeric and text array columns
+    :return: function takes a tuple of column values and returns the encoded row
+    """
+    builder = _RowEncoderBuilder(
+        encoding=encoding, table=table, value_cache=value_cache
+    )
+    source = builder.build()
+    formatters = [compile_formatter(encoding, column) for column in table]
+    namespace = builder.namespace
+    namespace["_fallback"] = functools.partial(serialize_row, formatters)
+    exec(compile(source, "<row encoder>", "exec"), namespace)
+    encode_row = namespace["encode_row"]
+    encode_row.source = source
+    return encode_row
@@ -0,0 +1,172 @@
+import errno
+import logging
+import os
+import pathlib
+import queue
+import select
+import threading
+import time
+
+# Seconds to wait for a consumer to open a FIFO, or to read from it
+DEFAULT_FIFO_TIMEOUT = 60.0
+# Seconds between checks for consumers and aborting
+POLL_INTERVAL = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressClock:
+    """Time of the last progress of a group of FIFOs, data written into any of them
+    by the exporter, or read from any of them by the consumers
+
+    """
+
+    def __init__(self):
+        self.last_progress = time.monotonic()
+
+    def touch(self):
+        self.last_progress = time.monotonic()
+
+    def idle_time(self) -> float:
+        return time.monotonic() - self.last_progress
+
+
+class FifoWriter:
+    """File-like object writing into a named pipe (FIFO) on its own thread
+
+    Data written into it is buffered in an unbounded queue, so that encoding never
+    waits for a particular consumer. Consumers are free to read the tables in any
+    order (or one after another) without deadlocking the exporter, at the cost of
+    holding the data not read yet in memory.
+
+    While the FIFO is waiting for the consumer to open or to read it, a
+    `TimeoutError` is raised if no progress is made for `timeout` seconds. FIFOs
+    sharing the same `clock` count the progress of each other, so that a consumer
+    reading one table after another doesn't time out the tables it hasn't got to
+    yet. Errors of the writer thread, like a consumer closing the pipe early, are
+    raised by the next `write` or by `close`.
+
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        timeout: float = DEFAULT_FIFO_TIMEOUT,
+        clock: ProgressClock | None = None,
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.clock = clock or ProgressClock()
+        if path.exists() or path.is_symlink():
+            path.unlink()
+        os.mkfifo(path)
+        self.error: BaseException | None = None
+        self._queue: queue.SimpleQueue[bytes | None] = queue.SimpleQueue()
+        self._aborted = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"fifo-{path.name}", daemon=True
+        )
+        self._thread.start()
+
+    def _open(self) -> int:
+        logger.debug("Waiting for consumer of %s", self.path)
+        while not self._aborted.is_set():
+            try:
+                # opening a FIFO without a reader fails with ENXIO in non-blocking
+                # mode, instead of blocking until a reader shows up
+                fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+                self.clock.touch()
+                return fd
+            except OSError as exc:
+                if exc.errno != errno.ENXIO:
+                    raise
+            if self.clock.idle_time() >= self.timeout:
+                raise TimeoutError(
+                    f"No consumer opened {self.path} for reading, and there was no "
+                    f"progress in {self.timeout}s"
+                )
+            time.sleep(POLL_INTERVAL)
+        raise InterruptedError(f"Writing {self.path} is aborted")
+
+    def _write_all(self, fd: int, chunk: bytes):
+        view = memoryview(chunk)
+        while view:
+            if self._aborted.is_set():
+                raise InterruptedError(f"Writing {self.path} is aborted")
+            _, writable, _ = select.select([], [fd], [], POLL_INTERVAL)
+            if not writable:
+                if self.clock.idle_time() >= self.timeout:
+                    raise TimeoutError(
+                        f"Consumer of {self.path} stopped reading, and there was no "
+                        f"progress in {self.timeout}s"
+                    )
+                continue
+            try:
+                written = os.write(fd, view)
+            except BlockingIOError:
+                continue
+            except BrokenPipeError as exc:
+                raise BrokenPipeError(
+                    exc.errno,
+                    f"Consumer of {self.path} closed it before reading all data",
+                ) from exc
+            view = view[written:]
+            self.clock.touch()
+
+    def _run(self):
+        fd = None
+        try:
+            fd = self._open()
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    return
+                self._write_all(fd, chunk)
+        except BaseException as exc:
+            self.error = exc
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def write(self, data: bytes) -> int:
+        if self.error is not None:
+            raise self.error
+        if self._closed:
+            raise ValueError(f"Writing to closed {self.path}")
+        # the buffer passed in is reused by the writer, take a copy
+        self._queue.put(bytes(data))
+        self.clock.touch()
+        return len(data)
+
+    def finish(self):
+        """End the data without waiting for the consumer to read it, so that other
+        FIFOs can be finished before waiting for any of them
+
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+
+    def close(self):
+        """Wait for the consumer to read all the data, and close the FIFO"""
+        self.finish()
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def abort(self):
+        """Stop writing without waiting for the consumer, also after `finish`"""
+        self._aborted.set()
+        self.finish()
+        self._thread.join()
+
+    def __enter__(self) -> "FifoWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,267 @@
+import datetime
+import enum
+import os
+import typing
+import uuid
+
+from beancount.core import data
+
+EntryId = uuid.UUID | int
+
+# Variant and version bits of UUID, same as what `uuid.UUID(version=...)` sets
+_VARIANT_RFC_4122 = 0x8000 << 48
+_UUID7_VERSION = 7 << 76
+# Translation tables setting the version byte and the variant byte of UUIDv4
+_UUID4_VERSION_BYTE = bytes((byte & 0x0F) | 0x40 for byte in range(256))
+_RFC_4122_VARIANT_BYTE = bytes((byte & 0x3F) | 0x80 for byte in range(256))
+# Namespace of content-addressed ids
+CONTENT_ID_NAMESPACE = uuid.uuid5(
+    uuid.NAMESPACE_URL, "https://github.com/LaunchPlatform/beancount-exporter"
+)
+# Meta keys not considered as content of entries and postings, they change whenever
+# lines move around
+LOCATION_META_KEYS = frozenset(["filename", "lineno"])
+_UNIX_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_MS_PER_DAY = 24 * 60 * 60 * 1000
+# UUIDv7 uses the 12 bits rand_a and the 30 high bits of rand_b as a counter, the
+# remaining 32 bits of rand_b are random
+_UUID7_COUNTER_LOW_BITS = 30
+_UUID7_COUNTER_MASK = (1 << 42) - 1
+_UUID7_COUNTER_LOW_MASK = (1 << _UUID7_COUNTER_LOW_BITS) - 1
+
+
+@enum.unique
+class IdStrategy(enum.StrEnum):
+    UUID4 = "UUID4"
+    UUID7 = "UUID7"
+    SEQUENCE = "SEQUENCE"
+    CONTENT = "CONTENT"
+
+
+def random_integers(size: int, batch_size: int) -> typing.Generator[int, None, None]:
+    """Generate random integers of given size in bytes, reading one block of
+    `size * batch_size` bytes from `os.urandom` at a time
+
+    """
+    while True:
+        block = os.urandom(size * batch_size)
+        for offset in range(0, len(block), size):
+            yield int.from_bytes(block[offset : offset + size])
+
+
+class IdAllocator:
+    # PostgreSQL type of the id columns, see `tables.replace_id_type`
+    type_name: str = "uuid"
+    # whether the same entries always get the same ids
+    deterministic: bool = False
+
+    def entry_id(self, entry: data.Directive) -> EntryId:
+        raise NotImplementedError()
+
+    def posting_ids(self, entry: data.Transaction, entry_id: EntryId) -> list[EntryId]:
+        raise NotImplementedError()
+
+    def fork(self, id_offset: int) -> "IdAllocator":
+        """Create an allocator for a chunk of entries processed in another process
+
+        :param id_offset: number of ids (entries and postings) allocated by this
+            allocator for the entries before the chunk
+        """
+        raise NotImplementedError()
+
+
+def uuid4_batch(count: int) -> list[uuid.UUID]:
+    """Generate UUIDv4s from one block of random bytes"""
+    block = bytearray(os.urandom(16 * count))
+    block[6::16] = block[6::16].translate(_UUID4_VERSION_BYTE)
+    block[8::16] = block[8::16].translate(_RFC_4122_VARIANT_BYTE)
+    block = bytes(block)
+    return [
+        uuid.UUID(bytes=block[offset : offset + 16])
+        for offset in range(0, len(block), 16)
+    ]
+
+
+class Uuid4Allocator(IdAllocator):
+    """Random UUIDv4, allocated in batches from one block of random bytes"""
+
+    def __init__(self, batch_size: int = 4096):
+        self.batch_size = batch_size
+        self._pool: list[uuid.UUID] = []
+
+    def entry_id(self, entry: data.Directive) -> uuid.UUID:
+        if not self._pool:
+            self._pool = uuid4_batch(self.batch_size)
+        return self._pool.pop()
+
+    def posting_ids(
+        self, entry: data.Transaction, entry_id: EntryId
+    ) -> list[uuid.UUID]:
+        count = len(entry.postings)
+        pool = self._pool
+        if len(pool) < count:
+            pool.extend(uuid4_batch(max(count, self.batch_size)))
+        ids = pool[len(pool) - count :]
+        del pool[len(pool) - count :]
+        return ids
+
+    def fork(self, id_offset: int) -> "Uuid4Allocator":
+        return Uuid4Allocator(batch_size=self.batch_size)
+
+
+class Uuid7Allocator(IdAllocator):
+    """Time-ordered UUIDv7 with the entry date as the timestamp
+
+    A counter shared by all ids follows the timestamp, so ids allocated for entries
+    in date order (which is how beancount sorts them) are increasing, and inserts
+    into the btree index of the id column stay local. Dates before 1970 are clamped
+    to the unix epoch.
+
+    """
+
+    def __init__(self, batch_size: int = 4096, counter_start: int = 0):
+        self.batch_size = batch_size
+        self._random = random_integers(4, batch_size)
+        self._counter = counter_start
+
+    def _new_id(self, date: datetime.date) -> uuid.UUID:
+        timestamp = max(0, (date.toordinal() - _UNIX_EPOCH_ORDINAL) * _MS_PER_DAY)
+        counter = self._counter & _UUID7_COUNTER_MASK
+        self._counter += 1
+        return uuid.UUID(
+            int=(
+                (timestamp << 80)
+                | _UUID7_VERSION
+                | ((counter >> _UUID7_COUNTER_LOW_BITS) << 64)
+                | _VARIANT_RFC_4122
+                | ((counter & _UUID7_COUNTER_LOW_MASK) << 32)
+                | next(self._random)
+            )
+        )
+
+    def entry_id(self, entry: data.Directive) -> uuid.UUID:
+        return self._new_id(entry.date)
+
+    def posting_ids(
+        self, entry: data.Transaction, entry_id: EntryId
+    ) -> list[uuid.UUID]:
+        return [self._new_id(entry.date) for _ in entry.postings]
+
+    def fork(self, id_offset: int) -> "Uuid7Allocator":
+        return Uuid7Allocator(
+            batch_size=self.batch_size, counter_start=self._counter + id_offset
+        )
+
+
+class SequenceAllocator(IdAllocator):
+    """Compact bigint ids from a sequence, entries and postings share the sequence"""
+
+    type_name = "int8"
+    deterministic = True
+
+    def __init__(self, start: int = 1):
+        self._next = start
+
+    def entry_id(self, entry: data.Directive) -> int:
+        id = self._next
+        self._next += 1
+        return id
+
+    def posting_ids(self, entry: data.Transaction, entry_id: EntryId) -> list[int]:
+        start = self._next
+        self._next += len(entry.postings)
+        return list(range(start, self._next))
+
+    def fork(self, id_offset: int) -> "SequenceAllocator":
+        return SequenceAllocator(start=self._next + id_offset)
+
+
+def normalize_content(value: typing.Any) -> typing.Any:
+    """Normalize value of an entry field into a structure with stable `repr`, sets
+    are sorted and location or internal (like `__tolerances__`) meta keys are removed
+
+    """
+    if isinstance(value, dict):
+        return tuple(
+            sorted(
+                (key, normalize_content(item))
+                for key, item in value.items()
+                if key not in LOCATION_META_KEYS and not key.startswith("__")
+            )
+        )
+    elif isinstance(value, (set, frozenset)):
+        return tuple(sorted(map(normalize_content, value), key=repr))
+    elif isinstance(value, tuple) and hasattr(value, "_fields"):
+        return (
+            type(value).__name__,
+            *(
+                (name, normalize_content(item))
+                for name, item in zip(value._fields, value)
+            ),
+        )
+    elif isinstance(value, (list, tuple)):
+        return tuple(map(normalize_content, value))
+    return value
+
+
+class ContentAllocator(IdAllocator):
+    """Deterministic UUIDv5 ids derived from the content of entries
+
+    The entry id is derived from the entry type, date and all other fields including
+    meta, except `filename`, `lineno` and internal keys starting with `__`. Posting
+    ids are derived from the entry id and the position of the posting within the
+    transaction. Unchanged entries keep the same ids across exports, no matter where
+    they are in the ledger files, and the same goes for entries generated by plugins,
+    like `<auto_accounts>` opens and padding transactions. `PgCopyProcessor` strips
+    the base path off the filename of documents before allocating their ids, so
+    that they don't depend on where the ledger is checked out either.
+
+    Entries with identical content, like two same coffee purchases on the same day,
+    are told apart by the order of their occurrence: the first one gets the content
+    id, and the n-th duplicate gets an id derived from the content id and n. Their ids
+    are stable as long as the relative order of the duplicates doesn't change.
+
+    """
+
+    deterministic = True
+
+    def __init__(self, namespace: uuid.UUID = CONTENT_ID_NAMESPACE):
+        self.namespace = namespace
+        self._occurrences: dict[uuid.UUID, int] = {}
+
+    def content_id(self, entry: data.Directive) -> uuid.UUID:
+        return uuid.uuid5(self.namespace, repr(normalize_content(entry)))
+
+    def entry_id(self, entry: data.Directive) -> uuid.UUID:
+        content_id = self.content_id(entry)
+        occurrence = self._occurrences.get(content_id, 0)
+        self._occurrences[content_id] = occurrence + 1
+        if not occurrence:
+            return content_id
+        return uuid.uuid5(content_id, f"duplicate:{occurrence}")
+
+    def posting_ids(
+        self, entry: data.Transaction, entry_id: EntryId
+    ) -> list[uuid.UUID]:
+        return [
+            uuid.uuid5(entry_id, f"posting:{index}")
+            for index in range(len(entry.postings))
+        ]
+
+    def fork(self, id_offset: int) -> "ContentAllocator":
+        # ids don't depend on the offset, but the duplicates seen so far still count
+        allocator = ContentAllocator(namespace=self.namespace)
+        allocator._occurrences = self._occurrences.copy()
+        return allocator
+
+
+def make_id_allocator(strategy: IdStrategy) -> IdAllocator:
+    if strategy == IdStrategy.UUID4:
+        return Uuid4Allocator()
+    elif strategy == IdStrategy.UUID7:
+        return Uuid7Allocator()
+    elif strategy == IdStrategy.SEQUENCE:
+        return SequenceAllocator()
+    elif strategy == IdStrategy.CONTENT:
+        return ContentAllocator()
+    raise ValueError(f"Unexpected id strategy {strategy}")
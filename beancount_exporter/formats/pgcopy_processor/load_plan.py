@@ -0,0 +1,122 @@
+import pathlib
+import shlex
+import typing
+
+from .manifest import table_filenames
+from .schema import build_constraints_sql
+from .schema import create_tables_sql
+from .schema import create_types_sql
+from .schema import qualified_name
+from .schema import quote_identifier
+from .schema import quote_literal
+from .schema import TableMode
+from .schema import TableSchema
+
+CREATE_TABLES_FILENAME = "create_tables.sql"
+BUILD_CONSTRAINTS_FILENAME = "build_constraints.sql"
+LOAD_SCRIPT_FILENAME = "load.sh"
+DEFAULT_LOAD_JOBS = 4
+
+
+def list_table_files(
+    table_schemas: list[TableSchema], manifest: dict[str, typing.Any] | None = None
+) -> list[tuple[str, str]]:
+    """List the files of tables to load, from the manifest if there's one
+
+    :param table_schemas: schemas of the tables
+    :param manifest: manifest of the output, see `make_manifest`
+    :return: table name and file name of the files, partitions and shards of a table
+        are all loaded into the table
+    """
+    table_files = []
+    for table_schema in table_schemas:
+        if manifest is None:
+            filenames = table_filenames(table_schema.name)
+        else:
+            filenames = [
+                file["file"] for file in manifest["tables"].get(table_schema.name, [])
+            ]
+        table_files.extend((table_schema.name, filename) for filename in filenames)
+    return table_files
+
+
+def make_load_script(
+    table_files: list[tuple[str, str]],
+    schema: str | None = None,
+    jobs: int = DEFAULT_LOAD_JOBS,
+) -> str:
+    """Make a shell script loading the tables with psql, the connection is set with
+    the libpq environment variables like `PGHOST` and `PGDATABASE`
+
+    The tables are created first, then the files are copied by `xargs -P`, which
+    starts the next copy as soon as any of the `jobs` running ones is done, so that
+    a large file doesn't hold up the others. The constraints and indexes are built
+    only after all of them are loaded.
+
+    """
+    psql = "psql -X -q -v ON_ERROR_STOP=1"
+    lines = [
+        "#!/bin/sh",
+        "# Generated by beancount-exporter, loads the PGCOPY tables into PostgreSQL",
+        "set -eu",
+        'cd "$(dirname "$0")"',
+        f"{psql} -1 -f {CREATE_TABLES_FILENAME}",
+        "failed=0",
+    ]
+    if table_files:
+        lines.append("printf '%s\\0' \\")
+        for table, filename in table_files:
+            command = (
+                f"\\copy {qualified_name(table, schema)} "
+                f"FROM {quote_literal(filename)} WITH (FORMAT BINARY)"
+            )
+            lines.append(f"    {shlex.quote(command)} \\")
+        lines.append(f"    | xargs -0 -n 1 -P {jobs} {psql} -c || failed=1")
+    lines.extend(
+        [
+            'if [ "$failed" -ne 0 ]; then',
+            '    echo "Loading tables failed" >&2',
+            "    exit 1",
+            "fi",
+            f"{psql} -1 -f {BUILD_CONSTRAINTS_FILENAME}",
+            "",
+        ]
+    )
+    return "\n".join(lines)
+
+
+def write_load_plan(
+    output_dir: pathlib.Path,
+    table_schemas: list[TableSchema],
+    manifest: dict[str, typing.Any] | None = None,
+    schema: str | None = None,
+    table_mode: TableMode = TableMode.STAGED,
+    jobs: int = DEFAULT_LOAD_JOBS,
+):
+    """Write the DDL and the load script next to the PGCOPY files
+
+    :param output_dir: output directory of the PGCOPY files
+    :param table_schemas: schemas of the tables, see `make_table_schemas`
+    :param manifest: manifest of the output, if there's one
+    :param schema: PostgreSQL schema of the tables, `search_path` is used if None
+    :param table_mode: whether the tables are created UNLOGGED
+    :param jobs: number of files to copy at the same time
+    """
+    create_statements = []
+    if schema is not None:
+        create_statements.append(
+            f"CREATE SCHEMA IF NOT EXISTS {quote_identifier(schema)};"
+        )
+    create_statements.extend(create_types_sql(schema))
+    create_statements.extend(create_tables_sql(table_schemas, schema, table_mode))
+    (output_dir / CREATE_TABLES_FILENAME).write_text(
+        "\n".join(create_statements) + "\n"
+    )
+    (output_dir / BUILD_CONSTRAINTS_FILENAME).write_text(
+        "\n".join(build_constraints_sql(table_schemas, schema, table_mode)) + "\n"
+    )
+    script_path = output_dir / LOAD_SCRIPT_FILENAME
+    script_path.write_text(
+        make_load_script(list_table_files(table_schemas, manifest), schema, jobs)
+    )
+    script_path.chmod(0o755)
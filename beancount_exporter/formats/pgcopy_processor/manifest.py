@@ -0,0 +1,67 @@
+import typing
+
+from .writers import ShardedTableWriter
+from .writers import TableWriter
+
+MANIFEST_FILENAME = "manifest.json"
+# hash of the table files, see `TableWriter.content_hash`
+HASH_ALGORITHM = "blake2b-128"
+
+
+def table_filenames(
+    table: str, shard_count: int = 1, partition: str | None = None
+) -> list[str]:
+    """File names of a table, like `{table}.bin`, `{table}.{index}.bin` for shards
+    and `{table}.{partition}.bin` for partitions
+
+    """
+    prefix = table if partition is None else f"{table}.{partition}"
+    if shard_count == 1:
+        return [f"{prefix}.bin"]
+    return [f"{prefix}.{index}.bin" for index in range(shard_count)]
+
+
+def make_manifest(
+    table_writers: list[tuple[str, str | None, TableWriter | ShardedTableWriter]],
+    **extra: typing.Any,
+) -> dict[str, typing.Any]:
+    """Make manifest of the output files with their row counts, sizes and hashes
+
+    :param table_writers: table name, partition and writer of tables, see
+        `PgCopyProcessor.table_writers`
+    :param extra: extra top level keys of the manifest
+    """
+    tables: dict[str, list[dict[str, typing.Any]]] = {}
+    for table, partition, writer in table_writers:
+        filenames = table_filenames(table, len(writer.shards), partition)
+        for filename, shard in zip(filenames, writer.shards):
+            file = dict(
+                file=filename,
+                row_count=shard.row_count,
+                byte_size=shard.byte_size,
+                content_hash=shard.content_hash,
+            )
+            if partition is not None:
+                file["partition"] = partition
+            tables.setdefault(table, []).append(file)
+    return dict(**extra, hash_algorithm=HASH_ALGORITHM, tables=tables)
+
+
+def unchanged_tables(
+    previous: dict[str, typing.Any], manifest: dict[str, typing.Any]
+) -> set[str]:
+    """Tables with exactly the same files as in the previous manifest, so that
+    loaders can skip reloading them
+
+    Hashes of different runs are comparable only with deterministic ids, like
+    `CONTENT` or `SEQUENCE` ids, as the ids are part of the rows.
+
+    """
+    if previous.get("hash_algorithm") != manifest.get("hash_algorithm"):
+        return set()
+    previous_tables = previous.get("tables", {})
+    return {
+        table
+        for table, files in manifest["tables"].items()
+        if previous_tables.get(table) == files
+    }
@@ -0,0 +1,158 @@
+import datetime
+import decimal
+import typing
+
+from .data_types import Column
+from .data_types import Table
+
+# Type category of the types meta values can be lifted into
+META_COLUMN_TYPE_CATEGORIES = {
+    "varchar": "S",
+    "int4": "N",
+    "int8": "N",
+    "numeric": "N",
+    "date": "D",
+    "bool": "B",
+}
+
+
+class MetaColumn(typing.NamedTuple):
+    # meta key, it's also the name of the column
+    key: str
+    # type name of the column, see `META_COLUMN_TYPE_CATEGORIES`
+    type_name: str
+
+
+# Meta keys every entry and posting has
+DEFAULT_META_COLUMNS = (
+    MetaColumn(key="filename", type_name="varchar"),
+    MetaColumn(key="lineno", type_name="int4"),
+)
+
+
+def parse_meta_column(value: str) -> MetaColumn:
+    """Parse a meta column like `receipt=varchar`"""
+    key, sep, type_name = value.partition("=")
+    key = key.strip()
+    type_name = type_name.strip()
+    if not sep or not key:
+        raise ValueError(f"Invalid meta column {value!r}, expected KEY=TYPE")
+    if type_name not in META_COLUMN_TYPE_CATEGORIES:
+        raise ValueError(
+            f"Unknown meta column type {type_name!r}, expected one of "
+            f"{', '.join(META_COLUMN_TYPE_CATEGORIES)}"
+        )
+    return MetaColumn(key=key, type_name=type_name)
+
+
+def make_meta_table(table: Table, meta_columns: tuple[MetaColumn, ...]) -> Table:
+    """Add columns of the meta values to a table with meta, the meta column becomes
+    nullable, as it's null when no other key is left
+
+    """
+    if not meta_columns:
+        return table
+    attnames = {column.attname for column in table}
+    columns = [
+        column._replace(not_null=False) if column.attname == "meta" else column
+        for column in table
+    ]
+    for meta_column in meta_columns:
+        if meta_column.key in attnames:
+            raise ValueError(f"Meta column {meta_column.key} is already a column")
+        attnames.add(meta_column.key)
+        columns.append(
+            Column(
+                attname=meta_column.key,
+                type_category=META_COLUMN_TYPE_CATEGORIES[meta_column.type_name],
+                type_name=meta_column.type_name,
+                type_mod=-1,
+                not_null=False,
+                typelem=0,
+            )
+        )
+    return tuple(columns)
+
+
+def _convert_varchar(value: typing.Any) -> str:
+    if not isinstance(value, str):
+        raise TypeError(f"{value!r} is not a string")
+    return value
+
+
+def _make_int_converter(bits: int) -> typing.Callable[[typing.Any], int]:
+    lower = -(1 << (bits - 1))
+    upper = 1 << (bits - 1)
+
+    def convert_int(value: typing.Any) -> int:
+        if isinstance(value, bool) or not isinstance(value, (int, decimal.Decimal)):
+            raise TypeError(f"{value!r} is not an integer")
+        integer = int(value)
+        if integer != value or not lower <= integer < upper:
+            raise ValueError(f"{value!r} doesn't fit in int{bits // 8}")
+        return integer
+
+    return convert_int
+
+
+def _convert_numeric(value: typing.Any) -> decimal.Decimal:
+    if isinstance(value, bool) or not isinstance(value, (int, decimal.Decimal)):
+        raise TypeError(f"{value!r} is not a number")
+    return decimal.Decimal(value)
+
+
+def _convert_date(value: typing.Any) -> datetime.date:
+    if isinstance(value, datetime.datetime) or not isinstance(value, datetime.date):
+        raise TypeError(f"{value!r} is not a date")
+    return value
+
+
+def _convert_bool(value: typing.Any) -> bool:
+    if not isinstance(value, bool):
+        raise TypeError(f"{value!r} is not a bool")
+    return value
+
+
+META_COLUMN_CONVERTERS: dict[str, typing.Callable[[typing.Any], typing.Any]] = {
+    "varchar": _convert_varchar,
+    "int4": _make_int_converter(32),
+    "int8": _make_int_converter(64),
+    "numeric": _convert_numeric,
+    "date": _convert_date,
+    "bool": _convert_bool,
+}
+
+
+class MetaSplitter:
+    """Lifts values of meta columns out of meta
+
+    Values not fitting the type of their column are left in meta, so that nothing
+    is lost, and their column is null.
+
+    """
+
+    def __init__(self, meta_columns: tuple[MetaColumn, ...]):
+        self.meta_columns = meta_columns
+        self._converters = [
+            (meta_column.key, META_COLUMN_CONVERTERS[meta_column.type_name])
+            for meta_column in meta_columns
+        ]
+        self.empty_values = (None,) * len(meta_columns)
+
+    def split(self, meta: dict[str, typing.Any]) -> tuple:
+        """Remove the lifted values from meta, and return them in the order of the
+        columns
+
+        """
+        values = []
+        for key, convert in self._converters:
+            value = meta.get(key)
+            if value is not None:
+                try:
+                    value = convert(value)
+                except (TypeError, ValueError):
+                    values.append(None)
+                    continue
+            meta.pop(key, None)
+            values.append(value)
+        return tuple(values)
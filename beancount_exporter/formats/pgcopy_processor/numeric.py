@@ -0,0 +1,97 @@
+import decimal
+import functools
+import struct
+import typing
+
+# size, number of base-10000 digits, weight, sign, display scale
+_HEADER = struct.Struct(">ihhHH")
+_HEADER_SIZE = _HEADER.size - 4
+_SINGLE_DIGIT = struct.Struct(">ihhHHH")
+NUMERIC_POS = 0x0000
+NUMERIC_NEG = 0x4000
+NUMERIC_NAN = 0xC000
+# pgcopy encodes NaN and infinities all as NaN
+NAN_FIELD = _HEADER.pack(_HEADER_SIZE, 0, 0, NUMERIC_NAN, 0)
+NBASE = 10000
+DEC_DIGITS = 4
+_POW10 = (1, 10, 100, 1000)
+# stay well below the int max str digits limit
+MAX_STR_DIGITS = 1000
+
+
+@functools.lru_cache(maxsize=None)
+def _get_struct(ndigits: int) -> struct.Struct:
+    return struct.Struct(f">ihhHH{ndigits}H")
+
+
+def _encode(sign: int, coefficient: int, exponent: int) -> bytes:
+    dscale = -exponent if exponent < 0 else 0
+    # align the lowest digit to the base-10000 digit boundary
+    shift = exponent % DEC_DIGITS
+    if shift:
+        coefficient *= _POW10[shift]
+    weight = exponent // DEC_DIGITS
+    if not coefficient:
+        return _HEADER.pack(_HEADER_SIZE, 0, weight, sign, dscale)
+    # trailing zero digit groups are not stored, only reflected in the weight
+    while not coefficient % NBASE:
+        coefficient //= NBASE
+        weight += 1
+    if coefficient < NBASE:
+        # the common case of beancount numbers, like 5.99 or 123.45
+        return _SINGLE_DIGIT.pack(
+            _HEADER_SIZE + 2, 1, weight, sign, dscale, coefficient
+        )
+    digits = []
+    while coefficient:
+        coefficient, digit = divmod(coefficient, NBASE)
+        digits.append(digit)
+    digits.reverse()
+    ndigits = len(digits)
+    return _get_struct(ndigits).pack(
+        _HEADER_SIZE + 2 * ndigits,
+        ndigits,
+        weight + ndigits - 1,
+        sign,
+        dscale,
+        *digits,
+    )
+
+
+def _encode_numeric_tuple(value: typing.Any) -> bytes:
+    try:
+        sign, digits, exponent = value.as_tuple()
+    except AttributeError:
+        raise TypeError("numeric field requires Decimal value (got %r)" % value)
+    if isinstance(exponent, str):
+        # NaN, Inf, -Inf
+        return NAN_FIELD
+    coefficient = 0
+    for digit in digits:
+        coefficient = coefficient * 10 + digit
+    return _encode(sign * NUMERIC_NEG, coefficient, exponent)
+
+
+def encode_numeric(value: decimal.Decimal) -> bytes:
+    """Encode decimal value as PostgreSQL numeric field in PGCOPY binary format,
+    including the length prefix. The output is identical to `pgcopy.copy.numeric`.
+
+    Plain notation decimals, which are what beancount produces, are decomposed from
+    their string form. Values in exponent notation, NaN and infinities go through
+    `Decimal.as_tuple` instead.
+
+    :param value: decimal value to encode
+    :return: encoded field
+    """
+    if type(value) is not decimal.Decimal:
+        return _encode_numeric_tuple(value)
+    text = str(value)
+    sign = NUMERIC_POS
+    if text[0] == "-":
+        sign = NUMERIC_NEG
+        text = text[1:]
+    integer, _, fraction = text.partition(".")
+    digits = integer + fraction
+    if len(digits) > MAX_STR_DIGITS or not digits.isdigit():
+        return _encode_numeric_tuple(value)
+    return _encode(sign, int(digits), -len(fraction))
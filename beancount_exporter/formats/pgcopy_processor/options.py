@@ -0,0 +1,51 @@
+import typing
+
+from .meta_columns import MetaColumn
+from .sorting import DEFAULT_SORT_BUFFER_SIZE
+from .sorting import SortKeys
+from .writers import DEFAULT_FLUSH_SIZE
+from .writers import DEFAULT_MAX_PENDING_CHUNKS
+from .writers import PartitionBy
+from .writers import ShardKey
+
+
+class PgCopyOptions(typing.NamedTuple):
+    """Options of how `PgCopyProcessor` encodes and writes the rows"""
+
+    # encode rows with compiled row encoders instead of per-column formatters
+    use_row_encoders: bool = True
+    # max number of encoded values cached by the row encoders, 0 disables the cache
+    value_cache_size: int = 0
+    # flush size of table buffers in bytes
+    flush_size: int = DEFAULT_FLUSH_SIZE
+    # write flushed buffers on a background thread
+    background_writes: bool = False
+    # max number of flushed buffers waiting for the background thread
+    max_pending_chunks: int = DEFAULT_MAX_PENDING_CHUNKS
+    # number of worker processes encoding rows, delta, sorted output and background
+    # writes don't work with multiple jobs
+    jobs: int = 1
+    # how rows are split into the shards of a table
+    shard_key: ShardKey = ShardKey.TRANSACTION_ID
+    # split rows into partitions by the date of entries, postings go with their
+    # transactions
+    partition_by: PartitionBy | None = None
+    # number of shard files of each table in each partition
+    partition_shards: int = 1
+    # write identical bytes for identical input, keys of JSON values are sorted,
+    # and so are sets within them. It requires a deterministic id allocator
+    reproducible: bool = False
+    # column names rows of each table are sorted by, keyed by table name, like
+    # `{"posting": ("account", "date")}`. The `date` of tables without such a
+    # column is the date of the entry
+    sort_keys: SortKeys | None = None
+    # bytes of rows each sorted table holds in memory before spilling them into a
+    # run file under `spill_dir`
+    sort_buffer_size: int = DEFAULT_SORT_BUFFER_SIZE
+    spill_dir: str | None = None
+    # replace accounts, currencies and source files in rows with int8 keys of
+    # dimension tables, see `dimensions.DIMENSION_COLUMNS`
+    normalize: bool = False
+    # meta keys lifted into columns of entry_base and posting, meta is null when no
+    # other key is left
+    meta_columns: tuple[MetaColumn, ...] = ()
@@ -0,0 +1,153 @@
+import io
+import itertools
+import multiprocessing.context
+import typing
+
+from beancount.core import data
+
+from .dimensions import DimensionNames
+from .ids import IdAllocator
+
+# Number of chunks per worker process, more chunks balance the load better at the
+# cost of more round trips between the processes
+CHUNKS_PER_JOB = 4
+
+
+class ChunkTask(typing.NamedTuple):
+    start: int
+    stop: int
+    # number of ids allocated for the entries before the chunk
+    id_offset: int
+    # entries of the chunk, only shipped to the worker when it can't share the
+    # entries of the parent process by forking
+    entries: data.Entries | None = None
+
+
+# Partition, key of table, and encoded rows and row count of each shard, see
+# `PgCopyProcessor.keyed_writers`
+EncodedChunk = list[tuple[str | None, typing.Hashable, list[tuple[bytes, int]]]]
+
+
+# Creates a processor writing into the given files, `PgCopyProcessor` with the
+# config of the parent processor bound
+ProcessorFactory = typing.Callable[..., typing.Any]
+
+
+def count_ids(entry: data.Directive) -> int:
+    """Number of ids allocated for an entry and its postings"""
+    if isinstance(entry, data.Transaction):
+        return 1 + len(entry.postings)
+    return 1
+
+
+def split_chunks(entries: data.Entries, count: int) -> list[tuple[int, int]]:
+    """Split entries into about `count` chunks of consecutive entries
+
+    The end of each chunk is moved forward to the next date change, so that entries
+    on the same date stay in the same chunk. Entries are sorted by date, and
+    entries with identical content always have the same date, so duplicates told
+    apart by `ContentAllocator` end up in the same chunk.
+
+    """
+    size = max(1, -(-len(entries) // max(count, 1)))
+    chunks = []
+    start = 0
+    while start < len(entries):
+        stop = min(start + size, len(entries))
+        while stop < len(entries) and entries[stop].date == entries[stop - 1].date:
+            stop += 1
+        chunks.append((start, stop))
+        start = stop
+    return chunks
+
+
+def make_tasks(
+    entries: data.Entries, count: int, ship_entries: bool
+) -> list[ChunkTask]:
+    chunks = split_chunks(entries, count)
+    id_offsets = itertools.accumulate(
+        (sum(map(count_ids, entries[start:stop])) for start, stop in chunks[:-1]),
+        initial=0,
+    )
+    return [
+        ChunkTask(
+            start=start,
+            stop=stop,
+            id_offset=id_offset,
+            entries=entries[start:stop] if ship_entries else None,
+        )
+        for (start, stop), id_offset in zip(chunks, id_offsets)
+    ]
+
+
+def get_context() -> tuple[multiprocessing.context.BaseContext, bool]:
+    """Multiprocessing context for the workers, and whether the workers share the
+    entries of the parent process by forking (copy-on-write)
+
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork"), True
+    return multiprocessing.get_context(), False
+
+
+_worker_state: tuple[
+    ProcessorFactory, IdAllocator, dict[typing.Hashable, int], data.Entries | None
+] | None = None
+
+
+def init_worker(
+    make_processor: ProcessorFactory,
+    id_allocator: IdAllocator,
+    shard_counts: dict[typing.Hashable, int],
+    entries: data.Entries | None,
+):
+    """
+    :param shard_counts: number of shards of tables keyed like the writers of
+        `PgCopyProcessor`, empty with partitioning
+    """
+    global _worker_state
+    _worker_state = (make_processor, id_allocator, shard_counts, entries)
+
+
+def make_files(shard_count: int) -> io.BytesIO | list[io.BytesIO]:
+    if shard_count == 1:
+        return io.BytesIO()
+    return [io.BytesIO() for _ in range(shard_count)]
+
+
+def make_partition_files(
+    shard_count: int, table: str, partition: str
+) -> io.BytesIO | list[io.BytesIO]:
+    return make_files(shard_count)
+
+
+def encode_chunk(task: ChunkTask) -> tuple[EncodedChunk, DimensionNames]:
+    """Encode rows of a chunk of entries without the PGCOPY header and trailer
+
+    :return: the encoded chunk, and the names of each dimension seen in the chunk,
+        see `PgCopyProcessor.dimension_names`
+    """
+    assert _worker_state is not None
+    make_processor, id_allocator, shard_counts, shared_entries = _worker_state
+    entries = task.entries
+    if entries is None:
+        entries = shared_entries[task.start : task.stop]
+    files = {key: make_files(shard_count) for key, shard_count in shard_counts.items()}
+    processor = make_processor(
+        entry_base_file=files.pop("entry_base", None),
+        posting_file=files.pop("posting", None),
+        entry_files=files,
+        id_allocator=id_allocator.fork(task.id_offset),
+    )
+    processor.process_entries(entries)
+    chunk = []
+    for partition, key, writer in processor.keyed_writers:
+        writer.flush()
+        chunk.append(
+            (
+                partition,
+                key,
+                [(shard.file.getvalue(), shard.row_count) for shard in writer.shards],
+            )
+        )
+    return chunk, processor.dimension_names()
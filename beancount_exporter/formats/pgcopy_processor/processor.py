@@ -2,10 +2,8 @@ import functools
 import io
 import pathlib
 import typing
-import uuid
 
 import orjson
-import pgcopy
 from beancount.core import data
 from beancount.loader import LoadError
 from beancount_data.data_types import EntryType
@@ -14,16 +12,59 @@ from beancount_data.data_types import ValidationError
 from beancount_data.data_types import ValidationResult
 
 from ..processor import Processor
+from .cache import EncodedValueCache
 from .configs import ENTRY_TYPE_CONFIGS
 from .configs import EntryTypeConfig
 from .data_types import Table
+from .delta import DeltaTracker
+from .dimensions import Dimension
+from .dimensions import DimensionNames
+from .dimensions import make_dictionaries
+from .dimensions import make_normalizer
+from .dimensions import normalize_meta_columns
+from .dimensions import normalize_table
+from .encoders import compile_row_encoder
+from .encoders import RowEncoder
+from .ids import EntryId
+from .ids import IdAllocator
+from .ids import Uuid4Allocator
+from .meta_columns import make_meta_table
+from .meta_columns import MetaSplitter
+from .options import PgCopyOptions
+from .parallel import CHUNKS_PER_JOB
+from .parallel import count_ids
+from .parallel import encode_chunk
+from .parallel import get_context
+from .parallel import init_worker
+from .parallel import make_partition_files
+from .parallel import make_tasks
+from .parallel import ProcessorFactory
+from .sorting import check_sort_keys
+from .sorting import make_sort_key_getter
+from .sorting import SortingTableWriter
+from .tables import DIMENSION_TABLE
+from .tables import ENTRY_BASE_KEY
 from .tables import ENTRY_BASE_TABLE
+from .tables import POSTING_KEY
 from .tables import POSTING_TABLE
+from .tables import replace_id_type
 from .utils import compile_formatter
 from .utils import convert_custom_value
 from .utils import orjson_default
 from .utils import orjson_option_maps_default
+from .utils import orjson_reproducible_default
 from .utils import serialize_row
+from .writers import BackgroundWriter
+from .writers import LazyWriters
+from .writers import partition_of
+from .writers import ShardedTableWriter
+from .writers import ShardKey
+from .writers import TableWriter
+
+# A file, or a list of shard files of a table
+TableFiles = io.BytesIO | list[io.BytesIO]
+# Opens files of a table in a partition
+PartitionFilesOpener = typing.Callable[[str, str], TableFiles]
 
 
 class PgCopyProcessor(Processor):
@@ -32,16 +73,33 @@ class PgCopyProcessor(Processor):
         base_path: pathlib.Path,
         option_maps_file: io.BytesIO,
         errors_file: io.BytesIO,
-        entry_base_file: io.BytesIO,
-        posting_file: io.BytesIO,
-        entry_files: dict[typing.Type, io.BytesIO],
+        entry_base_file: TableFiles | None = None,
+        posting_file: TableFiles | None = None,
+        entry_files: dict[typing.Type, TableFiles] | None = None,
         entry_base_table: Table = ENTRY_BASE_TABLE,
         posting_table: Table = POSTING_TABLE,
         entry_configs: dict[typing.Type, EntryTypeConfig] | None = None,
         encoding: str = "utf8",
         strip_paths: bool = True,
         path_cache: dict[str, str] | None = None,
+        id_allocator: IdAllocator | None = None,
+        options: PgCopyOptions = PgCopyOptions(),
+        open_partition_files: PartitionFilesOpener | None = None,
+        delta: DeltaTracker | None = None,
+        dimension_files: dict[Dimension, TableFiles] | None = None,
     ):
+        """
+        :param options: options of how rows are encoded and written, see
+            `PgCopyOptions`
+        :param open_partition_files: opens files of each table in each partition
+            by `open_partition_files(table_name, partition)` when they are first
+            used, instead of the given table files, with `options.partition_by`.
+            It returns `options.partition_shards` shard files for each table
+        :param delta: write only the rows of entries changed since the previous
+            export, it doesn't work with multiple jobs
+        :param dimension_files: files of the dimension tables written by a
+            normalizing processor, they are written when the processor stops
+        """
         super().__init__(
             base_path=base_path, strip_paths=strip_paths, path_cache=path_cache
         )
@@ -49,24 +107,183 @@ class PgCopyProcessor(Processor):
         self.errors_file = errors_file
         self.entry_base_file = entry_base_file
         self.posting_file = posting_file
-        self.entry_files = entry_files
-        self.entry_base_table = entry_base_table
-        self.posting_table = posting_table
-        self.entry_configs = entry_configs or ENTRY_TYPE_CONFIGS
+        self.entry_files = entry_files or {}
+        self.options = options
+        self.flush_size = options.flush_size
+        if options.background_writes and options.jobs > 1:
+            # worker processes are forked, which isn't safe while the writer thread
+            # holds its locks
+            raise ValueError("Background writes don't work with multiple jobs")
+        self.background_writer = (
+            BackgroundWriter(max_pending_chunks=options.max_pending_chunks)
+            if options.background_writes
+            else None
+        )
+        self.shard_key = options.shard_key
+        self._posting_key_is_transaction_id = self.shard_key == ShardKey.TRANSACTION_ID
+        self.partition_by = options.partition_by
+        self.open_partition_files = open_partition_files
+        self.partition_shards = options.partition_shards
+        if delta is not None and options.jobs > 1:
+            raise ValueError("Delta export doesn't work with multiple jobs")
+        self.delta = delta
+        if options.sort_keys and options.jobs > 1:
+            raise ValueError("Sorted output doesn't work with multiple jobs")
+        self.sort_keys = options.sort_keys or {}
+        self.sort_buffer_size = options.sort_buffer_size
+        self.spill_dir = options.spill_dir
+        self._started = False
+        self.id_allocator = id_allocator or Uuid4Allocator()
+        if options.reproducible and not self.id_allocator.deterministic:
+            raise ValueError("Reproducible export requires deterministic ids")
+        self.reproducible = options.reproducible
+        self._json_option = orjson.OPT_SORT_KEYS if self.reproducible else 0
+        id_type = self.id_allocator.type_name
+        self.entry_base_table = replace_id_type(entry_base_table, id_type)
+        self.posting_table = replace_id_type(posting_table, id_type)
+        self.entry_configs = {
+            key: config._replace(table=replace_id_type(config.table, id_type))
+            for key, config in (entry_configs or ENTRY_TYPE_CONFIGS).items()
+        }
+        tables = {
+            ENTRY_BASE_KEY: self.entry_base_table,
+            POSTING_KEY: self.posting_table,
+            **{key: config.table for key, config in self.entry_configs.items()},
+        }
+        self.normalize = options.normalize
+        self.dictionaries = make_dictionaries() if self.normalize else None
+        # normalizers of the tables with dimension values keyed like the writers
+        self._normalizers = {}
+        if self.dictionaries is not None:
+            for key, table in tables.items():
+                normalizer = make_normalizer(
+                    self._table_name(key), table, self.dictionaries
+                )
+                if normalizer is not None:
+                    self._normalizers[key] = normalizer
+            tables = {
+                key: normalize_table(self._table_name(key), table)
+                for key, table in tables.items()
+            }
+        self.meta_columns = options.meta_columns
+        lifted_meta_columns = (
+            normalize_meta_columns(self.meta_columns)
+            if self.normalize
+            else self.meta_columns
+        )
+        self._meta_splitter = (
+            MetaSplitter(lifted_meta_columns) if lifted_meta_columns else None
+        )
+        # meta is written as it is, without anything lifted out of it
+        self._plain_meta = self._meta_splitter is None and self.dictionaries is None
+        for key in (ENTRY_BASE_KEY, POSTING_KEY):
+            tables[key] = make_meta_table(tables[key], lifted_meta_columns)
+        # tables of the rows written keyed like the writers, they differ from the
+        # configured tables when normalizing
+        self.tables = tables
+        check_sort_keys(
+            self.sort_keys,
+            {self._table_name(key): table for key, table in tables.items()},
+        )
+        # sort key getters keyed like the writers, only for the sorted tables
+        self._sort_key_getters = {
+            key: make_sort_key_getter(table, self.sort_keys[self._table_name(key)])
+            for key, table in tables.items()
+            if self._table_name(key) in self.sort_keys
+        }
+        # writers of each partition keyed by ENTRY_BASE_KEY, POSTING_KEY or the
+        # entry type, the only partition is None without partitioning
+        self._partitions: dict[
+            str | None, dict[typing.Hashable, TableWriter | ShardedTableWriter]
+        ] = {}
+        # writers of the partition of the entry being processed
+        self._writers: dict[typing.Hashable, TableWriter | ShardedTableWriter] = {}
+        if self.partition_by is None:
+            self._writers = self._partitions[None] = {
+                ENTRY_BASE_KEY: self._make_writer(entry_base_file, ENTRY_BASE_KEY),
+                POSTING_KEY: self._make_writer(posting_file, POSTING_KEY),
+                **{
+                    entry_type: self._make_writer(entry_file, entry_type)
+                    for entry_type, entry_file in self.entry_files.items()
+                },
+            }
+        self._dimension_writers = {
+            dimension: self._make_writer(files, dimension)
+            for dimension, files in (dimension_files or {}).items()
+        }
         self.encoding = encoding
-        self._entry_base_formatters = self._compile_formatters(self.entry_base_table)
-        self._posting_formatters = self._compile_formatters(self.posting_table)
-        self._formatters = {
-            key: self._compile_formatters(config.table)
-            for key, config in self.entry_configs.items()
+        self.use_row_encoders = options.use_row_encoders
+        self.jobs = options.jobs
+        self.value_cache = (
+            EncodedValueCache(maxsize=options.value_cache_size)
+            if self.use_row_encoders and options.value_cache_size > 0
+            else None
+        )
+        self._entry_base_encoder = self._compile_encoder(tables[ENTRY_BASE_KEY])
+        self._posting_encoder = self._compile_encoder(tables[POSTING_KEY])
+        self._encoders = {
+            key: self._compile_encoder(tables[key]) for key in self.entry_configs
         }
+        self._dimension_encoder = self._compile_encoder(DIMENSION_TABLE)
+
+    def _make_writer(
+        self, files: TableFiles, key: typing.Hashable
+    ) -> TableWriter | ShardedTableWriter | SortingTableWriter:
+        make_writer = functools.partial(
+            TableWriter,
+            flush_size=self.flush_size,
+            background_writer=self.background_writer,
+        )
+        if not isinstance(files, list):
+            writer = make_writer(files)
+        else:
+            writer = ShardedTableWriter(list(map(make_writer, files)), self.shard_key)
+        if key not in self._sort_key_getters:
+            return writer
+        return SortingTableWriter(
+            writer, buffer_size=self.sort_buffer_size, spill_dir=self.spill_dir
+        )
+
+    def _table_name(self, key: typing.Hashable) -> str:
+        if isinstance(key, str):
+            # plain str of `Dimension` keys
+            return str(key)
+        return self.entry_configs[key].type.value
+
+    def _open_writer(
+        self, partition: str, key: typing.Hashable
+    ) -> TableWriter | ShardedTableWriter:
+        writer = self._make_writer(
+            self.open_partition_files(self._table_name(key), partition), key
+        )
+        if self._started:
+            writer.start()
+        return writer
+
+    def _partition_writers(
+        self, partition: str | None
+    ) -> dict[typing.Hashable, TableWriter | ShardedTableWriter]:
+        writers = self._partitions.get(partition)
+        if writers is None:
+            writers = self._partitions[partition] = LazyWriters(
+                functools.partial(self._open_writer, partition)
+            )
+        return writers
 
     def _compile_formatters(self, table: Table) -> list[typing.Callable]:
         return list(map(functools.partial(compile_formatter, self.encoding), table))
 
+    def _compile_encoder(self, table: Table) -> RowEncoder:
+        if self.use_row_encoders:
+            return compile_row_encoder(
+                self.encoding, table, value_cache=self.value_cache
+            )
+        # generic per-column formatter chain
+        return functools.partial(serialize_row, self._compile_formatters(table))
+
     def _extract_entry(
         self,
-        id: uuid.UUID,
+        id: EntryId,
         entry_type: EntryType,
         entry: data.Union,
     ) -> tuple:
@@ -78,37 +295,71 @@ class PgCopyProcessor(Processor):
             id,
             entry_type.name,
             entry.date,
-            orjson.dumps(meta, default=orjson_default),
+            *self._meta_values(meta),
+        )
+
+    def _meta_values(self, meta: dict[str, typing.Any] | None) -> tuple:
+        """Values of the meta column and the columns following it, that is
+        `source_file_id` when normalizing, then the meta columns
+
+        """
+        if self._plain_meta:
+            return (
+                orjson.dumps(meta, default=orjson_default, option=self._json_option),
+            )
+        source_file = None
+        lifted = () if self._meta_splitter is None else self._meta_splitter.empty_values
+        if meta is not None:
+            meta = meta.copy()
+            if self.dictionaries is not None:
+                source_file = meta.pop("filename", None)
+            if self._meta_splitter is not None:
+                lifted = self._meta_splitter.split(meta)
+        meta_value = (
+            None
+            if self._meta_splitter is not None and not meta
+            else orjson.dumps(meta, default=orjson_default, option=self._json_option)
+        )
+        if self.dictionaries is None:
+            return (meta_value, *lifted)
+        return (
+            meta_value,
+            self.dictionaries[Dimension.SOURCE_FILE].key(source_file)
+            if source_file is not None
+            else None,
+            *lifted,
         )
 
-    def _extract_open(self, id: uuid.UUID, entry: data.Open) -> tuple:
+    def _extract_open(self, id: EntryId, entry: data.Open) -> tuple:
         return (
             id,
             entry.account,
-            entry.currencies,
+            # sorted like tags and links, so that the array doesn't depend on the
+            # order currencies are declared in
+            sorted(entry.currencies) if entry.currencies is not None else None,
             entry.booking.value if entry.booking is not None else None,
         )
 
-    def _extract_close(self, id: uuid.UUID, entry: data.Close) -> tuple:
+    def _extract_close(self, id: EntryId, entry: data.Close) -> tuple:
         return (
             id,
             entry.account,
         )
 
-    def _extract_commodity(self, id: uuid.UUID, entry: data.Commodity) -> tuple:
+    def _extract_commodity(self, id: EntryId, entry: data.Commodity) -> tuple:
         return (
             id,
             entry.currency,
         )
 
-    def _extract_pad(self, id: uuid.UUID, entry: data.Pad) -> tuple:
+    def _extract_pad(self, id: EntryId, entry: data.Pad) -> tuple:
         return (
             id,
             entry.account,
             entry.source_account,
         )
 
-    def _extract_balance(self, id: uuid.UUID, entry: data.Balance) -> tuple:
+    def _extract_balance(self, id: EntryId, entry: data.Balance) -> tuple:
         return (
             id,
             entry.account,
@@ -119,33 +370,33 @@ class PgCopyProcessor(Processor):
             entry.diff_amount.currency if entry.diff_amount is not None else None,
         )
 
-    def _extract_transaction(self, id: uuid.UUID, entry: data.Transaction) -> tuple:
+    def _extract_transaction(self, id: EntryId, entry: data.Transaction) -> tuple:
         return (
             id,
             entry.flag,
             entry.payee,
             entry.narration,
-            # pgcopy doesn't recognize frozenset
-            # TODO: fix that issue in the upstream
-            set(entry.tags),
-            set(entry.links),
+            # pgcopy doesn't recognize frozenset, and sorting makes the order of
+            # the array independent of the hash seed
+            sorted(entry.tags),
+            sorted(entry.links),
         )
 
-    def _extract_note(self, id: uuid.UUID, entry: data.Note) -> tuple:
+    def _extract_note(self, id: EntryId, entry: data.Note) -> tuple:
         return (
             id,
             entry.account,
             entry.comment,
         )
 
-    def _extract_event(self, id: uuid.UUID, entry: data.Event) -> tuple:
+    def _extract_event(self, id: EntryId, entry: data.Event) -> tuple:
         return (
             id,
             entry.type,
             entry.description,
         )
 
-    def _extract_price(self, id: uuid.UUID, entry: data.Price) -> tuple:
+    def _extract_price(self, id: EntryId, entry: data.Price) -> tuple:
         return (
             id,
             entry.currency,
@@ -153,18 +404,18 @@ class PgCopyProcessor(Processor):
             entry.amount.currency,
         )
 
-    def _extract_document(self, id: uuid.UUID, entry: data.Document) -> tuple:
+    def _extract_document(self, id: EntryId, entry: data.Document) -> tuple:
         return (
             id,
             entry.account,
             self.strip_path(entry.filename),
-            # pgcopy doesn't recognize frozenset
-            # TODO: fix that issue in the upstream
-            set(entry.tags),
-            set(entry.links),
+            # pgcopy doesn't recognize frozenset, and sorting makes the order of
+            # the array independent of the hash seed
+            sorted(entry.tags),
+            sorted(entry.links),
         )
 
-    def _extract_custom(self, id: uuid.UUID, entry: data.Custom) -> tuple:
+    def _extract_custom(self, id: EntryId, entry: data.Custom) -> tuple:
         return (
             id,
             entry.type,
@@ -172,7 +423,7 @@ class PgCopyProcessor(Processor):
         )
 
     def _extract_posting(
-        self, id: uuid.UUID, transaction_id: uuid.UUID, posting: data.Posting
+        self, id: EntryId, transaction_id: EntryId, posting: data.Posting
     ) -> tuple:
         if isinstance(posting.cost, data.CostSpec):
             cost_spec = (
@@ -204,31 +455,116 @@ class PgCopyProcessor(Processor):
             posting.cost.label if posting.cost is not None else None,
             *cost_spec,
             posting.flag,
-            orjson.dumps(meta, default=orjson_default),
+            *self._meta_values(meta),
         )
 
-    def _process_transaction(self, transaction_id: uuid.UUID, entry: data.Transaction):
-        for posting in entry.postings:
-            posting_values = self._extract_posting(
-                uuid.uuid4(), transaction_id, posting
-            )
-            self.posting_file.write(
-                serialize_row(self._posting_formatters, posting_values)
+    def _process_transaction(self, transaction_id: EntryId, entry: data.Transaction):
+        posting_ids = self.id_allocator.posting_ids(entry, transaction_id)
+        get_sort_key = self._sort_key_getters.get(POSTING_KEY)
+        normalize = self._normalizers.get(POSTING_KEY)
+        for posting_id, posting in zip(posting_ids, entry.postings):
+            posting_values = self._extract_posting(posting_id, transaction_id, posting)
+            if normalize is not None:
+                posting_values = normalize(posting_values)
+            self._writers[POSTING_KEY].write(
+                self._posting_encoder(posting_values),
+                transaction_id if self._posting_key_is_transaction_id else posting_id,
+                get_sort_key(posting_values, entry.date)
+                if get_sort_key is not None
+                else (),
             )
 
     @property
-    def all_files(self) -> tuple[io.BytesIO, ...]:
+    def all_files(self) -> tuple[TableFiles, ...]:
         return self.entry_base_file, self.posting_file, *self.entry_files.values()
 
+    @property
+    def all_writers(self) -> tuple[TableWriter | ShardedTableWriter, ...]:
+        return (
+            *(
+                writer
+                for writers in self._partitions.values()
+                for writer in writers.values()
+            ),
+            *self._dimension_writers.values(),
+        )
+
+    @property
+    def keyed_writers(
+        self,
+    ) -> list[tuple[str | None, typing.Hashable, TableWriter | ShardedTableWriter]]:
+        """Partition, key and writer of all tables in all partitions, dimension
+        tables are keyed by their `Dimension` without partition
+
+        """
+        return [
+            *(
+                (partition, key, writer)
+                for partition, writers in self._partitions.items()
+                for key, writer in writers.items()
+            ),
+            *(
+                (None, dimension, writer)
+                for dimension, writer in self._dimension_writers.items()
+            ),
+        ]
+
+    @property
+    def table_writers(
+        self,
+    ) -> list[tuple[str, str | None, TableWriter | ShardedTableWriter]]:
+        """Table name, partition and writer of all tables in all partitions"""
+        return [
+            (self._table_name(key), partition, writer)
+            for partition, key, writer in self.keyed_writers
+        ]
+
     def start(self):
-        for pgcopy_file in self.all_files:
-            pgcopy_file.write(pgcopy.copy.BINCOPY_HEADER)
+        if self.background_writer is not None:
+            self.background_writer.start()
+        for writer in self.all_writers:
+            writer.start()
+        self._started = True
+
+    def dimension_names(self) -> DimensionNames:
+        """Names seen in each dimension so far, empty without normalizing"""
+        if self.dictionaries is None:
+            return {}
+        return {
+            dimension: list(dictionary.keys)
+            for dimension, dictionary in self.dictionaries.items()
+        }
+
+    def add_dimension_names(self, names: DimensionNames):
+        """Add names seen by another processor, like the ones of the workers"""
+        for dimension, dimension_names in names.items():
+            add_name = self.dictionaries[dimension].key
+            for name in dimension_names:
+                add_name(name)
+
+    def _write_dimensions(self):
+        for dimension, writer in self._dimension_writers.items():
+            for name, key in self.dictionaries[dimension].keys.items():
+                writer.write(self._dimension_encoder((key, name)), key)
 
     def stop(self):
-        for pgcopy_file in self.all_files:
-            pgcopy_file.write(pgcopy.copy.BINCOPY_TRAILER)
+        self._write_dimensions()
+        for writer in self.all_writers:
+            writer.stop()
+        if self.background_writer is not None:
+            # trailers are queued after all the rows, wait for them to be written
+            self.background_writer.stop()
 
     def process_options(self, options: dict[str, typing.Any]):
+        if self.reproducible:
+            self.option_maps_file.write(
+                orjson.dumps(
+                    options,
+                    default=orjson_reproducible_default,
+                    option=orjson.OPT_SORT_KEYS,
+                )
+            )
+            return
         self.option_maps_file.write(
             orjson.dumps(options, default=orjson_option_maps_default)
         )
@@ -252,9 +588,71 @@ class PgCopyProcessor(Processor):
                         if posting_filename is None:
                             continue
                         posting.meta["filename"] = self.strip_path(posting_filename)
+        if self.reproducible:
+            # pydantic writes sets in their iteration order, which depends on the
+            # hash seed
+            self.errors_file.write(
+                orjson.dumps(
+                    validation_result.dict(),
+                    default=orjson_reproducible_default,
+                    option=orjson.OPT_SORT_KEYS,
+                )
+            )
+            return
         self.errors_file.write(validation_result.json().encode("utf8"))
 
+    def _chunk_processor_factory(self) -> ProcessorFactory:
+        return functools.partial(
+            type(self),
+            base_path=self.base_path,
+            option_maps_file=None,
+            errors_file=None,
+            entry_base_table=self.entry_base_table,
+            posting_table=self.posting_table,
+            entry_configs=self.entry_configs,
+            encoding=self.encoding,
+            strip_paths=self.strip_paths,
+            path_cache=self.path_cache,
+            # rows of a chunk are encoded on the worker's own thread, the parent
+            # writes them
+            options=self.options._replace(jobs=1, background_writes=False),
+            open_partition_files=functools.partial(
+                make_partition_files, self.partition_shards
+            ),
+        )
+
+    def _process_entries_parallel(self, entries: data.Entries):
+        context, share_entries = get_context()
+        tasks = make_tasks(
+            entries, self.jobs * CHUNKS_PER_JOB, ship_entries=not share_entries
+        )
+        with context.Pool(
+            self.jobs,
+            initializer=init_worker,
+            initargs=(
+                self._chunk_processor_factory(),
+                self.id_allocator,
+                {
+                    key: len(writer.shards)
+                    for key, writer in self._partitions.get(None, {}).items()
+                },
+                entries if share_entries else None,
+            ),
+        ) as pool:
+            # chunks come back in order, so they are concatenated in entry order
+            for chunk, dimension_names in pool.imap(encode_chunk, tasks):
+                self.add_dimension_names(dimension_names)
+                for partition, key, encoded_shards in chunk:
+                    writer = self._partition_writers(partition)[key]
+                    for shard, (rows, row_count) in zip(writer.shards, encoded_shards):
+                        shard.write_rows(rows, row_count)
+        # continue after the ids allocated by the workers
+        self.id_allocator = self.id_allocator.fork(sum(map(count_ids, entries)))
+
     def process_entries(self, entries: data.Entries):
+        if self.jobs > 1 and len(entries) > 1:
+            self._process_entries_parallel(entries)
+            return
         extractors = {
             data.Open: self._extract_open,
             data.Close: self._extract_close,
@@ -268,26 +666,59 @@ class PgCopyProcessor(Processor):
             data.Document: self._extract_document,
             data.Custom: self._extract_custom,
         }
-        # TODO: to improve performance even more, maybe we can have multiprocessing
-        #       breaking down entries into groups first and process them in different
-        #       thread / processors
+        delta = self.delta
+        writers = self._writers
+        if delta is not None:
+            writers = self._writers = delta.wrap(writers)
+        partition_by = self.partition_by
+        sort_key_getters = self._sort_key_getters
+        normalizers = self._normalizers
+        entry_base_sort_key = sort_key_getters.get(ENTRY_BASE_KEY)
+        last_date = None
         for entry in entries:
+            if partition_by is not None and entry.date != last_date:
+                last_date = entry.date
+                writers = self._writers = self._partition_writers(
+                    partition_of(partition_by, last_date)
+                )
+                if delta is not None:
+                    writers = self._writers = delta.wrap(writers)
             entry_type = type(entry)
             entry_config = self.entry_configs[entry_type]
-            entry_id = uuid.uuid4()
+            entry_id = self.id_allocator.entry_id(
+                # the same ledger checked out elsewhere gets the same ids
+                entry._replace(filename=self.strip_path(entry.filename))
+                if entry_type is data.Document
+                else entry
+            )
             entry_base_values = self._extract_entry(
                 entry_id,
                 entry_config.type,
                 entry,
             )
-            self.entry_base_file.write(
-                serialize_row(self._entry_base_formatters, entry_base_values)
+            writers[ENTRY_BASE_KEY].write(
+                self._entry_base_encoder(entry_base_values),
+                entry_id,
+                entry_base_sort_key(entry_base_values, entry.date)
+                if entry_base_sort_key is not None
+                else (),
             )
 
             extractor = extractors[entry_type]
             entry_values = extractor(entry_id, entry)
-            entry_file = self.entry_files[entry_type]
-            entry_formatters = self._formatters[entry_type]
-            entry_file.write(serialize_row(entry_formatters, entry_values))
+            normalize = normalizers.get(entry_type)
+            if normalize is not None:
+                entry_values = normalize(entry_values)
+            entry_encoder = self._encoders[entry_type]
+            get_sort_key = sort_key_getters.get(entry_type)
+            writers[entry_type].write(
+                entry_encoder(entry_values),
+                entry_id,
+                get_sort_key(entry_values, entry.date)
+                if get_sort_key is not None
+                else (),
+            )
             if entry_type is data.Transaction:
                 self._process_transaction(entry_id, entry)
+            if delta is not None:
+                delta.finish_entry(entry_id)
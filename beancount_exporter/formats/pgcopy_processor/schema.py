@@ -0,0 +1,247 @@
+import enum
+import typing
+
+from beancount_data.data_types import Booking
+from beancount_data.data_types import EntryType
+
+from .configs import ENTRY_TYPE_CONFIGS
+from .data_types import Column
+from .data_types import EntryTypeConfig
+from .data_types import Table
+from .dimensions import Dimension
+from .dimensions import DIMENSION_COLUMNS
+from .dimensions import dimension_foreign_keys
+from .dimensions import INT8_OID
+from .dimensions import normalize_meta_columns
+from .dimensions import normalize_table
+from .meta_columns import make_meta_table
+from .meta_columns import MetaColumn
+from .tables import DIMENSION_TABLE
+from .tables import ENTRY_BASE_KEY
+from .tables import ENTRY_BASE_TABLE
+from .tables import POSTING_KEY
+from .tables import POSTING_TABLE
+from .tables import replace_id_type
+
+# Labels of the enum types used by the tables, entry types are encoded by their
+# names while booking methods are encoded by their values
+ENUM_TYPES: dict[str, list[str]] = {
+    "entrytype": [entry_type.name for entry_type in EntryType],
+    "booking": [booking.value for booking in Booking],
+}
+# Element type names of array columns by their type oid
+ARRAY_ELEMENT_TYPES = {
+    1043: "varchar",
+    INT8_OID: "int8",
+}
+
+
+@enum.unique
+class TableMode(enum.StrEnum):
+    # regular tables, every row loaded is WAL-logged
+    LOGGED = "LOGGED"
+    # UNLOGGED tables, the fastest to load, but they are truncated after a crash
+    # and not replicated
+    UNLOGGED = "UNLOGGED"
+    # UNLOGGED while loading, switched to LOGGED before building the constraints
+    # and indexes
+    STAGED = "STAGED"
+
+
+class TableSchema(typing.NamedTuple):
+    name: str
+    table: Table
+    primary_key: tuple[str, ...] = ("id",)
+    # column and the table it references
+    foreign_keys: tuple[tuple[str, str], ...] = ()
+    indexes: tuple[tuple[str, ...], ...] = ()
+    # dimension tables are shared by all entries, rows are only ever added to them
+    dimension: bool = False
+
+
+def make_table_schemas(
+    id_type: str = "uuid",
+    entry_configs: dict[typing.Type, EntryTypeConfig] | None = None,
+    normalized: bool = False,
+    meta_columns: tuple[MetaColumn, ...] = (),
+) -> list[TableSchema]:
+    """Make schemas of all the tables exported, referenced tables come first
+
+    :param id_type: type name of id columns, see `IdAllocator.type_name`
+    :param entry_configs: entry type configs of the processor
+    :param normalized: make the schemas of normalized tables along with the
+        dimension tables, see `PgCopyProcessor.normalize`
+    :param meta_columns: meta keys lifted into columns of entry_base and posting
+    :return: the table schemas
+    """
+
+    def make_table_schema(
+        name: str,
+        table: Table,
+        foreign_keys: tuple[tuple[str, str], ...] = (),
+        indexes: tuple[tuple[str, ...], ...] = (),
+    ) -> TableSchema:
+        table = replace_id_type(table, id_type)
+        lifted_meta_columns = meta_columns
+        if normalized:
+            # entries come first in the foreign keys, see `make_apply_delta_sql`
+            table = normalize_table(name, table)
+            foreign_keys += dimension_foreign_keys(name, table)
+            columns = DIMENSION_COLUMNS.get(name, {})
+            indexes = tuple(
+                tuple(
+                    columns[column][1] if column in columns else column
+                    for column in index
+                )
+                for index in indexes
+            )
+            lifted_meta_columns = normalize_meta_columns(meta_columns)
+        if name in (ENTRY_BASE_KEY, POSTING_KEY):
+            table = make_meta_table(table, lifted_meta_columns)
+        return TableSchema(
+            name=name, table=table, foreign_keys=foreign_keys, indexes=indexes
+        )
+
+    schemas = []
+    if normalized:
+        schemas.extend(
+            TableSchema(
+                name=dimension.value,
+                table=DIMENSION_TABLE,
+                indexes=(("name",),),
+                dimension=True,
+            )
+            for dimension in Dimension
+        )
+    schemas.append(
+        make_table_schema(
+            ENTRY_BASE_KEY, ENTRY_BASE_TABLE, indexes=(("date",), ("entry_type",))
+        )
+    )
+    for config in (entry_configs or ENTRY_TYPE_CONFIGS).values():
+        schemas.append(
+            make_table_schema(
+                config.type.value,
+                config.table,
+                foreign_keys=(("id", ENTRY_BASE_KEY),),
+            )
+        )
+    schemas.append(
+        make_table_schema(
+            POSTING_KEY,
+            POSTING_TABLE,
+            foreign_keys=(("transaction_id", EntryType.TRANSACTION.value),),
+            indexes=(("transaction_id",), ("account",)),
+        )
+    )
+    return schemas
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def qualified_name(name: str, schema: str | None = None) -> str:
+    if schema is None:
+        return quote_identifier(name)
+    return f"{quote_identifier(schema)}.{quote_identifier(name)}"
+
+
+def column_type(column: Column, schema: str | None = None) -> str:
+    """SQL type of the column, like `varchar[]` or `numeric`"""
+    if column.typelem != 0:
+        return f"{ARRAY_ELEMENT_TYPES[column.typelem]}[]"
+    if column.type_category == "E":
+        return qualified_name(column.type_name, schema)
+    if column.type_name in ("varchar", "bpchar") and column.type_mod >= 0:
+        # postgres reports size + 4
+        return f"{column.type_name}({column.type_mod - 4})"
+    return column.type_name
+
+
+def create_types_sql(schema: str | None = None) -> list[str]:
+    """Statements creating the enum types, types existing already are kept"""
+    statements = []
+    for type_name, labels in ENUM_TYPES.items():
+        values = ", ".join(map(quote_literal, labels))
+        statements.append(
+            "DO $$ BEGIN "
+            f"CREATE TYPE {qualified_name(type_name, schema)} AS ENUM ({values}); "
+            "EXCEPTION WHEN duplicate_object THEN NULL; "
+            "END $$;"
+        )
+    return statements
+
+
+def create_tables_sql(
+    table_schemas: list[TableSchema],
+    schema: str | None = None,
+    table_mode: TableMode = TableMode.LOGGED,
+) -> list[str]:
+    """Statements creating the tables without any constraint other than NOT NULL,
+    see `build_constraints_sql` for the rest
+
+    """
+    unlogged = "" if table_mode == TableMode.LOGGED else "UNLOGGED "
+    statements = []
+    for table_schema in table_schemas:
+        columns = ",\n".join(
+            f"    {quote_identifier(column.attname)} {column_type(column, schema)}"
+            + (" NOT NULL" if column.not_null else "")
+            for column in table_schema.table
+        )
+        statements.append(
+            f"CREATE {unlogged}TABLE "
+            f"{qualified_name(table_schema.name, schema)} (\n{columns}\n);"
+        )
+    return statements
+
+
+def build_constraints_sql(
+    table_schemas: list[TableSchema],
+    schema: str | None = None,
+    table_mode: TableMode = TableMode.LOGGED,
+) -> list[str]:
+    """Statements to run after loading the tables, building primary keys, foreign
+    keys and indexes in one pass over the data each, then analyzing the tables
+
+    """
+    statements = []
+    if table_mode == TableMode.STAGED:
+        # logged tables can't reference unlogged ones, the referenced tables come
+        # first
+        statements.extend(
+            f"ALTER TABLE {qualified_name(table_schema.name, schema)} SET LOGGED;"
+            for table_schema in table_schemas
+        )
+    for table_schema in table_schemas:
+        name = qualified_name(table_schema.name, schema)
+        columns = ", ".join(map(quote_identifier, table_schema.primary_key))
+        statements.append(
+            f"ALTER TABLE {name} ADD CONSTRAINT "
+            f"{quote_identifier(f'{table_schema.name}_pkey')} PRIMARY KEY ({columns});"
+        )
+    for table_schema in table_schemas:
+        name = qualified_name(table_schema.name, schema)
+        for column, referenced in table_schema.foreign_keys:
+            constraint = quote_identifier(f"{table_schema.name}_{column}_fkey")
+            statements.append(
+                f"ALTER TABLE {name} ADD CONSTRAINT {constraint} "
+                f"FOREIGN KEY ({quote_identifier(column)}) "
+                f"REFERENCES {qualified_name(referenced, schema)} (id);"
+            )
+        for index_columns in table_schema.indexes:
+            index = quote_identifier(
+                f"{table_schema.name}_{'_'.join(index_columns)}_idx"
+            )
+            columns = ", ".join(map(quote_identifier, index_columns))
+            statements.append(f"CREATE INDEX {index} ON {name} ({columns});")
+    statements.extend(
+        f"ANALYZE {qualified_name(table_schema.name, schema)};"
+        for table_schema in table_schemas
+    )
+    return statements
@@ -0,0 +1,222 @@
+import concurrent.futures
+import logging
+import pathlib
+import typing
+
+from .load_plan import DEFAULT_LOAD_JOBS
+from .load_plan import list_table_files
+from .schema import build_constraints_sql
+from .schema import create_tables_sql
+from .schema import create_types_sql
+from .schema import qualified_name
+from .schema import quote_identifier
+from .schema import TableMode
+from .schema import TableSchema
+
+# Suffixes of the schema being loaded and the schema replaced by the last load
+SHADOW_SUFFIX = "_shadow"
+PREVIOUS_SUFFIX = "_previous"
+# Seconds to wait for the locks of the swap, so that it never queues up behind a
+# long query and blocks the readers coming after it
+DEFAULT_SWAP_LOCK_TIMEOUT = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+class RowCountMismatch(Exception):
+    pass
+
+
+def manifest_row_counts(manifest: dict[str, typing.Any]) -> dict[str, int]:
+    """Row count of each table in the manifest, over all of its files"""
+    return {
+        table: sum(file["row_count"] for file in files)
+        for table, files in manifest["tables"].items()
+    }
+
+
+class ShadowLoader:
+    """Loads PGCOPY files into a shadow schema next to the live one, then swaps them
+
+    Tables are created, loaded, indexed and analyzed in `{schema}_shadow`, which
+    readers of the live schema never see. Once the row counts match the manifest,
+    the live schema is renamed to `{schema}_previous` and the shadow schema to
+    `{schema}` in one transaction. The previous schema is kept until the next load,
+    so that `rollback` can swap it back.
+
+    """
+
+    def __init__(
+        self,
+        database_url: str,
+        schema: str,
+        table_schemas: list[TableSchema],
+        jobs: int = DEFAULT_LOAD_JOBS,
+        swap_lock_timeout: float = DEFAULT_SWAP_LOCK_TIMEOUT,
+    ):
+        self.database_url = database_url
+        self.schema = schema
+        self.shadow_schema = f"{schema}{SHADOW_SUFFIX}"
+        self.previous_schema = f"{schema}{PREVIOUS_SUFFIX}"
+        self.table_schemas = table_schemas
+        self.jobs = jobs
+        self.swap_lock_timeout = swap_lock_timeout
+
+    def _connect(self) -> typing.Any:
+        import psycopg2
+
+        return psycopg2.connect(self.database_url)
+
+    def _execute(self, statements: list[str]):
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _copy_file(self, table: str, path: pathlib.Path):
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor, open(path, "rb") as fo:
+                cursor.copy_expert(
+                    f"COPY {qualified_name(table, self.shadow_schema)} "
+                    "FROM STDIN WITH (FORMAT BINARY)",
+                    fo,
+                )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def create_shadow(self):
+        """Create the shadow schema with empty tables, replacing any leftover of a
+        failed load
+
+        """
+        shadow = quote_identifier(self.shadow_schema)
+        self._execute(
+            [
+                f"DROP SCHEMA IF EXISTS {shadow} CASCADE",
+                f"CREATE SCHEMA {shadow}",
+                *create_types_sql(self.shadow_schema),
+                *create_tables_sql(
+                    self.table_schemas, self.shadow_schema, TableMode.STAGED
+                ),
+            ]
+        )
+
+    def copy_files(self, output_dir: pathlib.Path, manifest: dict[str, typing.Any]):
+        """COPY files of the tables into the shadow schema, `jobs` at a time"""
+        table_files = list_table_files(self.table_schemas, manifest)
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            futures = [
+                executor.submit(self._copy_file, table, output_dir / filename)
+                for table, filename in table_files
+            ]
+            for future in futures:
+                future.result()
+
+    def build_constraints(self):
+        self._execute(
+            build_constraints_sql(
+                self.table_schemas, self.shadow_schema, TableMode.STAGED
+            )
+        )
+
+    def validate(self, manifest: dict[str, typing.Any]):
+        """Make sure the shadow tables have exactly the rows of the export"""
+        expected = manifest_row_counts(manifest)
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                for table_schema in self.table_schemas:
+                    cursor.execute(
+                        "SELECT count(*) FROM "
+                        f"{qualified_name(table_schema.name, self.shadow_schema)}"
+                    )
+                    (count,) = cursor.fetchone()
+                    if count != expected.get(table_schema.name, 0):
+                        raise RowCountMismatch(
+                            f"Table {table_schema.name} has {count} rows, expected "
+                            f"{expected.get(table_schema.name, 0)}"
+                        )
+        finally:
+            connection.close()
+
+    def _schema_exists(self, name: str) -> bool:
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_namespace WHERE nspname = %s", (name,))
+                return cursor.fetchone() is not None
+        finally:
+            connection.close()
+
+    def _rename_schemas(self, renames: list[tuple[str, str]]):
+        """Rename schemas in one transaction, it gives up if the locks can't be
+        acquired in time
+
+        """
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT set_config('lock_timeout', %s, true)",
+                    (f"{int(self.swap_lock_timeout * 1000)}ms",),
+                )
+                for name, new_name in renames:
+                    cursor.execute(
+                        f"ALTER SCHEMA {quote_identifier(name)} "
+                        f"RENAME TO {quote_identifier(new_name)}"
+                    )
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    def swap(self):
+        """Make the shadow schema live, and keep the live one as the previous"""
+        # drop the previous schema on its own, so that the swap stays short
+        self._execute(
+            [f"DROP SCHEMA IF EXISTS {quote_identifier(self.previous_schema)} CASCADE"]
+        )
+        renames = [(self.shadow_schema, self.schema)]
+        if self._schema_exists(self.schema):
+            renames.insert(0, (self.schema, self.previous_schema))
+        self._rename_schemas(renames)
+
+    def rollback(self):
+        """Swap the previous schema back, the rolled back one becomes the previous"""
+        if not self._schema_exists(self.previous_schema):
+            raise ValueError(
+                f"No previous schema {self.previous_schema} to roll back to"
+            )
+        # the shadow schema only holds leftovers of a failed load at this point
+        self._execute(
+            [f"DROP SCHEMA IF EXISTS {quote_identifier(self.shadow_schema)} CASCADE"]
+        )
+        self._rename_schemas(
+            [
+                (self.schema, self.shadow_schema),
+                (self.previous_schema, self.schema),
+                (self.shadow_schema, self.previous_schema),
+            ]
+        )
+
+    def load(self, output_dir: pathlib.Path, manifest: dict[str, typing.Any]):
+        logger.info("Loading %s into schema %s", output_dir, self.shadow_schema)
+        self.create_shadow()
+        self.copy_files(output_dir, manifest)
+        logger.info("Building constraints and indexes of %s", self.shadow_schema)
+        self.build_constraints()
+        self.validate(manifest)
+        self.swap()
+        logger.info(
+            "Schema %s is live, the replaced one is kept as %s",
+            self.schema,
+            self.previous_schema,
+        )
@@ -0,0 +1,209 @@
+import datetime
+import heapq
+import itertools
+import pickle
+import sys
+import tempfile
+import typing
+
+from .data_types import Table
+from .dimensions import DIMENSION_COLUMNS
+from .dimensions import SOURCE_FILE_TABLES
+from .tables import SOURCE_FILE_ID_COLUMN
+from .writers import ShardedTableWriter
+from .writers import TableWriter
+
+# Bytes of encoded rows a sorting writer holds in memory before spilling them into
+# a sorted run file
+DEFAULT_SORT_BUFFER_SIZE = 64 << 20
+# Number of rows pickled together in run files, and read back at a time while
+# merging
+SPILL_BATCH_SIZE = 1024
+# Bytes of the Python objects holding a buffered row besides the encoded row and
+# its sort key: the record tuple with its slot in the list, the header of the
+# bytes object and the sequence number
+RECORD_OVERHEAD = (
+    sys.getsizeof((None,) * 4) + 8 + sys.getsizeof(b"") + sys.getsizeof(1 << 32)
+)
+# Pseudo column of the sort keys, it's the date of the entry for tables without
+# a `date` column, so that postings can be sorted by the date of their transaction
+DATE_COLUMN = "date"
+
+# Column names of the sort key of each table by table name
+SortKeys = dict[str, tuple[str, ...]]
+# Makes the sort key of a row from its column values and the date of its entry
+SortKeyGetter = typing.Callable[[tuple, datetime.date], tuple]
+# Sort key, sequence number, encoded row and shard key
+SortRecord = tuple[tuple, int, bytes, typing.Hashable]
+
+
+def parse_sort_key(value: str) -> tuple[str, tuple[str, ...]]:
+    """Parse a sort key like `posting=account,date`"""
+    table, sep, columns = value.partition("=")
+    column_names = tuple(filter(None, map(str.strip, columns.split(","))))
+    if not sep or not table.strip() or not column_names:
+        raise ValueError(f"Invalid sort key {value!r}, expected TABLE=COLUMN,...")
+    return table.strip(), column_names
+
+
+def check_sort_keys(sort_keys: SortKeys, tables: dict[str, Table]):
+    """Make sure tables and columns of the sort keys exist
+
+    Columns replaced by keys of dimensions in normalized tables are rejected, as
+    the keys are hashes of the names, which don't sort like the names.
+
+    :param tables: tables by their names
+    """
+    for table_name, columns in sort_keys.items():
+        table = tables.get(table_name)
+        if table is None:
+            raise ValueError(f"Unknown sort key table {table_name}")
+        attnames = {column.attname for column in table} | {DATE_COLUMN}
+        dimension_columns = {
+            name: key_name
+            for name, (_, key_name) in DIMENSION_COLUMNS.get(table_name, {}).items()
+        }
+        if table_name in SOURCE_FILE_TABLES:
+            dimension_columns["filename"] = SOURCE_FILE_ID_COLUMN.attname
+        for column in columns:
+            key_name = dimension_columns.get(column, column)
+            if key_name in attnames and key_name in dimension_columns.values():
+                raise ValueError(
+                    f"Sort key column {column} of normalized {table_name} has keys "
+                    "of a dimension, which are hashes that don't sort like the names"
+                )
+            if column not in attnames:
+                raise ValueError(f"Unknown sort key column {column} of {table_name}")
+
+
+def make_sort_key_getter(table: Table, columns: tuple[str, ...]) -> SortKeyGetter:
+    """Make the sort key getter of a table
+
+    Each value in the key comes with a flag putting nulls last, like ascending order
+    of PostgreSQL does, so that nulls are never compared with other values.
+
+    """
+    attnames = [column.attname for column in table]
+    indexes: list[int | None] = []
+    for column in columns:
+        if column in attnames:
+            indexes.append(attnames.index(column))
+        elif column == DATE_COLUMN:
+            indexes.append(None)
+        else:
+            raise ValueError(f"Unknown sort key column {column}")
+
+    def get_sort_key(values: tuple, date: datetime.date) -> tuple:
+        key = []
+        for index in indexes:
+            value = date if index is None else values[index]
+            key.append((value is None, value))
+        return tuple(key)
+
+    return get_sort_key
+
+
+def record_size(row: bytes, sort_key: tuple) -> int:
+    """Estimated bytes a buffered row takes in memory, along with its sort key, so
+    that narrow rows don't take many times the buffer size
+
+    """
+    size = len(row) + RECORD_OVERHEAD + sys.getsizeof(sort_key)
+    for flag_value in sort_key:
+        size += sys.getsizeof(flag_value) + sys.getsizeof(flag_value[1])
+    return size
+
+
+def _read_run(file: typing.BinaryIO) -> typing.Iterator[SortRecord]:
+    file.seek(0)
+    while True:
+        try:
+            batch = pickle.load(file)
+        except EOFError:
+            return
+        yield from batch
+
+
+class SortingTableWriter:
+    """Writes rows of a table ordered by their sort keys, so that the loaded table
+    is physically clustered
+
+    Rows are held in memory until `stop`. Once they take more than `buffer_size`
+    bytes, they are sorted and spilled into a temporary run file under `spill_dir`,
+    and the runs are merged at the end, so that memory stays bounded no matter how
+    many rows there are. Rows with equal sort keys keep the order they are written
+    in, which keeps the output reproducible.
+
+    """
+
+    def __init__(
+        self,
+        writer: TableWriter | ShardedTableWriter,
+        buffer_size: int = DEFAULT_SORT_BUFFER_SIZE,
+        spill_dir: str | None = None,
+    ):
+        self.writer = writer
+        self.buffer_size = buffer_size
+        self.spill_dir = spill_dir
+        self.runs: list[typing.BinaryIO] = []
+        self._records: list[SortRecord] = []
+        self._buffered_size = 0
+        self._sequence = itertools.count()
+
+    @property
+    def shards(self) -> list[TableWriter]:
+        return self.writer.shards
+
+    @property
+    def row_count(self) -> int:
+        return self.writer.row_count
+
+    def start(self):
+        self.writer.start()
+
+    def write(self, row: bytes, key: typing.Hashable = None, sort_key: tuple = ()):
+        self._records.append((sort_key, next(self._sequence), row, key))
+        self._buffered_size += record_size(row, sort_key)
+        if self._buffered_size >= self.buffer_size:
+            self.spill()
+
+    def spill(self):
+        """Sort the rows held in memory and write them into a new run file"""
+        if not self._records:
+            return
+        self._records.sort()
+        run = tempfile.TemporaryFile(dir=self.spill_dir)
+        try:
+            for start in range(0, len(self._records), SPILL_BATCH_SIZE):
+                pickle.dump(
+                    self._records[start : start + SPILL_BATCH_SIZE],
+                    run,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+        except BaseException:
+            run.close()
+            raise
+        self.runs.append(run)
+        self._records = []
+        self._buffered_size = 0
+
+    def flush(self):
+        self.writer.flush()
+
+    def close_runs(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
+
+    def stop(self):
+        self._records.sort()
+        try:
+            for _, _, row, key in heapq.merge(
+                *map(_read_run, self.runs), self._records
+            ):
+                self.writer.write(row, key)
+        finally:
+            self.close_runs()
+            self._records = []
+            self._buffered_size = 0
+        self.writer.stop()
@@ -1,6 +1,10 @@
 from .data_types import Column
 from .data_types import Table
 
+# Keys of writers in a partition, entry-type tables are keyed by the entry type
+ENTRY_BASE_KEY = "entry_base"
+POSTING_KEY = "posting"
+
 ID_COLUMN = Column(
     attname="id",
     type_category="U",
@@ -452,3 +456,56 @@ CUSTOM_TABLE: Table = (
         typelem=1043,
     ),
 )
+# Dimension tables of accounts, currencies and source files, keyed by a stable
+# hash of the name, see `dimensions.dimension_key`
+DIMENSION_TABLE: Table = (
+    Column(
+        attname="id",
+        type_category="N",
+        type_name="int8",
+        type_mod=-1,
+        not_null=True,
+        typelem=0,
+    ),
+    Column(
+        attname="name",
+        type_category="S",
+        type_name="varchar",
+        type_mod=-1,
+        not_null=True,
+        typelem=0,
+    ),
+)
+# Column referencing the dimension table of the source file, normalized tables have
+# it in place of the filename in meta
+SOURCE_FILE_ID_COLUMN = Column(
+    attname="source_file_id",
+    type_category="N",
+    type_name="int8",
+    type_mod=-1,
+    not_null=False,
+    typelem=0,
+)
+# Columns holding the id of entries or postings
+ID_COLUMN_NAMES = frozenset(["id", "transaction_id"])
+ID_TYPE_CATEGORIES = {
+    "uuid": "U",
+    "int8": "N",
+}
+
+
+def replace_id_type(table: Table, type_name: str) -> Table:
+    """Replace type of id columns in the table, like `int8` for sequence ids
+
+    :param table: table to replace
+    :param type_name: type name of id columns
+    :return: the new table
+    """
+    return tuple(
+        column._replace(
+            type_name=type_name, type_category=ID_TYPE_CATEGORIES[type_name]
+        )
+        if column.attname in ID_COLUMN_NAMES
+        else column
+        for column in table
+    )
@@ -49,6 +49,16 @@ def orjson_option_maps_default(value: typing.Any) -> typing.Any:
     raise TypeError
 
 
+def orjson_reproducible_default(value: typing.Any) -> typing.Any:
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    elif isinstance(value, decimal.Decimal):
+        return str(value)
+    elif isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError
+
+
 def compile_formatter(encoding: str, column: Column):
     funcs = [
         pgcopy.copy.encode,
@@ -0,0 +1,229 @@
+import datetime
+import enum
+import hashlib
+import queue
+import threading
+import typing
+
+import pgcopy.copy
+
+# Flush size of table buffers in bytes
+DEFAULT_FLUSH_SIZE = 1 << 20
+# Max number of flushed chunks waiting for the background writer thread
+DEFAULT_MAX_PENDING_CHUNKS = 8
+
+
+@enum.unique
+class ShardKey(enum.StrEnum):
+    # rows are dealt to the shards in turn
+    ROUND_ROBIN = "ROUND_ROBIN"
+    # rows are split by the hash of their own id
+    ENTRY_ID = "ENTRY_ID"
+    # same as ENTRY_ID, except postings are split by the hash of their transaction
+    # id, so that they land in the shards with the same index as their transaction
+    TRANSACTION_ID = "TRANSACTION_ID"
+
+
+@enum.unique
+class PartitionBy(enum.StrEnum):
+    YEAR = "YEAR"
+    MONTH = "MONTH"
+
+
+def partition_of(partition_by: PartitionBy, date: datetime.date) -> str:
+    """Name of the partition of a date, like `2023` or `2023-01`"""
+    if partition_by == PartitionBy.YEAR:
+        return f"{date.year:04}"
+    elif partition_by == PartitionBy.MONTH:
+        return f"{date.year:04}-{date.month:02}"
+    raise ValueError(f"Unexpected partition by {partition_by}")
+
+
+class BackgroundWriter:
+    """Writes chunks into files on a separate thread
+
+    Chunks of all tables go through one bounded FIFO queue, so that chunks of the
+    same file are written in the order they are submitted, and no more than
+    `max_pending_chunks` chunks are held in memory. File writes release the GIL,
+    so rows can be encoded on the main thread while the previous chunks hit the
+    disk. An exception raised by a write is re-raised by the next `submit` or
+    `stop` call once, the remaining chunks are dropped.
+
+    """
+
+    def __init__(self, max_pending_chunks: int = DEFAULT_MAX_PENDING_CHUNKS):
+        self.max_pending_chunks = max_pending_chunks
+        self._queue: queue.Queue[
+            tuple[typing.BinaryIO, bytearray] | None
+        ] = queue.Queue(maxsize=max_pending_chunks)
+        self._thread: threading.Thread | None = None
+        self._error: BaseException | None = None
+        self._error_raised = False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                # keep draining the queue, so that submit never blocks forever
+                continue
+            file, chunk = item
+            try:
+                file.write(chunk)
+            except BaseException as exc:
+                self._error = exc
+
+    def _raise_error(self):
+        if self._error is not None and not self._error_raised:
+            self._error_raised = True
+            raise self._error
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="pgcopy-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, file: typing.BinaryIO, chunk: bytearray):
+        self._raise_error()
+        self._queue.put((file, chunk))
+
+    def stop(self):
+        """Wait for all pending chunks to be written, it's safe to call more than
+        once, so that it can be used for cleaning up after failures
+
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._raise_error()
+
+
+class TableWriter:
+    """Writes PGCOPY binary stream of a table into a file
+
+    Encoded rows are appended to a reusable bytearray, which is written to the file
+    once it reaches `flush_size` bytes. This saves a call into the file object for
+    every row, and cuts the number of write syscalls. With a `background_writer`,
+    the filled buffer is handed over to the writer thread and a new one is used.
+
+    The size and the hash of the stream are computed along the way, as the buffer
+    is flushed.
+
+    """
+
+    def __init__(
+        self,
+        file: typing.BinaryIO,
+        flush_size: int = DEFAULT_FLUSH_SIZE,
+        background_writer: BackgroundWriter | None = None,
+    ):
+        self.file = file
+        self.flush_size = flush_size
+        self.background_writer = background_writer
+        self.buffer = bytearray()
+        self.row_count = 0
+        self.byte_size = 0
+        self._digest = hashlib.blake2b(digest_size=16)
+
+    @property
+    def shards(self) -> list["TableWriter"]:
+        return [self]
+
+    @property
+    def content_hash(self) -> str:
+        """blake2b hash of the bytes flushed so far"""
+        return self._digest.hexdigest()
+
+    def start(self):
+        self.buffer += pgcopy.copy.BINCOPY_HEADER
+
+    def write(self, row: bytes, key: typing.Hashable = None, sort_key: tuple = ()):
+        buffer = self.buffer
+        buffer += row
+        self.row_count += 1
+        if len(buffer) >= self.flush_size:
+            self.flush()
+
+    def write_rows(self, rows: bytes, row_count: int):
+        """Write a block of encoded rows"""
+        self.buffer += rows
+        self.row_count += row_count
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.byte_size += len(self.buffer)
+        self._digest.update(self.buffer)
+        if self.background_writer is not None:
+            self.background_writer.submit(self.file, self.buffer)
+            self.buffer = bytearray()
+            return
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+    def stop(self):
+        self.buffer += pgcopy.copy.BINCOPY_TRAILER
+        self.flush()
+
+
+class ShardedTableWriter:
+    """Splits rows of a table into shards, each of them is a standalone PGCOPY
+    binary stream, so that they can be loaded by concurrent COPY commands
+
+    """
+
+    def __init__(self, shards: list[TableWriter], shard_key: ShardKey):
+        self.shards = shards
+        self.shard_key = shard_key
+        self._next_shard = 0
+
+    @property
+    def row_count(self) -> int:
+        return sum(shard.row_count for shard in self.shards)
+
+    def start(self):
+        for shard in self.shards:
+            shard.start()
+
+    def write(self, row: bytes, key: typing.Hashable = None, sort_key: tuple = ()):
+        if self.shard_key == ShardKey.ROUND_ROBIN:
+            index = self._next_shard
+            self._next_shard = (index + 1) % len(self.shards)
+        else:
+            # hash of UUID and int is stable across processes
+            index = hash(key) % len(self.shards)
+        self.shards[index].write(row)
+
+    def flush(self):
+        for shard in self.shards:
+            shard.flush()
+
+    def stop(self):
+        for shard in self.shards:
+            shard.stop()
+
+
+class LazyWriters(dict):
+    """Writers of a partition, each of them is opened by `open_writer` when it's
+    first used
+
+    """
+
+    def __init__(
+        self,
+        open_writer: typing.Callable[
+            [typing.Hashable], TableWriter | ShardedTableWriter
+        ],
+    ):
+        super().__init__()
+        self.open_writer = open_writer
+
+    def __missing__(self, key: typing.Hashable) -> TableWriter | ShardedTableWriter:
+        writer = self[key] = self.open_writer(key)
+        return writer
@@ -0,0 +1,101 @@
+import logging
+import pathlib
+
+import click
+import orjson
+
+from .formats.pgcopy_processor.ids import IdStrategy
+from .formats.pgcopy_processor.ids import make_id_allocator
+from .formats.pgcopy_processor.load_plan import DEFAULT_LOAD_JOBS
+from .formats.pgcopy_processor.manifest import MANIFEST_FILENAME
+from .formats.pgcopy_processor.meta_columns import MetaColumn
+from .formats.pgcopy_processor.schema import make_table_schemas
+from .formats.pgcopy_processor.shadow import DEFAULT_SWAP_LOCK_TIMEOUT
+from .formats.pgcopy_processor.shadow import ShadowLoader
+
+
+@click.command()
+@click.argument(
+    "output_dir",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    required=False,
+)
+@click.option(
+    "--database-url",
+    type=str,
+    required=True,
+    help="libpq connection string or URL of the PostgreSQL database to load into",
+)
+@click.option(
+    "--database-schema",
+    type=str,
+    default="beancount",
+    help="Live schema readers query, it's replaced as a whole by each load",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=DEFAULT_LOAD_JOBS,
+    help="Number of files to copy at the same time",
+)
+@click.option(
+    "--swap-lock-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=DEFAULT_SWAP_LOCK_TIMEOUT,
+    help="Seconds to wait for the locks of the schema swap before giving up",
+)
+@click.option(
+    "--rollback",
+    is_flag=True,
+    help="Swap the schema replaced by the last load back instead of loading",
+)
+def main(
+    output_dir: click.Path | None,
+    database_url: str,
+    database_schema: str,
+    jobs: int,
+    swap_lock_timeout: float,
+    rollback: bool,
+):
+    """Load PGCOPY files in OUTPUT_DIR into a shadow schema, then swap it live"""
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s: %(message)s")
+    if rollback:
+        ShadowLoader(
+            database_url,
+            database_schema,
+            make_table_schemas(),
+            swap_lock_timeout=swap_lock_timeout,
+        ).rollback()
+        return
+    if output_dir is None:
+        raise click.UsageError("OUTPUT_DIR is required unless --rollback is given")
+    output_dir_path = pathlib.Path(str(output_dir))
+    manifest_path = output_dir_path / MANIFEST_FILENAME
+    if not manifest_path.exists():
+        raise click.UsageError(f"No {MANIFEST_FILENAME} in {output_dir_path}")
+    manifest = orjson.loads(manifest_path.read_bytes())
+    if manifest.get("delta", False):
+        raise click.UsageError(
+            f"{output_dir_path} is a delta export, it can't replace the schema"
+        )
+    id_strategy = IdStrategy(manifest.get("id_strategy", IdStrategy.UUID4))
+    loader = ShadowLoader(
+        database_url,
+        database_schema,
+        make_table_schemas(
+            make_id_allocator(id_strategy).type_name,
+            normalized=manifest.get("normalized", False),
+            meta_columns=tuple(
+                MetaColumn(*meta_column)
+                for meta_column in manifest.get("meta_columns", [])
+            ),
+        ),
+        jobs=jobs,
+        swap_lock_timeout=swap_lock_timeout,
+    )
+    loader.load(output_dir_path, manifest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import glob
+import hashlib
+import importlib.util
+import logging
+import pathlib
+import platform
+import struct
+import typing
+from os import path
+
+import beancount
+import orjson
+from beancount.utils import misc_utils
+
+from .loading import ParseResult
+from .parse_cache import atomic_write
+from .parse_cache import CacheKey
+from .parse_cache import file_key
+from .snapshot import dump_snapshot
+from .snapshot import load_snapshot
+
+# bump it whenever the cache keys are no longer comparable with older ones
+LOAD_CACHE_VERSION = 1
+# size of the cache key written before the snapshot
+KEY_SIZE = struct.Struct(">I")
+
+logger = logging.getLogger(__name__)
+
+
+def module_key(name: str, key: CacheKey) -> list | None:
+    """Key of the source file of a plugin module, None if it's not a file"""
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or spec.origin is None or not path.isfile(spec.origin):
+        return None
+    return list(file_key(spec.origin, key))
+
+
+class LoadCache:
+    """Caches the load result of a ledger in a directory, written in the snapshot
+    format, see `beancount_exporter.snapshot`
+
+    The cached result is used only when none of these changed:
+
+    - content of the files of the ledger, encrypted ones included, or their mtime
+      and size with MTIME key
+    - files matched by the include directives, so that new files matched by a glob
+      invalidate it
+    - plugins with their config, and the source files of the plugin modules
+    - extra validations
+    - versions of beancount and python
+
+    """
+
+    def __init__(self, cache_dir: pathlib.Path, key: CacheKey = CacheKey.CONTENT):
+        self.cache_dir = cache_dir
+        self.key = key
+
+    def cache_path(self, filename: str) -> pathlib.Path:
+        name = hashlib.blake2b(filename.encode("utf8"), digest_size=16).hexdigest()
+        return self.cache_dir / f"{name}.snapshot"
+
+    def make_key(
+        self,
+        filenames: list[str],
+        include_globs: list[tuple[str, str]],
+        plugins: list[tuple[str, str | None]],
+        extra_validations: list | None,
+        validate: bool = True,
+    ) -> dict[str, typing.Any]:
+        """
+        :param include_globs: (directory, pattern) of the include directives, see
+            `beancount_exporter.loading.parse_recursive`
+        :raise OSError: if any of the files is gone
+        """
+        return dict(
+            version=LOAD_CACHE_VERSION,
+            beancount=beancount.__version__,
+            python=platform.python_version(),
+            key=self.key.value,
+            validations=[
+                f"{func.__module__}.{func.__qualname__}"
+                for func in extra_validations or ()
+            ]
+            if validate
+            else None,
+            files=[
+                [filename, list(file_key(filename, self.key))] for filename in filenames
+            ],
+            include_globs=[
+                [
+                    directory,
+                    pattern,
+                    sorted(glob.glob(pattern, root_dir=directory, recursive=True)),
+                ]
+                for directory, pattern in include_globs
+            ],
+            plugins=[
+                [name, config, module_key(name, self.key)] for name, config in plugins
+            ],
+        )
+
+    def _load(
+        self,
+        cache_path: pathlib.Path,
+        extra_validations: list | None,
+        validate: bool,
+        log_timings: typing.Callable[[str], typing.Any],
+    ) -> ParseResult | None:
+        try:
+            fo = open(cache_path, "rb")
+        except FileNotFoundError:
+            log_timings(f"Load cache miss at {cache_path}")
+            return None
+        with fo:
+            try:
+                (key_size,) = KEY_SIZE.unpack(fo.read(KEY_SIZE.size))
+                cached_key = orjson.loads(fo.read(key_size))
+                key = self.make_key(
+                    [filename for filename, _ in cached_key["files"]],
+                    [
+                        (directory, pattern)
+                        for directory, pattern, _ in cached_key["include_globs"]
+                    ],
+                    [(name, config) for name, config, _ in cached_key["plugins"]],
+                    extra_validations,
+                    validate,
+                )
+            except (
+                struct.error,
+                orjson.JSONDecodeError,
+                KeyError,
+                TypeError,
+                ValueError,
+            ):
+                logger.warning("Discarding unreadable load cache %s", cache_path)
+                return None
+            except OSError:
+                # a file of the ledger is gone
+                key = None
+            if key != cached_key:
+                log_timings(f"Load cache at {cache_path} is stale")
+                return None
+            try:
+                result = load_snapshot(fo)
+            except ValueError as exc:
+                logger.warning("Discarding load cache %s, %s", cache_path, exc)
+                return None
+        log_timings(f"Load cache hit at {cache_path}")
+        return result
+
+    def load(
+        self,
+        filename: str,
+        extra_validations: list | None = None,
+        validate: bool = True,
+        log_timings: typing.Callable[[str], typing.Any] = logger.debug,
+    ) -> ParseResult | None:
+        """Cached load result of a ledger, None if there's none or it's stale
+
+        :param filename: absolute path of the top level file of the ledger
+        :param validate: whether the entries are validated, see
+            `beancount_exporter.loading.load_file`
+        :param log_timings: logs the timing and whether it's a hit
+        """
+        with misc_utils.log_time("load_cache", log_timings, indent=1):
+            return self._load(
+                self.cache_path(filename), extra_validations, validate, log_timings
+            )
+
+    def dump(
+        self,
+        filename: str,
+        result: ParseResult,
+        parsed_filenames: list[str],
+        include_globs: list[tuple[str, str]],
+        extra_validations: list | None = None,
+        validate: bool = True,
+    ):
+        """Cache the load result of a ledger
+
+        :param filename: absolute path of the top level file of the ledger
+        :param parsed_filenames: files parsed while loading the ledger, encrypted
+            files are left out of its `include` option
+        :param include_globs: (directory, pattern) of the include directives
+            collected while loading the ledger
+        """
+        _, _, options_map = result
+        key = orjson.dumps(
+            self.make_key(
+                parsed_filenames,
+                include_globs,
+                options_map["plugin"],
+                extra_validations,
+                validate,
+            )
+        )
+        with atomic_write(self.cache_path(filename)) as fo:
+            fo.write(KEY_SIZE.pack(len(key)))
+            fo.write(key)
+            dump_snapshot(fo, result)
@@ -0,0 +1,105 @@
+import pathlib
+
+import click
+import orjson
+from click.core import ParameterSource
+
+from .formats.pgcopy_processor.delta import APPLY_DELTA_FILENAME
+from .formats.pgcopy_processor.ids import IdStrategy
+from .formats.pgcopy_processor.ids import make_id_allocator
+from .formats.pgcopy_processor.load_plan import BUILD_CONSTRAINTS_FILENAME
+from .formats.pgcopy_processor.load_plan import CREATE_TABLES_FILENAME
+from .formats.pgcopy_processor.load_plan import DEFAULT_LOAD_JOBS
+from .formats.pgcopy_processor.load_plan import LOAD_SCRIPT_FILENAME
+from .formats.pgcopy_processor.load_plan import write_load_plan
+from .formats.pgcopy_processor.manifest import MANIFEST_FILENAME
+from .formats.pgcopy_processor.meta_columns import MetaColumn
+from .formats.pgcopy_processor.schema import make_table_schemas
+from .formats.pgcopy_processor.schema import TableMode
+
+
+@click.command()
+@click.argument(
+    "output_dir", type=click.Path(exists=True, dir_okay=True, file_okay=False)
+)
+@click.option(
+    "--id-strategy",
+    type=click.Choice(IdStrategy),
+    default=IdStrategy.UUID4,
+    help="Id strategy the PGCOPY files were exported with, SEQUENCE ids are int8 "
+    "while the others are uuid, the one recorded in the manifest is used if not set",
+)
+@click.option(
+    "--database-schema",
+    type=str,
+    help="PostgreSQL schema to create the tables in, search_path is used if not set",
+)
+@click.option(
+    "--table-mode",
+    type=click.Choice(TableMode),
+    default=TableMode.STAGED,
+    help="LOGGED creates regular tables, UNLOGGED keeps the tables unlogged, STAGED "
+    "loads them unlogged and switches them to logged before building indexes",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=DEFAULT_LOAD_JOBS,
+    help="Number of files to copy at the same time",
+)
+def main(
+    output_dir: click.Path,
+    id_strategy: IdStrategy,
+    database_schema: str | None,
+    table_mode: TableMode,
+    jobs: int,
+):
+    """Generate the DDL and a psql load script for PGCOPY files in OUTPUT_DIR"""
+    output_dir_path = pathlib.Path(str(output_dir))
+    manifest = None
+    manifest_path = output_dir_path / MANIFEST_FILENAME
+    if manifest_path.exists():
+        manifest = orjson.loads(manifest_path.read_bytes())
+    settings = manifest or {}
+    if settings.get("delta", False):
+        raise click.UsageError(
+            f"{output_dir_path} is a delta export, apply it with "
+            f"{APPLY_DELTA_FILENAME} instead"
+        )
+    if "id_strategy" in settings:
+        manifest_id_strategy = IdStrategy(settings["id_strategy"])
+        context = click.get_current_context()
+        if context.get_parameter_source("id_strategy") == ParameterSource.DEFAULT:
+            id_strategy = manifest_id_strategy
+        elif id_strategy != manifest_id_strategy:
+            raise click.UsageError(
+                f"--id-strategy {id_strategy} doesn't match the id strategy "
+                f"{manifest_id_strategy} the files were exported with, see "
+                f"{MANIFEST_FILENAME}"
+            )
+    write_load_plan(
+        output_dir_path,
+        make_table_schemas(
+            make_id_allocator(id_strategy).type_name,
+            # columns of normalized tables and meta columns are in the manifest
+            normalized=settings.get("normalized", False),
+            meta_columns=tuple(
+                MetaColumn(*meta_column)
+                for meta_column in settings.get("meta_columns", [])
+            ),
+        ),
+        manifest=manifest,
+        schema=database_schema,
+        table_mode=table_mode,
+        jobs=jobs,
+    )
+    click.echo(
+        f"Wrote {CREATE_TABLES_FILENAME}, {LOAD_SCRIPT_FILENAME} and "
+        f"{BUILD_CONSTRAINTS_FILENAME}, run {output_dir_path / LOAD_SCRIPT_FILENAME} "
+        "to load the tables"
+    )
+
+
+if __name__ == "__main__":
+    main()
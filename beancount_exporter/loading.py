@@ -0,0 +1,257 @@
+import functools
+import glob
+import io
+import multiprocessing.pool
+import os
+import typing
+from os import path
+
+from beancount import loader
+from beancount.core import data
+from beancount.ops import validation
+from beancount.parser import booking
+from beancount.parser import options
+from beancount.parser import parser
+from beancount.parser import printer
+from beancount.utils import encryption
+from beancount.utils import file_utils
+from beancount.utils import misc_utils
+
+from .formats.pgcopy_processor.parallel import get_context
+
+# Entries, errors and options map of a parsed file
+ParseResult = tuple[data.Entries, list, dict[str, typing.Any]]
+# Parses files by their absolute paths, and returns the results in the same order
+ParseFiles = typing.Callable[[list[str]], list[ParseResult]]
+# Function or file object timings are written to, see `beancount.loader.load_file`
+LogTimings = typing.Callable[[str], typing.Any] | typing.TextIO | None
+
+
+def parse_file(filename: str, encoding: str | None = None) -> ParseResult:
+    return parser.parse_file(filename, encoding=encoding)
+
+
+def parse_files(filenames: list[str], encoding: str | None = None) -> list[ParseResult]:
+    return [parse_file(filename, encoding=encoding) for filename in filenames]
+
+
+class ParallelParser:
+    """Parses files in a pool of worker processes
+
+    The pool is started for the first batch with more than one file, and it's
+    stopped when the parser is closed.
+
+    """
+
+    def __init__(self, jobs: int, encoding: str | None = None):
+        self.jobs = jobs
+        self.encoding = encoding
+        self._pool: multiprocessing.pool.Pool | None = None
+
+    def __enter__(self) -> "ParallelParser":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def parse_files(self, filenames: list[str]) -> list[ParseResult]:
+        if self.jobs == 1 or len(filenames) <= 1:
+            return parse_files(filenames, encoding=self.encoding)
+        if self._pool is None:
+            context, _ = get_context()
+            self._pool = context.Pool(self.jobs)
+        # the results come back in order of the files, whichever worker is done
+        # first, so that the merged entries and errors stay the same
+        return self._pool.map(
+            functools.partial(parse_file, encoding=self.encoding),
+            filenames,
+            chunksize=1,
+        )
+
+
+def _load_error(message: str) -> loader.LoadError:
+    return loader.LoadError(data.new_metadata("<load>", 0), message, None)
+
+
+def parse_recursive(
+    filename: str,
+    parse_files: ParseFiles,
+    log_timings: typing.Callable[[str], typing.Any] | None = None,
+    encoding: str | None = None,
+    include_globs: list[tuple[str, str]] | None = None,
+    parsed_filenames: list[str] | None = None,
+) -> ParseResult:
+    """Parse a file and the files it includes, same as
+    `beancount.loader._parse_recursive`, except files are parsed by `parse_files`
+
+    The include graph is walked breadth first, like beancount does, a level at a
+    time. Files of a level are parsed by a single `parse_files` call, then their
+    results are merged in the same order beancount would have parsed them.
+    Encrypted files are always parsed by beancount.
+
+    :param include_globs: collects the (directory, pattern) of the include
+        directives, their matched files decide the files of the ledger
+    :param parsed_filenames: collects the files parsed, encrypted ones included,
+        unlike the `include` option which leaves them out
+    """
+    entries, parse_errors = [], []
+    options_map = None
+    sources = [filename]
+    # absolute filenames parsed so far, for detecting duplicates (cycles)
+    filenames_seen = set()
+
+    with misc_utils.log_time("beancount.parser.parser", log_timings, indent=1):
+        while sources:
+            # (kind, source) of each source of the level, kind is "error" with the
+            # error message as the source, "file" or "encrypted"
+            steps: list[tuple[str, str]] = []
+            filenames = []
+            for source in sources:
+                if encryption.is_encrypted_file(source):
+                    steps.append(("encrypted", source))
+                    continue
+                filename = path.normpath(source)
+                if filename in filenames_seen:
+                    steps.append(
+                        ("error", 'Duplicate filename parsed: "{}"'.format(filename))
+                    )
+                elif not path.exists(filename):
+                    steps.append(("error", 'File "{}" does not exist'.format(filename)))
+                else:
+                    filenames_seen.add(filename)
+                    filenames.append(filename)
+                    steps.append(("file", filename))
+
+            with misc_utils.log_time(
+                "beancount.parser.parser.parse_file", log_timings, indent=2
+            ):
+                results = iter(parse_files(filenames))
+
+            sources = []
+            for kind, source in steps:
+                if kind == "error":
+                    parse_errors.append(_load_error(source))
+                    continue
+                if parsed_filenames is not None:
+                    parsed_filenames.append(source)
+                if kind == "file":
+                    src_entries, src_errors, src_options_map = next(results)
+                else:
+                    contents = encryption.read_encrypted_file(source)
+                    if encoding:
+                        if isinstance(contents, bytes):
+                            contents = contents.decode(encoding)
+                        contents = contents.encode("ascii", "replace")
+                    with misc_utils.log_time(
+                        "beancount.parser.parser.parse_string", log_timings, indent=2
+                    ):
+                        src_entries, src_errors, src_options_map = parser.parse_string(
+                            contents, source
+                        )
+                cwd = path.dirname(source)
+
+                entries.extend(src_entries)
+                parse_errors.extend(src_errors)
+                # only the options of the top level file are used, except a few
+                # which are aggregated
+                if options_map is None:
+                    options_map = src_options_map
+                else:
+                    loader.aggregate_options_map(options_map, src_options_map)
+
+                include_expanded = []
+                with file_utils.chdir(cwd):
+                    for include_filename in src_options_map["include"]:
+                        if include_globs is not None:
+                            include_globs.append((cwd, include_filename))
+                        matched_filenames = glob.glob(include_filename, recursive=True)
+                        if matched_filenames:
+                            include_expanded.extend(matched_filenames)
+                        else:
+                            parse_errors.append(
+                                _load_error(
+                                    'File glob "{}" does not match any files'.format(
+                                        include_filename
+                                    )
+                                )
+                            )
+                for include_filename in include_expanded:
+                    if not path.isabs(include_filename):
+                        include_filename = path.join(cwd, include_filename)
+                    sources.append(path.normpath(include_filename))
+
+    if options_map is None:
+        options_map = options.OPTIONS_DEFAULTS.copy()
+    options_map["include"] = sorted(filenames_seen)
+    return entries, parse_errors, options_map
+
+
+def load_file(
+    filename: str,
+    parse_files: ParseFiles,
+    log_timings: LogTimings = None,
+    log_errors: typing.Callable[[str], typing.Any] | typing.TextIO | None = None,
+    extra_validations: list | None = None,
+    encoding: str | None = None,
+    include_globs: list[tuple[str, str]] | None = None,
+    validate: bool = True,
+    parsed_filenames: list[str] | None = None,
+) -> ParseResult:
+    """Load a ledger like `beancount.loader.load_file`, except files are parsed by
+    `parse_files`, then the entries are booked, transformed by plugins and validated
+    the same way
+
+    :param validate: whether the entries are validated, the default validations
+        beancount always runs are skipped too if it's false
+    :param parsed_filenames: collects the files parsed, see `parse_recursive`
+    """
+    filename = path.expandvars(path.expanduser(filename))
+    if not path.isabs(filename):
+        filename = path.normpath(path.join(os.getcwd(), filename))
+    if hasattr(log_timings, "write"):
+        log_timings = log_timings.write
+
+    with misc_utils.log_time("parse", log_timings, indent=1):
+        entries, parse_errors, options_map = parse_recursive(
+            filename,
+            parse_files,
+            log_timings,
+            encoding,
+            include_globs,
+            parsed_filenames,
+        )
+        entries.sort(key=data.entry_sortkey)
+
+    with misc_utils.log_time("booking", log_timings, indent=1):
+        entries, balance_errors = booking.book(entries, options_map)
+        parse_errors.extend(balance_errors)
+
+    with misc_utils.log_time("run_transformations", log_timings, indent=1):
+        entries, errors = loader.run_transformations(
+            entries, parse_errors, options_map, log_timings
+        )
+
+    if validate:
+        with misc_utils.log_time("beancount.ops.validate", log_timings, indent=1):
+            errors.extend(
+                validation.validate(
+                    entries, options_map, log_timings, extra_validations
+                )
+            )
+
+    options_map["input_hash"] = loader.compute_input_hash(options_map["include"])
+
+    if log_errors and errors:
+        if hasattr(log_errors, "write"):
+            printer.print_errors(errors, file=log_errors)
+        else:
+            error_io = io.StringIO()
+            printer.print_errors(errors, file=error_io)
+            log_errors(error_io.getvalue())
+    return entries, errors, options_map
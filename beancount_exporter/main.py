@@ -1,4 +1,5 @@
 import contextlib
+import copy
 import enum
 import logging
 import os
@@ -7,11 +8,40 @@ import sys
 
 import click
 from beancount import loader
-from beancount.ops import validation
+from beancount.parser import printer
+from beancount.utils import misc_utils
+from click.core import ParameterSource
 
 from .formats.json_processor import JsonProcessor
-from .formats.pgcopy_processor import PgCopyProcessor
-from .formats.pgcopy_processor.configs import ENTRY_TYPE_CONFIGS
+from .formats.pgcopy_processor.database import CommitMode
+from .formats.pgcopy_processor.database import DEFAULT_MAX_CONNECTIONS
+from .formats.pgcopy_processor.delta import APPLY_DELTA_FILENAME
+from .formats.pgcopy_processor.delta import DELETED_ENTRIES_FILENAME
+from .formats.pgcopy_processor.delta import FINGERPRINTS_FILENAME
+from .formats.pgcopy_processor.fifo import DEFAULT_FIFO_TIMEOUT
+from .formats.pgcopy_processor.ids import IdStrategy
+from .formats.pgcopy_processor.ids import make_id_allocator
+from .formats.pgcopy_processor.manifest import MANIFEST_FILENAME
+from .formats.pgcopy_processor.meta_columns import DEFAULT_META_COLUMNS
+from .formats.pgcopy_processor.meta_columns import MetaColumn
+from .formats.pgcopy_processor.meta_columns import parse_meta_column
+from .formats.pgcopy_processor.options import PgCopyOptions
+from .formats.pgcopy_processor.sorting import DEFAULT_SORT_BUFFER_SIZE
+from .formats.pgcopy_processor.sorting import parse_sort_key
+from .formats.pgcopy_processor.sorting import SortKeys
+from .formats.pgcopy_processor.writers import PartitionBy
+from .formats.pgcopy_processor.writers import ShardKey
+from .load_cache import LoadCache
+from .loading import load_file
+from .loading import ParallelParser
+from .loading import ParseResult
+from .parse_cache import CacheKey
+from .parse_cache import ParseCache
+from .pgcopy_export import PgCopyExport
+from .snapshot import load_snapshot
+from .validations import BackgroundValidator
+from .validations import get_extra_validations
+from .validations import ValidationLevel
 
 
 @enum.unique
@@ -20,6 +50,133 @@ class ExportFormat(enum.StrEnum):
     PGCOPY = "PGCOPY"
 
 
+# parameters of options only the PGCOPY format uses
+PGCOPY_OPTIONS = frozenset(
+    {
+        "value_cache_size",
+        "id_strategy",
+        "background_writes",
+        "jobs",
+        "shards",
+        "shard_key",
+        "partition_by",
+        "database_url",
+        "database_schema",
+        "commit_mode",
+        "max_connections",
+        "fifo",
+        "fifo_timeout",
+        "fingerprints",
+        "delta_from",
+        "sort_keys",
+        "sort_buffer_size",
+        "spill_dir",
+        "normalize",
+        "promote_meta",
+        "meta_columns",
+    }
+)
+
+
+def parse_sort_keys(
+    context: click.Context, param: click.Parameter, values: tuple[str, ...]
+) -> SortKeys:
+    try:
+        return dict(map(parse_sort_key, values))
+    except ValueError as exc:
+        raise click.BadParameter(str(exc)) from exc
+
+
+def parse_meta_columns(
+    context: click.Context, param: click.Parameter, values: tuple[str, ...]
+) -> tuple[MetaColumn, ...]:
+    try:
+        return tuple(map(parse_meta_column, values))
+    except ValueError as exc:
+        raise click.BadParameter(str(exc)) from exc
+
+
+def load_ledger(
+    filename: str,
+    parse_cache_dir: click.Path | None,
+    parse_cache_key: CacheKey,
+    parse_jobs: int,
+    load_cache_dir: click.Path | None,
+    load_cache_key: CacheKey,
+    validation_level: ValidationLevel,
+) -> ParseResult:
+    validate = validation_level != ValidationLevel.NONE
+    extra_validations = get_extra_validations(validation_level)
+    if (
+        parse_cache_dir is None
+        and parse_jobs == 1
+        and load_cache_dir is None
+        # beancount always runs the default validations
+        and validate
+    ):
+        return loader.load_file(
+            filename,
+            log_timings=logging.info,
+            log_errors=sys.stderr,
+            extra_validations=extra_validations,
+        )
+
+    filename = os.path.abspath(filename)
+    load_cache = None
+    if load_cache_dir is not None:
+        load_cache = LoadCache(pathlib.Path(str(load_cache_dir)), key=load_cache_key)
+        result = load_cache.load(
+            filename,
+            extra_validations=extra_validations,
+            validate=validate,
+            log_timings=logging.info,
+        )
+        if result is not None:
+            printer.print_errors(result[1], file=sys.stderr)
+            return result
+
+    include_globs: list[tuple[str, str]] = []
+    parsed_filenames: list[str] = []
+    with ParallelParser(parse_jobs) as parallel_parser:
+        parse_cache = None
+        parse_files = parallel_parser.parse_files
+        if parse_cache_dir is not None:
+            parse_cache = ParseCache(
+                pathlib.Path(str(parse_cache_dir)),
+                key=parse_cache_key,
+                parse_misses=parallel_parser.parse_files,
+            )
+            parse_files = parse_cache.parse_files
+        result = load_file(
+            filename,
+            parse_files=parse_files,
+            log_timings=logging.info,
+            log_errors=sys.stderr,
+            extra_validations=extra_validations,
+            include_globs=include_globs,
+            validate=validate,
+            parsed_filenames=parsed_filenames,
+        )
+    if parse_cache is not None:
+        parse_cache_stats = parse_cache.stats()
+        logging.info(
+            "Parse cache hits=%d, misses=%d, invalidations=%d",
+            parse_cache_stats.hits,
+            parse_cache_stats.misses,
+            parse_cache_stats.invalidations,
+        )
+    if load_cache is not None:
+        load_cache.dump(
+            filename,
+            result,
+            parsed_filenames,
+            include_globs,
+            extra_validations=extra_validations,
+            validate=validate,
+        )
+    return result
+
+
 @click.command()
 @click.argument("filename", type=click.Path(exists=True))
 @click.option(
@@ -53,6 +210,230 @@ class ExportFormat(enum.StrEnum):
     help="Disable validation result from the output",
 )
 @click.option("--disable-entries", is_flag=True, help="Disable entries from the output")
+@click.option(
+    "--value-cache-size",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Max number of cached encoded column values for PGCOPY format, 0 disables",
+)
+@click.option(
+    "--id-strategy",
+    type=click.Choice(IdStrategy),
+    default=IdStrategy.UUID4,
+    help="How ids of entries and postings are allocated for PGCOPY format, "
+    "SEQUENCE ids are bigint instead of uuid, CONTENT ids are derived from the "
+    "content of entries and stay the same across exports",
+)
+@click.option(
+    "--background-writes",
+    is_flag=True,
+    help="Write PGCOPY files on a separate thread, overlapping encoding with disk I/O",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of worker processes encoding entries for PGCOPY format, it can't be "
+    "used with --background-writes, --fifo or --database-url",
+)
+@click.option(
+    "--shards",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of shard files of each table for PGCOPY format, with more than one "
+    f"shard, a {MANIFEST_FILENAME} listing the shards and their row counts is written",
+)
+@click.option(
+    "--shard-key",
+    type=click.Choice(ShardKey),
+    default=ShardKey.TRANSACTION_ID,
+    help="How rows are split into shards, TRANSACTION_ID puts postings into the "
+    "shards with the same index as their transactions",
+)
+@click.option(
+    "--partition-by",
+    type=click.Choice(PartitionBy),
+    default=None,
+    help="Write PGCOPY files of each table per period of entry dates, like "
+    f"posting.2023.bin, postings go with their transactions, a {MANIFEST_FILENAME} "
+    "listing the files and their row counts is written",
+)
+@click.option(
+    "--database-url",
+    type=str,
+    default=None,
+    help="Load PGCOPY tables straight into PostgreSQL with concurrent COPY commands "
+    "instead of writing them into the output dir, like "
+    "postgresql://user@localhost/beancount",
+)
+@click.option(
+    "--database-schema",
+    type=str,
+    default=None,
+    help="Schema of the tables loaded with --database-url, partitions are loaded "
+    "into {table}_{partition} tables",
+)
+@click.option(
+    "--commit-mode",
+    type=click.Choice(CommitMode),
+    default=CommitMode.TABLE,
+    help="How tables loaded with --database-url are committed, TABLE commits each "
+    "of them on its own, ALL commits them only if all of them succeed, TWO_PHASE "
+    "also prepares them before committing (requires max_prepared_transactions)",
+)
+@click.option(
+    "--max-connections",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_CONNECTIONS,
+    help="Max number of connections --database-url opens, one for each shard of "
+    "each table in each partition. Exports needing more are rejected before "
+    "loading anything, keep it below max_connections of PostgreSQL",
+)
+@click.option(
+    "--fifo",
+    is_flag=True,
+    help="Create PGCOPY table outputs as named pipes (FIFO), so that consumers like "
+    "psql \\copy can read them while entries are being encoded",
+)
+@click.option(
+    "--fifo-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=DEFAULT_FIFO_TIMEOUT,
+    help="Seconds without any progress writing or reading FIFOs before giving up "
+    "on the consumers",
+)
+@click.option(
+    "--fingerprints",
+    is_flag=True,
+    help=f"Record fingerprints of entries in {FINGERPRINTS_FILENAME}, so that later "
+    "exports can write only the delta with --delta-from (requires --id-strategy "
+    "CONTENT)",
+)
+@click.option(
+    "--delta-from",
+    type=click.Path(dir_okay=False),
+    help=f"{FINGERPRINTS_FILENAME} of the previous export, only rows of entries "
+    f"changed since then are written, along with {DELETED_ENTRIES_FILENAME} and "
+    f"{APPLY_DELTA_FILENAME} applying the delta. It falls back to a full export if "
+    "the fingerprints are missing or incompatible",
+)
+@click.option(
+    "--reproducible",
+    is_flag=True,
+    help="Write identical PGCOPY output bytes for identical input, with sorted JSON "
+    "keys and sets, and deterministic ids (CONTENT unless --id-strategy is given)",
+)
+@click.option(
+    "--sort-key",
+    "sort_keys",
+    multiple=True,
+    callback=parse_sort_keys,
+    help="Sort rows of a PGCOPY table by the given columns, like "
+    "posting=account,date or entry_base=date,entry_type, so that the loaded table "
+    "is physically clustered, date of tables without such a column is the date of "
+    "the entry. It can be given for more than one table. With --normalize, rows "
+    "can't be sorted by account, currency or source file, as their keys are hashes",
+)
+@click.option(
+    "--sort-buffer-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_SORT_BUFFER_SIZE >> 20,
+    help="Megabytes of memory the rows of each sorted table take, estimated along "
+    "with the Python objects holding them, before spilling them into a temporary "
+    "file",
+)
+@click.option(
+    "--spill-dir",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    default=None,
+    help="Directory of the temporary files spilled by sorted tables, defaults to the "
+    "system temporary directory",
+)
+@click.option(
+    "--normalize",
+    is_flag=True,
+    help="Write account, currency and source_file dimension tables for PGCOPY "
+    "format, and reference them by int8 keys in the other tables instead of "
+    "repeating the names, keys are derived from the names and stay the same across "
+    "exports",
+)
+@click.option(
+    "--promote-meta",
+    is_flag=True,
+    help="Lift filename and lineno out of the meta jsonb of entry_base and posting "
+    "into columns of their own for PGCOPY format, meta is null when no other key "
+    "is left",
+)
+@click.option(
+    "--meta-column",
+    "meta_columns",
+    multiple=True,
+    callback=parse_meta_columns,
+    help="Lift a meta key into a column of entry_base and posting with the given "
+    "type, like receipt=varchar, types are varchar, int4, int8, numeric, date and "
+    "bool. Values not fitting the type stay in meta. It can be given more than once",
+)
+@click.option(
+    "--parse-cache-dir",
+    type=click.Path(dir_okay=True, file_okay=False),
+    default=None,
+    envvar="PARSE_CACHE_DIR",
+    help="Directory caching the parse result of each ledger file, so that only the "
+    "files changed since the previous run are parsed again. Booking, plugins and "
+    "validations still run on all the entries",
+)
+@click.option(
+    "--parse-cache-key",
+    type=click.Choice(CacheKey),
+    default=CacheKey.CONTENT,
+    help="How changed files are detected by the parse cache, CONTENT hashes the "
+    "files, MTIME compares their modification time and size",
+)
+@click.option(
+    "--load-cache-dir",
+    type=click.Path(dir_okay=True, file_okay=False),
+    default=None,
+    envvar="LOAD_CACHE_DIR",
+    help="Directory caching the loaded entries, errors and options of the ledger, "
+    "used instead of beancount's cache written next to the ledger. It's used as "
+    "long as the ledger files, the names in their directories, the plugins, and "
+    "the beancount version stay the same",
+)
+@click.option(
+    "--load-cache-key",
+    type=click.Choice(CacheKey),
+    default=CacheKey.CONTENT,
+    help="How changed ledger files are detected by the load cache, CONTENT hashes "
+    "the files, MTIME compares their modification time and size",
+)
+@click.option(
+    "--from-snapshot",
+    is_flag=True,
+    help="FILENAME is a snapshot written by beancount_exporter.snapshot instead of "
+    "a ledger, its entries are exported without loading the ledger again",
+)
+@click.option(
+    "--parse-jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of worker processes parsing the included ledger files, the parsed "
+    "entries and errors are merged in the same order as parsing them one by one",
+)
+@click.option(
+    "--validation-level",
+    type=click.Choice(ValidationLevel, case_sensitive=False),
+    default=ValidationLevel.HARDCORE,
+    help="Validations of the loaded entries, NONE skips them all, DEFAULT runs the "
+    "ones beancount always runs, HARDCORE runs the extra heavy ones too",
+)
+@click.option(
+    "--background-validation",
+    is_flag=True,
+    help="Run the heavy validations of HARDCORE level in a separate process while "
+    "the entries are exported, their errors are written after the entries for "
+    "PGCOPY format",
+)
 def main(
     filename: str,
     base_path: click.Path,
@@ -62,50 +443,166 @@ def main(
     disable_options: bool,
     disable_validations: bool,
     disable_entries: bool,
+    value_cache_size: int,
+    id_strategy: IdStrategy,
+    background_writes: bool,
+    jobs: int,
+    shards: int,
+    shard_key: ShardKey,
+    partition_by: PartitionBy | None,
+    database_url: str | None,
+    database_schema: str | None,
+    commit_mode: CommitMode,
+    max_connections: int,
+    fifo: bool,
+    fifo_timeout: float,
+    fingerprints: bool,
+    delta_from: click.Path | None,
+    reproducible: bool,
+    sort_keys: SortKeys,
+    sort_buffer_size: int,
+    spill_dir: click.Path | None,
+    normalize: bool,
+    promote_meta: bool,
+    meta_columns: tuple[MetaColumn, ...],
+    parse_cache_dir: click.Path | None,
+    parse_cache_key: CacheKey,
+    load_cache_dir: click.Path | None,
+    load_cache_key: CacheKey,
+    from_snapshot: bool,
+    parse_jobs: int,
+    validation_level: ValidationLevel,
+    background_validation: bool,
 ):
     logging.basicConfig(level=logging.INFO, format="%(levelname)-8s: %(message)s")
-
-    entries, errors, options_map = loader.load_file(
-        filename,
-        log_timings=logging.info,
-        log_errors=sys.stderr,
-        extra_validations=validation.HARDCORE_VALIDATIONS,
-    )
+    context = click.get_current_context()
+    if format != ExportFormat.PGCOPY:
+        pgcopy_options = [
+            param.opts[-1]
+            for param in context.command.params
+            if param.name in PGCOPY_OPTIONS
+            and context.get_parameter_source(param.name) != ParameterSource.DEFAULT
+        ]
+        if pgcopy_options:
+            raise click.UsageError(
+                f"{', '.join(pgcopy_options)} can only be used with --format PGCOPY"
+            )
+    if reproducible:
+        if format != ExportFormat.PGCOPY:
+            raise click.UsageError("--reproducible requires --format PGCOPY")
+        if context.get_parameter_source("id_strategy") == ParameterSource.DEFAULT:
+            id_strategy = IdStrategy.CONTENT
+        elif not make_id_allocator(id_strategy).deterministic:
+            raise click.UsageError(
+                "--reproducible requires --id-strategy CONTENT or SEQUENCE"
+            )
+    if from_snapshot and (
+        parse_cache_dir is not None or parse_jobs > 1 or load_cache_dir is not None
+    ):
+        raise click.UsageError(
+            "--from-snapshot can't be used with --parse-cache-dir, --parse-jobs or "
+            "--load-cache-dir"
+        )
+    if background_validation:
+        if format != ExportFormat.PGCOPY:
+            raise click.UsageError("--background-validation requires --format PGCOPY")
+        if validation_level != ValidationLevel.HARDCORE:
+            raise click.UsageError(
+                "--background-validation requires --validation-level HARDCORE"
+            )
+    if from_snapshot:
+        if (
+            context.get_parameter_source("validation_level") != ParameterSource.DEFAULT
+            or background_validation
+        ):
+            raise click.UsageError(
+                "--from-snapshot can't be used with --validation-level or "
+                "--background-validation, snapshots are validated when written"
+            )
 
     strip_paths = not disable_path_stripping
+    pgcopy_export = None
+    if format == ExportFormat.PGCOPY:
+        pgcopy_export = PgCopyExport(
+            pathlib.Path(str(output_dir)),
+            id_strategy,
+            PgCopyOptions(
+                value_cache_size=value_cache_size,
+                background_writes=background_writes,
+                jobs=jobs,
+                shard_key=shard_key,
+                partition_by=partition_by,
+                partition_shards=shards,
+                reproducible=reproducible,
+                sort_keys=sort_keys,
+                sort_buffer_size=sort_buffer_size << 20,
+                spill_dir=str(spill_dir) if spill_dir is not None else None,
+                normalize=normalize,
+                meta_columns=(*DEFAULT_META_COLUMNS, *meta_columns)
+                if promote_meta
+                else meta_columns,
+            ),
+            database_url=database_url,
+            database_schema=database_schema,
+            commit_mode=commit_mode,
+            max_connections=max_connections,
+            fifo=fifo,
+            fifo_timeout=fifo_timeout,
+            fingerprints=fingerprints,
+            delta_from=pathlib.Path(str(delta_from))
+            if delta_from is not None
+            else None,
+            strip_paths=strip_paths,
+        )
+
+    if from_snapshot:
+        with open(filename, "rb") as fo, misc_utils.log_time(
+            "load_snapshot", logging.info
+        ):
+            try:
+                entries, errors, options_map = load_snapshot(fo)
+            except ValueError as exc:
+                raise click.UsageError(f"Invalid snapshot {filename}: {exc}") from exc
+        printer.print_errors(errors, file=sys.stderr)
+    else:
+        entries, errors, options_map = load_ledger(
+            filename,
+            parse_cache_dir=parse_cache_dir,
+            parse_cache_key=parse_cache_key,
+            parse_jobs=parse_jobs,
+            load_cache_dir=load_cache_dir,
+            load_cache_key=load_cache_key,
+            # the heavy ones run in the background below
+            validation_level=ValidationLevel.DEFAULT
+            if background_validation
+            else validation_level,
+        )
+
     base_path_value = pathlib.Path(str(base_path))
     path_cache: dict[str, str] = {}
     with contextlib.ExitStack() as stack:
-        if format == ExportFormat.JSON:
+        background_validator = None
+        if background_validation:
+            background_validator = stack.enter_context(
+                BackgroundValidator(
+                    entries,
+                    options_map,
+                    get_extra_validations(ValidationLevel.HARDCORE),
+                )
+            )
+        if pgcopy_export is None:
             processor = JsonProcessor(
                 base_path=base_path_value,
                 strip_paths=strip_paths,
                 path_cache=path_cache,
             )
-        elif format == ExportFormat.PGCOPY:
-            output_dir_path = pathlib.Path(str(output_dir))
-            processor = PgCopyProcessor(
+        else:
+            processor = pgcopy_export.open(
+                stack,
+                entries,
                 base_path=base_path_value,
                 strip_paths=strip_paths,
                 path_cache=path_cache,
-                option_maps_file=stack.enter_context(
-                    open(output_dir_path / "option_maps.json", "wb")
-                ),
-                errors_file=stack.enter_context(
-                    open(output_dir_path / "errors.json", "wb")
-                ),
-                entry_base_file=stack.enter_context(
-                    open(output_dir_path / "entry_base.bin", "wb")
-                ),
-                posting_file=stack.enter_context(
-                    open(output_dir_path / "posting.bin", "wb")
-                ),
-                entry_files={
-                    entry_type: stack.enter_context(
-                        open(output_dir_path / f"{config.type.value}.bin", "wb")
-                    )
-                    for entry_type, config in ENTRY_TYPE_CONFIGS.items()
-                },
             )
         processor.start()
         options = options_map.copy()
@@ -115,11 +612,26 @@ def main(
         del options["dcontext"]
         if not disable_options:
             processor.process_options(options)
-        if not disable_validations:
+        if not disable_validations and background_validator is None:
             processor.process_errors(errors)
+        elif not disable_validations:
+            # errors share the meta of the entries, whose filename is stripped in
+            # place while the entries are exported, keep it for writing the errors
+            # after the entries
+            errors = copy.deepcopy(errors)
         if not disable_entries:
             processor.process_entries(entries)
+        if background_validator is not None:
+            with misc_utils.log_time("background_validation", logging.info):
+                background_errors = background_validator.errors()
+            printer.print_errors(background_errors, file=sys.stderr)
+            # same order as validating them before the export
+            errors = errors + background_errors
+            if not disable_validations:
+                processor.process_errors(errors)
         processor.stop()
+        if pgcopy_export is not None:
+            pgcopy_export.finish(processor)
 
     exit(1 if errors else 0)
 
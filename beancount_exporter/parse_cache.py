@@ -0,0 +1,169 @@
+import contextlib
+import enum
+import hashlib
+import logging
+import os
+import pathlib
+import pickle
+import platform
+import tempfile
+import typing
+
+import beancount
+
+from .loading import parse_files
+from .loading import ParseFiles
+from .loading import ParseResult
+
+# bump it whenever the cached parse results are no longer compatible
+PARSE_CACHE_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+@enum.unique
+class CacheKey(enum.StrEnum):
+    """How changed files are detected by the caches"""
+
+    # hash of the file content
+    CONTENT = "CONTENT"
+    # modification time and size of the file, cheaper but it misses changes keeping
+    # both of them
+    MTIME = "MTIME"
+
+
+def file_key(filename: str, key: CacheKey) -> tuple:
+    """Key of a file, it changes whenever the file changes"""
+    if key == CacheKey.MTIME:
+        stat = os.stat(filename)
+        return (key.value, stat.st_mtime_ns, stat.st_size)
+    with open(filename, "rb") as fo:
+        digest = hashlib.file_digest(fo, "blake2b").hexdigest()
+    return (key.value, digest)
+
+
+@contextlib.contextmanager
+def atomic_write(path: pathlib.Path) -> typing.Generator[typing.BinaryIO, None, None]:
+    """Open a temporary file replacing the file at the path once it's written, so
+    that the file is never read half written
+
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fo:
+            yield fo
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class ParseCacheStats(typing.NamedTuple):
+    # files with a valid cached parse result
+    hits: int
+    # files parsed, including the invalidated ones
+    misses: int
+    # files with a stale or unreadable cached parse result
+    invalidations: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ParseCache:
+    """Caches the parse result of each file of a ledger on disk, so that only the
+    changed files are parsed again
+
+    Only the parse results are cached, booking, plugins and validations run on the
+    merged entries every time, see `beancount_exporter.loading.load_file`.
+
+    """
+
+    def __init__(
+        self,
+        cache_dir: pathlib.Path,
+        key: CacheKey = CacheKey.CONTENT,
+        encoding: str | None = None,
+        parse_misses: ParseFiles | None = None,
+    ):
+        """
+        :param parse_misses: parses the files without a valid cached parse result,
+            like `ParallelParser.parse_files`, defaults to parsing them one by one
+        """
+        self.cache_dir = cache_dir
+        self.key = key
+        self.encoding = encoding
+        self.parse_misses = parse_misses
+        self.header = dict(
+            version=PARSE_CACHE_VERSION,
+            beancount=beancount.__version__,
+            python=platform.python_version(),
+            encoding=encoding,
+        )
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def stats(self) -> ParseCacheStats:
+        return ParseCacheStats(
+            hits=self.hits, misses=self.misses, invalidations=self.invalidations
+        )
+
+    def cache_path(self, filename: str) -> pathlib.Path:
+        name = hashlib.blake2b(filename.encode("utf8"), digest_size=16).hexdigest()
+        return self.cache_dir / f"{name}.pickle"
+
+    def _load(self, cache_path: pathlib.Path, header: dict) -> ParseResult | None:
+        """Cached parse result, None if there's none matching the header"""
+        try:
+            with open(cache_path, "rb") as fo:
+                if pickle.load(fo) != header:
+                    return None
+                return pickle.load(fo)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Discarding unreadable parse cache %s", cache_path)
+            return None
+
+    def _dump(self, cache_path: pathlib.Path, header: dict, result: ParseResult):
+        with atomic_write(cache_path) as fo:
+            pickle.dump(header, fo, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(result, fo, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def parse_files(self, filenames: list[str]) -> list[ParseResult]:
+        """Parse files, or return their cached parse results if they haven't
+        changed
+
+        """
+        results: list[ParseResult | None] = []
+        misses = []
+        for filename in filenames:
+            cache_path = self.cache_path(filename)
+            header = dict(
+                self.header, filename=filename, key=file_key(filename, self.key)
+            )
+            result = self._load(cache_path, header)
+            if result is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if cache_path.exists():
+                    self.invalidations += 1
+                misses.append((len(results), cache_path, header))
+            results.append(result)
+        if not misses:
+            return results
+        miss_filenames = [filenames[index] for index, _, _ in misses]
+        if self.parse_misses is not None:
+            parsed = self.parse_misses(miss_filenames)
+        else:
+            parsed = parse_files(miss_filenames, encoding=self.encoding)
+        for (index, cache_path, header), result in zip(misses, parsed):
+            # dump it before the entries are mutated by booking and plugins
+            self._dump(cache_path, header, result)
+            results[index] = result
+        return results
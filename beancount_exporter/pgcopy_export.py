@@ -0,0 +1,318 @@
+import contextlib
+import hashlib
+import logging
+import os
+import pathlib
+import typing
+
+import click
+import orjson
+from beancount.core import data
+
+from .formats.pgcopy_processor import PgCopyProcessor
+from .formats.pgcopy_processor.configs import ENTRY_TYPE_CONFIGS
+from .formats.pgcopy_processor.database import CommitMode
+from .formats.pgcopy_processor.database import CopyTarget
+from .formats.pgcopy_processor.database import count_connections
+from .formats.pgcopy_processor.database import DEFAULT_MAX_CONNECTIONS
+from .formats.pgcopy_processor.delta import APPLY_DELTA_FILENAME
+from .formats.pgcopy_processor.delta import DELETED_ENTRIES_FILENAME
+from .formats.pgcopy_processor.delta import DeltaTracker
+from .formats.pgcopy_processor.delta import FINGERPRINTS_FILENAME
+from .formats.pgcopy_processor.delta import load_fingerprints
+from .formats.pgcopy_processor.delta import make_apply_delta_sql
+from .formats.pgcopy_processor.delta import make_fingerprint_header
+from .formats.pgcopy_processor.delta import write_deleted_ids
+from .formats.pgcopy_processor.dimensions import Dimension
+from .formats.pgcopy_processor.fifo import DEFAULT_FIFO_TIMEOUT
+from .formats.pgcopy_processor.fifo import FifoWriter
+from .formats.pgcopy_processor.fifo import ProgressClock
+from .formats.pgcopy_processor.ids import IdStrategy
+from .formats.pgcopy_processor.ids import make_id_allocator
+from .formats.pgcopy_processor.load_plan import list_table_files
+from .formats.pgcopy_processor.manifest import make_manifest
+from .formats.pgcopy_processor.manifest import MANIFEST_FILENAME
+from .formats.pgcopy_processor.manifest import table_filenames
+from .formats.pgcopy_processor.options import PgCopyOptions
+from .formats.pgcopy_processor.schema import make_table_schemas
+from .formats.pgcopy_processor.sorting import check_sort_keys
+
+
+class PgCopyExport:
+    """Sets up the PGCOPY processor of an export, with the table files or COPY
+    streams it writes into, and writes the manifest, fingerprints and delta files
+    after the entries
+
+    The options are checked when it's created, so that invalid ones are rejected
+    before the ledger is loaded.
+
+    """
+
+    def __init__(
+        self,
+        output_dir: pathlib.Path,
+        id_strategy: IdStrategy,
+        options: PgCopyOptions,
+        database_url: str | None = None,
+        database_schema: str | None = None,
+        commit_mode: CommitMode = CommitMode.TABLE,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        fifo: bool = False,
+        fifo_timeout: float = DEFAULT_FIFO_TIMEOUT,
+        fingerprints: bool = False,
+        delta_from: pathlib.Path | None = None,
+        strip_paths: bool = True,
+    ):
+        """
+        :param fingerprints: write fingerprints of the entries for a later delta
+            export, see `DeltaTracker`
+        :param delta_from: fingerprints of the previous export, only the entries
+            changed since then are written
+        :raise click.UsageError: if the options don't work together
+        """
+        if fifo and database_url is not None:
+            raise click.UsageError("--fifo can't be used with --database-url")
+        if fifo and not hasattr(os, "mkfifo"):
+            raise click.UsageError("--fifo is not supported on this platform")
+        if options.sort_keys and options.jobs > 1:
+            raise click.UsageError("--sort-key requires --jobs 1")
+        if options.jobs > 1 and (
+            options.background_writes or fifo or database_url is not None
+        ):
+            # worker processes are forked, which isn't safe while writer, FIFO or
+            # COPY threads hold locks or connections
+            raise click.UsageError(
+                "--jobs can't be used with --background-writes, --fifo or "
+                "--database-url"
+            )
+        if fingerprints or delta_from is not None:
+            if id_strategy != IdStrategy.CONTENT:
+                raise click.UsageError(
+                    "--fingerprints and --delta-from require --id-strategy CONTENT"
+                )
+            if options.jobs > 1:
+                raise click.UsageError(
+                    "--fingerprints and --delta-from require --jobs 1"
+                )
+            if database_url is not None:
+                raise click.UsageError(
+                    "--fingerprints and --delta-from can't be used with --database-url"
+                )
+        try:
+            self.table_schemas = make_table_schemas(
+                make_id_allocator(id_strategy).type_name,
+                normalized=options.normalize,
+                meta_columns=options.meta_columns,
+            )
+            check_sort_keys(
+                options.sort_keys or {},
+                {schema.name: schema.table for schema in self.table_schemas},
+            )
+        except ValueError as exc:
+            raise click.UsageError(str(exc)) from exc
+
+        self.output_dir = output_dir
+        self.id_strategy = id_strategy
+        self.options = options
+        self.database_url = database_url
+        self.database_schema = database_schema
+        self.commit_mode = commit_mode
+        self.max_connections = max_connections
+        self.fifo = fifo
+        self.fifo_timeout = fifo_timeout
+        self.delta_from = delta_from
+        self.fingerprint_header = (
+            make_fingerprint_header(self.table_schemas, strip_paths=strip_paths)
+            if fingerprints or delta_from is not None
+            else None
+        )
+        self.delta: DeltaTracker | None = None
+        # hash of the fingerprints the delta is written against
+        self.delta_base: str | None = None
+        self.copy_target: CopyTarget | None = None
+        self.fifo_writers: list[FifoWriter] = []
+        self._fifo_clock = ProgressClock()
+
+    def _open_copy_target(self, stack: contextlib.ExitStack, entries: data.Entries):
+        assert self.database_url is not None
+        connection_count = count_connections(
+            entries,
+            shards=self.options.partition_shards,
+            partition_by=self.options.partition_by,
+            dimension_count=len(Dimension) if self.options.normalize else 0,
+        )
+        if connection_count > self.max_connections:
+            raise click.UsageError(
+                f"--database-url needs {connection_count} connections for the "
+                f"tables, shards and partitions, more than --max-connections "
+                f"{self.max_connections}. Use fewer --shards, a coarser "
+                "--partition-by or a higher --max-connections"
+            )
+        self.copy_target = CopyTarget(
+            self.database_url,
+            commit_mode=self.commit_mode,
+            schema=self.database_schema,
+            max_connections=self.max_connections,
+        )
+        # roll back the COPY commands if the export fails
+        stack.callback(self.copy_target.abort)
+
+    def _open_table_files(
+        self, stack: contextlib.ExitStack, table: str, partition: str | None = None
+    ) -> typing.BinaryIO | list[typing.BinaryIO]:
+        shards = self.options.partition_shards
+        if self.copy_target is not None:
+            files = [self.copy_target.open(table, partition) for _ in range(shards)]
+        elif self.fifo:
+            files = [
+                stack.enter_context(
+                    FifoWriter(
+                        self.output_dir / filename,
+                        timeout=self.fifo_timeout,
+                        clock=self._fifo_clock,
+                    )
+                )
+                for filename in table_filenames(table, shards, partition)
+            ]
+            self.fifo_writers.extend(files)
+        else:
+            files = [
+                stack.enter_context(open(self.output_dir / filename, "wb"))
+                for filename in table_filenames(table, shards, partition)
+            ]
+        return files if shards > 1 else files[0]
+
+    def open(
+        self,
+        stack: contextlib.ExitStack,
+        entries: data.Entries,
+        **kwargs: typing.Any,
+    ) -> PgCopyProcessor:
+        """Open the table files, and make the processor writing into them
+
+        :param stack: closes the files, or rolls back the COPY commands if the
+            export fails
+        :param entries: entries to export, for checking the number of COPY
+            connections up front
+        :param kwargs: other arguments of `PgCopyProcessor`, like `base_path`
+        """
+        if self.fingerprint_header is not None:
+            previous = None
+            if self.delta_from is not None:
+                previous = load_fingerprints(self.delta_from, self.fingerprint_header)
+                if previous is not None:
+                    self.delta_base = hashlib.blake2b(
+                        self.delta_from.read_bytes(), digest_size=16
+                    ).hexdigest()
+            self.delta = DeltaTracker(previous)
+        if self.database_url is not None:
+            self._open_copy_target(stack, entries)
+
+        def open_table_files(
+            table: str, partition: str | None = None
+        ) -> typing.BinaryIO | list[typing.BinaryIO]:
+            return self._open_table_files(stack, table, partition)
+
+        table_files = {}
+        if self.options.partition_by is None:
+            table_files = dict(
+                entry_base_file=open_table_files("entry_base"),
+                posting_file=open_table_files("posting"),
+                entry_files={
+                    entry_type: open_table_files(config.type.value)
+                    for entry_type, config in ENTRY_TYPE_CONFIGS.items()
+                },
+            )
+        processor = PgCopyProcessor(
+            option_maps_file=stack.enter_context(
+                open(self.output_dir / "option_maps.json", "wb")
+            ),
+            errors_file=stack.enter_context(
+                open(self.output_dir / "errors.json", "wb")
+            ),
+            **table_files,
+            id_allocator=make_id_allocator(self.id_strategy),
+            options=self.options,
+            open_partition_files=open_table_files,
+            delta=self.delta,
+            dimension_files={
+                dimension: open_table_files(dimension.value) for dimension in Dimension
+            }
+            if self.options.normalize
+            else None,
+            **kwargs,
+        )
+        if processor.background_writer is not None:
+            # make sure the writer thread is done before closing the files
+            stack.callback(processor.background_writer.stop)
+        return processor
+
+    def finish(self, processor: PgCopyProcessor):
+        """Commit the COPY commands or end the FIFOs, then write the manifest and
+        the delta files, it's called after the processor is stopped
+
+        """
+        if self.copy_target is not None:
+            self.copy_target.commit()
+        # end all FIFOs before waiting for any of them, as consumers may read them
+        # in any order
+        for fifo_writer in self.fifo_writers:
+            fifo_writer.finish()
+        options = self.options
+        if self.delta_base is None:
+            # delta files of a previous export in the same directory would make it
+            # look like a delta export
+            for filename in (DELETED_ENTRIES_FILENAME, APPLY_DELTA_FILENAME):
+                (self.output_dir / filename).unlink(missing_ok=True)
+        manifest = make_manifest(
+            processor.table_writers,
+            id_strategy=self.id_strategy,
+            shard_key=options.shard_key,
+            partition_by=options.partition_by,
+            sort_keys=options.sort_keys or {},
+            normalized=options.normalize,
+            meta_columns=[list(meta_column) for meta_column in options.meta_columns],
+            delta=self.delta_base is not None,
+            delta_base=self.delta_base,
+        )
+        (self.output_dir / MANIFEST_FILENAME).write_bytes(
+            orjson.dumps(manifest, option=orjson.OPT_INDENT_2)
+        )
+        delta = self.delta
+        if delta is not None:
+            (self.output_dir / FINGERPRINTS_FILENAME).write_bytes(
+                delta.dump(self.fingerprint_header)
+            )
+        if delta is not None and self.delta_base is not None:
+            deleted_ids = delta.deleted_ids()
+            with open(self.output_dir / DELETED_ENTRIES_FILENAME, "wb") as fo:
+                write_deleted_ids(fo, deleted_ids)
+            (self.output_dir / APPLY_DELTA_FILENAME).write_text(
+                make_apply_delta_sql(
+                    self.table_schemas,
+                    list_table_files(self.table_schemas, manifest),
+                    self.database_schema,
+                )
+            )
+            logging.info(
+                "Delta: %d entries unchanged, %d moved, %d new or changed, %d "
+                "deleted or replaced",
+                delta.unchanged_count,
+                delta.moved_count,
+                len(delta.fingerprints) - delta.unchanged_count - delta.moved_count,
+                len(deleted_ids),
+            )
+        if (
+            processor.value_cache is not None
+            # caches of the worker processes are not collected
+            and options.jobs == 1
+        ):
+            stats = processor.value_cache.stats()
+            logging.info(
+                "Value cache: %d hits, %d misses, hit rate %.2f%%, size %d/%d",
+                stats.hits,
+                stats.misses,
+                stats.hit_rate * 100,
+                stats.size,
+                stats.maxsize,
+            )
@@ -0,0 +1,116 @@
+"""Snapshots of loaded ledgers
+
+A snapshot holds the entries, errors and options map returned by
+`beancount.loader.load_file`, so that the ledger can be exported many times while it's
+loaded only once:
+
+    python -m beancount_exporter.snapshot main.bean main.snapshot
+    python -m beancount_exporter.main --from-snapshot main.snapshot -f PGCOPY
+
+Snapshots are pickled, only load the ones written by yourself.
+
+"""
+import gc
+import hashlib
+import logging
+import pickle
+import platform
+import struct
+import sys
+import typing
+
+import beancount
+import click
+import orjson
+from beancount import loader
+from beancount.ops import validation
+
+from .loading import ParseResult
+
+SNAPSHOT_MAGIC = b"BCEXSNAP"
+# bump it whenever snapshots written before are no longer readable
+SNAPSHOT_VERSION = 1
+# magic, version and header length
+SNAPSHOT_PREFIX = struct.Struct(f">{len(SNAPSHOT_MAGIC)}sII")
+
+
+def make_snapshot_header(payload: bytes) -> dict[str, typing.Any]:
+    return dict(
+        beancount=beancount.__version__,
+        python=platform.python_version(),
+        size=len(payload),
+        digest=hashlib.blake2b(payload, digest_size=16).hexdigest(),
+    )
+
+
+def dump_snapshot(file: typing.BinaryIO, result: ParseResult):
+    """Write a snapshot of loaded entries, errors and options map"""
+    payload = pickle.dumps(tuple(result), protocol=pickle.HIGHEST_PROTOCOL)
+    header = orjson.dumps(make_snapshot_header(payload))
+    file.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+    file.write(header)
+    file.write(payload)
+
+
+def load_snapshot(file: typing.BinaryIO) -> ParseResult:
+    """Read a snapshot written by `dump_snapshot`
+
+    :raise ValueError: if it's not a snapshot, it's corrupted, or it's written by
+        another version of the exporter, beancount or python
+    """
+    prefix = file.read(SNAPSHOT_PREFIX.size)
+    if len(prefix) < SNAPSHOT_PREFIX.size:
+        raise ValueError("Not a snapshot, it's too short")
+    magic, version, header_size = SNAPSHOT_PREFIX.unpack(prefix)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Not a snapshot, magic bytes don't match")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(
+            f"Snapshot version {version} is not supported, expected {SNAPSHOT_VERSION}"
+        )
+    try:
+        header = orjson.loads(file.read(header_size))
+    except orjson.JSONDecodeError as exc:
+        raise ValueError("Snapshot is corrupted, invalid header") from exc
+    payload = file.read()
+    if not isinstance(header, dict):
+        raise ValueError("Snapshot is corrupted, invalid header")
+    expected = make_snapshot_header(payload)
+    for key in ("beancount", "python"):
+        if header.get(key) != expected[key]:
+            raise ValueError(
+                f"Snapshot is written with {key} {header.get(key)}, but this is "
+                f"{key} {expected[key]}"
+            )
+    if header != expected:
+        raise ValueError("Snapshot is corrupted, content doesn't match its digest")
+    # the loaded objects are all alive, so collecting them while they are created
+    # only slows down the loading
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        entries, errors, options_map = pickle.loads(payload)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return entries, errors, options_map
+
+
+@click.command()
+@click.argument("filename", type=click.Path(exists=True))
+@click.argument("snapshot", type=click.Path(dir_okay=False))
+def main(filename: str, snapshot: str):
+    """Load the ledger FILENAME and write a snapshot of it to SNAPSHOT"""
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s: %(message)s")
+    result = loader.load_file(
+        filename,
+        log_timings=logging.info,
+        log_errors=sys.stderr,
+        extra_validations=validation.HARDCORE_VALIDATIONS,
+    )
+    with open(snapshot, "wb") as fo:
+        dump_snapshot(fo, result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import enum
+import typing
+
+from beancount.core import data
+from beancount.ops import validation
+
+from .formats.pgcopy_processor.parallel import get_context
+
+# Validation function, see `beancount.ops.validation.validate`
+Validation = typing.Callable[[data.Entries, dict[str, typing.Any]], list]
+
+
+@enum.unique
+class ValidationLevel(enum.StrEnum):
+    # no validation at all, only errors of parsing, booking and plugins
+    NONE = "NONE"
+    # validations beancount always runs
+    DEFAULT = "DEFAULT"
+    # plus `beancount.ops.validation.HARDCORE_VALIDATIONS`
+    HARDCORE = "HARDCORE"
+
+
+def get_extra_validations(level: ValidationLevel) -> list[Validation] | None:
+    """Validations of the level run on top of the default ones"""
+    if level == ValidationLevel.HARDCORE:
+        return validation.HARDCORE_VALIDATIONS
+    return None
+
+
+_worker_state: tuple[data.Entries, dict[str, typing.Any]] | None = None
+
+
+def init_worker(entries: data.Entries, options_map: dict[str, typing.Any]):
+    global _worker_state
+    _worker_state = (entries, options_map)
+
+
+def run_validations(validations: list[Validation]) -> list:
+    assert _worker_state is not None
+    entries, options_map = _worker_state
+    errors = []
+    for validation_function in validations:
+        errors.extend(validation_function(entries, options_map))
+    return errors
+
+
+class BackgroundValidator:
+    """Runs validations in a worker process, so that they run while the entries are
+    exported
+
+    The worker shares the entries by forking when it can, otherwise they are
+    pickled when it starts. Either way, it validates the entries as they are when
+    the validator is created.
+
+    """
+
+    def __init__(
+        self,
+        entries: data.Entries,
+        options_map: dict[str, typing.Any],
+        validations: list[Validation],
+    ):
+        context, _ = get_context()
+        self._pool = context.Pool(
+            1, initializer=init_worker, initargs=(entries, options_map)
+        )
+        self._result = self._pool.apply_async(run_validations, (validations,))
+        self._pool.close()
+
+    def __enter__(self) -> "BackgroundValidator":
+        return self
+
+    def __exit__(self, *exc_info):
+        self._pool.terminate()
+        self._pool.join()
+
+    def errors(self) -> list:
+        """Wait for the validations, and return their errors"""
+        errors = self._result.get()
+        self._pool.join()
+        return errors
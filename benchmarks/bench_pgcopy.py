@@ -0,0 +1,156 @@
+"""Benchmarks of PGCOPY export on a generated ledger
+
+Usage:
+
+    python -m benchmarks.bench_pgcopy --transactions 100000
+
+With `--database-url`, the exported posting table is also COPY-ed into a temporary
+table with a primary key on `id`, to show the effect of the id strategy on index
+maintenance. The export is also run with 1, 2, 4, ... up to `--max-jobs` worker
+processes to show how it scales with the number of cores.
+
+"""
+import contextlib
+import datetime
+import io
+import os
+import random
+import time
+import typing
+
+import click
+from beancount import loader
+from beancount.core import data
+
+from beancount_exporter.formats.pgcopy_processor import PgCopyProcessor
+from beancount_exporter.formats.pgcopy_processor.configs import ENTRY_TYPE_CONFIGS
+from beancount_exporter.formats.pgcopy_processor.ids import IdStrategy
+from beancount_exporter.formats.pgcopy_processor.ids import make_id_allocator
+from beancount_exporter.formats.pgcopy_processor.options import PgCopyOptions
+
+ACCOUNTS = [
+    "Assets:Checking",
+    "Assets:Savings",
+    "Liabilities:CreditCard",
+    "Expenses:Grocery",
+    "Expenses:Restaurant",
+    "Expenses:Rent",
+    "Expenses:Transport",
+    "Income:Salary",
+]
+
+
+def generate_ledger(transactions: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines = [f"1970-01-01 open {account}" for account in ACCOUNTS]
+    start = datetime.date(2010, 1, 1)
+    for index in range(transactions):
+        date = start + datetime.timedelta(days=index * 3650 // max(transactions, 1))
+        account, other = rng.sample(ACCOUNTS, 2)
+        number = rng.choice(["1", "5.99", "12.50", "100", f"{rng.random() * 1000:.2f}"])
+        lines.append(f'{date} * "Payee {index % 97}" "Narration {index % 389}"')
+        lines.append(f"    {account}  {number} USD")
+        lines.append(f"    {other}")
+    return "\n".join(lines) + "\n"
+
+
+def load_ledger(transactions: int) -> data.Entries:
+    entries, errors, _ = loader.load_string(generate_ledger(transactions))
+    assert not errors, errors
+    return entries
+
+
+@contextlib.contextmanager
+def timed(label: str) -> typing.Generator[None, None, None]:
+    start = time.perf_counter()
+    yield
+    click.echo(f"{label:<40} {time.perf_counter() - start:8.3f}s")
+
+
+def export(entries: data.Entries, **kwargs) -> dict[str, io.BytesIO]:
+    files = dict(
+        entry_base_file=io.BytesIO(),
+        posting_file=io.BytesIO(),
+        entry_files={entry_type: io.BytesIO() for entry_type in ENTRY_TYPE_CONFIGS},
+    )
+    processor = PgCopyProcessor(
+        base_path=None,
+        strip_paths=False,
+        option_maps_file=io.BytesIO(),
+        errors_file=io.BytesIO(),
+        **files,
+        **kwargs,
+    )
+    processor.start()
+    processor.process_entries(entries)
+    processor.stop()
+    return files
+
+
+def copy_postings(database_url: str, strategy: IdStrategy, posting: bytes):
+    import psycopg2
+
+    id_type = "bigint" if strategy == IdStrategy.SEQUENCE else "uuid"
+    with contextlib.closing(psycopg2.connect(database_url)) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            CREATE TEMPORARY TABLE posting (
+                id {id_type} PRIMARY KEY,
+                transaction_id {id_type} NOT NULL,
+                account varchar NOT NULL,
+                units_number numeric,
+                units_currency varchar NOT NULL,
+                price_number numeric,
+                price_currency varchar,
+                cost_number numeric,
+                cost_currency varchar,
+                cost_date date,
+                cost_label varchar,
+                cost_number_per numeric,
+                cost_number_total numeric,
+                cost_merge boolean,
+                flag varchar,
+                meta jsonb
+            )
+            """
+        )
+        with timed(f"COPY posting ({strategy})"):
+            cursor.copy_expert(
+                "COPY posting FROM STDIN WITH (FORMAT BINARY)", io.BytesIO(posting)
+            )
+        conn.rollback()
+
+
+@click.command()
+@click.option("--transactions", type=int, default=100000)
+@click.option("--database-url", type=str, default=None)
+@click.option("--max-jobs", type=click.IntRange(min=1), default=os.cpu_count())
+def main(transactions: int, database_url: str | None, max_jobs: int):
+    with timed(f"load {transactions} transactions"):
+        entries = load_ledger(transactions)
+
+    with timed("export (generic formatters)"):
+        export(entries, options=PgCopyOptions(use_row_encoders=False))
+    with timed("export (row encoders)"):
+        export(entries)
+    with timed("export (row encoders, value cache)"):
+        export(entries, options=PgCopyOptions(value_cache_size=65536))
+
+    for strategy in IdStrategy:
+        with timed(f"export ({strategy} ids)"):
+            files = export(entries, id_allocator=make_id_allocator(strategy))
+        if database_url is not None:
+            copy_postings(database_url, strategy, files["posting_file"].getvalue())
+
+    jobs = 1
+    while True:
+        with timed(f"export ({jobs} jobs)"):
+            export(entries, options=PgCopyOptions(jobs=jobs))
+        if jobs >= max_jobs:
+            break
+        jobs = min(jobs * 2, max_jobs)
+
+
+if __name__ == "__main__":
+    main()
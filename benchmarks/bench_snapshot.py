@@ -0,0 +1,51 @@
+"""Benchmarks of loading a generated ledger from a snapshot instead of the ledger,
+or from a plain pickle like beancount's cache
+
+Usage:
+
+    python -m benchmarks.bench_snapshot --transactions 100000
+
+"""
+import io
+import pathlib
+import pickle
+import tempfile
+
+import click
+from beancount import loader
+from beancount.ops import validation
+
+from beancount_exporter.snapshot import dump_snapshot
+from beancount_exporter.snapshot import load_snapshot
+from benchmarks.bench_pgcopy import generate_ledger
+from benchmarks.bench_pgcopy import timed
+
+
+@click.command()
+@click.option("--transactions", type=int, default=100000)
+def main(transactions: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ledger = pathlib.Path(tmp_dir) / "main.bean"
+        ledger.write_text(generate_ledger(transactions))
+        with timed(f"load_file {transactions} transactions"):
+            result = loader.load_file(
+                str(ledger),
+                extra_validations=validation.HARDCORE_VALIDATIONS,
+            )
+
+    file = io.BytesIO()
+    with timed("dump_snapshot"):
+        dump_snapshot(file, result)
+    click.echo(f"{'snapshot size':<40} {len(file.getvalue()) >> 20:8d}MB")
+    file.seek(0)
+    with timed("load_snapshot"):
+        load_snapshot(file)
+
+    # what beancount's own cache does, see `beancount.loader.pickle_cache_function`
+    pickled = pickle.dumps(result, protocol=-1)
+    with timed("pickle.loads"):
+        pickle.loads(pickled)
+
+
+if __name__ == "__main__":
+    main()
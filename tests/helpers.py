@@ -0,0 +1,120 @@
+import io
+import pathlib
+import struct
+import typing
+
+import pgcopy.copy
+from beancount import loader
+
+from beancount_exporter.formats.pgcopy_processor.configs import ENTRY_TYPE_CONFIGS
+from beancount_exporter.formats.pgcopy_processor.ids import ContentAllocator
+from beancount_exporter.formats.pgcopy_processor.options import PgCopyOptions
+from beancount_exporter.formats.pgcopy_processor.processor import PgCopyProcessor
+
+LEDGER = """\
+1970-01-01 open Assets:Cash
+1970-01-01 open Expenses:Grocery
+1970-01-02 * "Buy milk" "Wholefood"
+    Assets:Cash     -5.99 USD
+    Expenses:Grocery
+1970-01-03 * "Buy eggs" "Wholefood"
+    Assets:Cash     -3.49 USD
+    Expenses:Grocery
+1970-01-04 price BTC 123.45 USD
+"""
+
+
+class CountingBytesIO(io.BytesIO):
+    def __init__(self):
+        super().__init__()
+        self.write_count = 0
+
+    def write(self, data: bytes) -> int:
+        self.write_count += 1
+        return super().write(data)
+
+
+def export_tables(
+    base_path: pathlib.Path,
+    ledger: str = LEDGER,
+    shards: int = 1,
+    **kwargs: typing.Any,
+) -> dict[str, typing.Any]:
+    """Export ledger into in-memory files keyed by table name, lists of files with
+    more than one shard
+
+    """
+    entries, errors, _ = loader.load_string(ledger)
+    assert not errors
+    kwargs.setdefault("id_allocator", ContentAllocator())
+    options = PgCopyOptions(
+        **{key: kwargs.pop(key) for key in PgCopyOptions._fields if key in kwargs}
+    )
+
+    def make_files() -> CountingBytesIO | list[CountingBytesIO]:
+        if shards == 1:
+            return CountingBytesIO()
+        return [CountingBytesIO() for _ in range(shards)]
+
+    files = dict(
+        entry_base=make_files(),
+        posting=make_files(),
+        **{config.type.value: make_files() for config in ENTRY_TYPE_CONFIGS.values()},
+    )
+    processor = PgCopyProcessor(
+        base_path=base_path,
+        strip_paths=False,
+        option_maps_file=io.BytesIO(),
+        errors_file=io.BytesIO(),
+        entry_base_file=files["entry_base"],
+        posting_file=files["posting"],
+        entry_files={
+            entry_type: files[config.type.value]
+            for entry_type, config in ENTRY_TYPE_CONFIGS.items()
+        },
+        options=options,
+        **kwargs,
+    )
+    processor.start()
+    processor.process_entries(entries)
+    processor.stop()
+    return files
+
+
+def read_rows(stream: bytes) -> list[list[bytes | None]]:
+    """Read raw field values of rows from PGCOPY binary stream"""
+    assert stream.startswith(pgcopy.copy.BINCOPY_HEADER)
+    assert stream.endswith(pgcopy.copy.BINCOPY_TRAILER)
+    offset = len(pgcopy.copy.BINCOPY_HEADER)
+    rows = []
+    while True:
+        (field_count,) = struct.unpack_from(">h", stream, offset)
+        offset += 2
+        if field_count == -1:
+            break
+        row = []
+        for _ in range(field_count):
+            (size,) = struct.unpack_from(">i", stream, offset)
+            offset += 4
+            if size == -1:
+                row.append(None)
+                continue
+            row.append(stream[offset : offset + size])
+            offset += size
+        rows.append(row)
+    assert offset == len(stream)
+    return rows
+
+
+def assert_same_result(result: tuple, expected: tuple):
+    entries, errors, options_map = result
+    expected_entries, expected_errors, expected_options_map = expected
+    assert entries == expected_entries
+    assert [(error.source, error.message) for error in errors] == [
+        (error.source, error.message) for error in expected_errors
+    ]
+    assert options_map.keys() == expected_options_map.keys()
+    for key, value in options_map.items():
+        if key != "dcontext":
+            assert value == expected_options_map[key], key
+    assert str(options_map["dcontext"]) == str(expected_options_map["dcontext"])
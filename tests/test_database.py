@@ -0,0 +1,209 @@
+import os
+import pathlib
+import textwrap
+import uuid
+
+import pytest
+from beancount import loader
+from click.testing import CliRunner
+from sqlalchemy import create_engine
+from sqlalchemy import Engine
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db.base import Base
+from beancount_exporter.formats.pgcopy_processor.configs import ENTRY_TYPE_CONFIGS
+from beancount_exporter.formats.pgcopy_processor.database import CommitMode
+from beancount_exporter.formats.pgcopy_processor.database import count_connections
+from beancount_exporter.formats.pgcopy_processor.writers import PartitionBy
+from beancount_exporter.main import main
+
+LEDGER = """\
+1970-01-01 open Assets:Cash
+1970-01-01 open Expenses:Grocery
+1970-01-02 * "Buy milk" "Wholefood"
+    Assets:Cash     -5.99 USD
+    Expenses:Grocery
+1970-01-03 * "Buy eggs" "Wholefood"
+    Assets:Cash     -3.49 USD
+    Expenses:Grocery
+"""
+
+
+@pytest.fixture
+def engine() -> Engine:
+    return create_engine(os.environ["DATABASE_URL"], pool_pre_ping=True)
+
+
+@pytest.fixture
+def db(engine: Engine) -> Session:
+    session = Session(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def schema(db: Session) -> str:
+    """Schema with regular tables like the temporary test tables, as the COPY
+    commands run on other connections can't see temporary tables
+
+    """
+    name = f"test_{uuid.uuid4().hex}"
+    db.execute(text(f"CREATE SCHEMA {name}"))
+    tables = dict(
+        entry_base="entry",
+        posting="posting",
+        **{
+            config.type.value: config.type.value
+            for config in ENTRY_TYPE_CONFIGS.values()
+        },
+    )
+    for table, source in tables.items():
+        db.execute(
+            text(
+                f'CREATE TABLE {name}."{table}" (LIKE pg_temp."{source}" INCLUDING ALL)'
+            )
+        )
+    db.commit()
+    try:
+        yield name
+    finally:
+        db.rollback()
+        db.execute(text(f"DROP SCHEMA {name} CASCADE"))
+        db.commit()
+
+
+def export(tmp_path: pathlib.Path, schema: str, *args: str):
+    bean_file_path = tmp_path / "main.bean"
+    bean_file_path.write_text(textwrap.dedent(LEDGER))
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    return CliRunner().invoke(
+        main,
+        [
+            str(bean_file_path),
+            "--base-path",
+            str(tmp_path),
+            "--format",
+            "PGCOPY",
+            "--output-dir",
+            str(output_dir),
+            "--database-url",
+            os.environ["DATABASE_URL"],
+            "--database-schema",
+            schema,
+            *args,
+        ],
+    )
+
+
+def count_rows(db: Session, schema: str, table: str) -> int:
+    return db.execute(text(f'SELECT count(*) FROM {schema}."{table}"')).scalar()
+
+
+@pytest.mark.parametrize("commit_mode", [CommitMode.TABLE, CommitMode.ALL])
+@pytest.mark.parametrize("shards", [1, 3])
+def test_database_url(
+    tmp_path: pathlib.Path,
+    db: Session,
+    schema: str,
+    commit_mode: CommitMode,
+    shards: int,
+):
+    result = export(
+        tmp_path, schema, "--commit-mode", commit_mode, "--shards", str(shards)
+    )
+    assert result.exit_code == 0, result.output
+    assert not list((tmp_path / "output").glob("*.bin"))
+    assert count_rows(db, schema, "entry_base") == 4
+    assert count_rows(db, schema, "open") == 2
+    assert count_rows(db, schema, "transaction") == 2
+    assert count_rows(db, schema, "posting") == 4
+    orphans = db.execute(
+        text(
+            f"SELECT count(*) FROM {schema}.posting AS posting "
+            f'LEFT JOIN {schema}."transaction" AS txn '
+            "ON posting.transaction_id = txn.id WHERE txn.id IS NULL"
+        )
+    ).scalar()
+    assert orphans == 0
+
+
+@pytest.mark.parametrize(
+    "commit_mode, committed_entries",
+    [(CommitMode.TABLE, 4), (CommitMode.ALL, 0)],
+)
+def test_database_url_copy_error(
+    tmp_path: pathlib.Path,
+    db: Session,
+    schema: str,
+    commit_mode: CommitMode,
+    committed_entries: int,
+):
+    db.execute(
+        text(
+            f"ALTER TABLE {schema}.posting "
+            "ADD CONSTRAINT no_grocery CHECK (account <> 'Expenses:Grocery')"
+        )
+    )
+    db.commit()
+    result = export(tmp_path, schema, "--commit-mode", commit_mode)
+    assert result.exit_code != 0
+    assert "no_grocery" in str(result.exception)
+    assert count_rows(db, schema, "entry_base") == committed_entries
+    assert count_rows(db, schema, "posting") == 0
+
+
+def test_database_url_two_phase_commit(
+    tmp_path: pathlib.Path, db: Session, schema: str
+):
+    if int(db.execute(text("SHOW max_prepared_transactions")).scalar()) == 0:
+        pytest.skip("prepared transactions are disabled")
+    result = export(tmp_path, schema, "--commit-mode", CommitMode.TWO_PHASE)
+    assert result.exit_code == 0, result.output
+    assert count_rows(db, schema, "entry_base") == 4
+    assert count_rows(db, schema, "posting") == 4
+    assert not db.execute(text("SELECT count(*) FROM pg_prepared_xacts")).scalar()
+
+
+def test_count_connections():
+    entries, _, _ = loader.load_string(LEDGER)
+    assert count_connections(entries) == 2 + len(ENTRY_TYPE_CONFIGS)
+    assert count_connections(entries, shards=3) == 3 * (2 + len(ENTRY_TYPE_CONFIGS))
+    # entry_base, open, transaction and posting of the only partition
+    assert count_connections(entries, partition_by=PartitionBy.MONTH) == 4
+    assert (
+        count_connections(
+            entries, shards=2, partition_by=PartitionBy.YEAR, dimension_count=3
+        )
+        == 14
+    )
+
+
+def test_database_url_too_many_connections(tmp_path: pathlib.Path):
+    bean_file_path = tmp_path / "main.bean"
+    bean_file_path.write_text(LEDGER)
+    result = CliRunner().invoke(
+        main,
+        [
+            str(bean_file_path),
+            "--format",
+            "PGCOPY",
+            "--output-dir",
+            str(tmp_path),
+            # rejected before connecting
+            "--database-url",
+            "postgresql://invalid",
+            "--partition-by",
+            "MONTH",
+            "--shards",
+            "2",
+            "--max-connections",
+            "7",
+        ],
+    )
+    assert result.exit_code == 2
+    assert "needs 8 connections" in result.output
@@ -0,0 +1,320 @@
+import hashlib
+import os
+import pathlib
+import re
+import typing
+import uuid
+
+import orjson
+import pytest
+from click.testing import CliRunner
+
+from .helpers import export_tables
+from .helpers import LEDGER
+from .helpers import read_rows
+from beancount_exporter.formats.pgcopy_processor.delta import APPLY_DELTA_FILENAME
+from beancount_exporter.formats.pgcopy_processor.delta import (
+    DELETED_ENTRIES_FILENAME,
+)
+from beancount_exporter.formats.pgcopy_processor.delta import DeltaTracker
+from beancount_exporter.formats.pgcopy_processor.delta import FINGERPRINTS_FILENAME
+from beancount_exporter.formats.pgcopy_processor.delta import LOCATION_TABLE_KEYS
+from beancount_exporter.formats.pgcopy_processor.load_plan import (
+    BUILD_CONSTRAINTS_FILENAME,
+)
+from beancount_exporter.formats.pgcopy_processor.load_plan import (
+    CREATE_TABLES_FILENAME,
+)
+from beancount_exporter.formats.pgcopy_processor.load_plan import list_table_files
+from beancount_exporter.formats.pgcopy_processor.manifest import MANIFEST_FILENAME
+from beancount_exporter.formats.pgcopy_processor.manifest import unchanged_tables
+from beancount_exporter.formats.pgcopy_processor.schema import make_table_schemas
+from beancount_exporter.load_plan import main as load_plan_main
+from beancount_exporter.main import main
+
+
+def test_delta_tracker(tmp_path: pathlib.Path):
+    tracker = DeltaTracker()
+    files = export_tables(tmp_path, delta=tracker)
+    assert len(read_rows(files["entry_base"].getvalue())) == 5
+    assert len(tracker.fingerprints) == 5
+    assert tracker.deleted_ids() == []
+
+    changed_ledger = LEDGER.replace("-3.49 USD", "-3.59 USD").replace(
+        "1970-01-04 price BTC 123.45 USD\n", ""
+    )
+    delta = DeltaTracker(tracker.fingerprints)
+    delta_files = export_tables(tmp_path, ledger=changed_ledger, delta=delta)
+    assert delta.unchanged_count == 3
+    # only the changed transaction and its postings are written
+    assert len(read_rows(delta_files["entry_base"].getvalue())) == 1
+    assert len(read_rows(delta_files["transaction"].getvalue())) == 1
+    assert len(read_rows(delta_files["posting"].getvalue())) == 2
+    assert len(read_rows(delta_files["price"].getvalue())) == 0
+    # the old transaction and the price are deleted
+    assert len(delta.deleted_ids()) == 2
+    assert set(delta.deleted_ids()) == set(map(uuid.UUID, tracker.fingerprints)) - set(
+        map(uuid.UUID, delta.fingerprints)
+    )
+
+
+def test_delta_tracker_meta_change(tmp_path: pathlib.Path):
+    tracker = DeltaTracker()
+    export_tables(tmp_path, delta=tracker)
+    delta = DeltaTracker(tracker.fingerprints)
+    # shifting lines changes only the location of entries, their entry_base and
+    # posting rows are written to replace the previous ones
+    delta_files = export_tables(tmp_path, ledger="\n" + LEDGER, delta=delta)
+    assert delta.unchanged_count == 0
+    assert delta.moved_count == 5
+    assert len(read_rows(delta_files["entry_base"].getvalue())) == 5
+    assert len(read_rows(delta_files["posting"].getvalue())) == 4
+    assert len(read_rows(delta_files["transaction"].getvalue())) == 0
+    assert delta.deleted_ids() == []
+
+    # other meta is part of the content
+    changed_ledger = LEDGER.replace(
+        '"Buy milk" "Wholefood"', '"Buy milk" "Wholefood"\n  receipt: "1234"'
+    )
+    delta = DeltaTracker(tracker.fingerprints)
+    delta_files = export_tables(tmp_path, ledger=changed_ledger, delta=delta)
+    # the entries below the added line are moved
+    assert delta.unchanged_count == 2
+    assert delta.moved_count == 2
+    assert len(read_rows(delta_files["entry_base"].getvalue())) == 3
+    assert len(read_rows(delta_files["transaction"].getvalue())) == 1
+
+
+def apply_delta(
+    tables: dict[str, dict[bytes, list]],
+    delta_files: dict[str, typing.Any],
+    deleted_ids: list[uuid.UUID],
+):
+    """Apply delta files to rows of tables keyed by id, like apply_delta.sql"""
+    deleted = {entry_id.bytes for entry_id in deleted_ids}
+    for table, rows in tables.items():
+        # postings go with their transactions
+        column = 1 if table == "posting" else 0
+        for row_id, row in list(rows.items()):
+            if row[column] in deleted:
+                del rows[row_id]
+        for row in read_rows(delta_files[table].getvalue()):
+            if table not in LOCATION_TABLE_KEYS:
+                assert row[0] not in rows
+            rows[row[0]] = row
+
+
+def test_delta_tracker_applied(tmp_path: pathlib.Path):
+    tracker = DeltaTracker()
+    files = export_tables(tmp_path, delta=tracker)
+    tables = {
+        table: {row[0]: row for row in read_rows(file.getvalue())}
+        for table, file in files.items()
+    }
+    # lines inserted above existing entries, along with a changed and a new entry
+    changed_ledger = "1970-01-01 open Assets:Bank\n\n" + LEDGER.replace(
+        "-3.49 USD", "-3.59 USD"
+    )
+    delta = DeltaTracker(tracker.fingerprints)
+    delta_files = export_tables(tmp_path, ledger=changed_ledger, delta=delta)
+    assert delta.moved_count == 4
+    apply_delta(tables, delta_files, delta.deleted_ids())
+
+    expected_files = export_tables(tmp_path, ledger=changed_ledger)
+    for table, file in expected_files.items():
+        expected_rows = read_rows(file.getvalue())
+        assert sorted(tables[table].values()) == sorted(expected_rows), table
+
+
+def test_delta_jobs(tmp_path: pathlib.Path):
+    with pytest.raises(ValueError):
+        export_tables(tmp_path, delta=DeltaTracker(), jobs=2)
+
+
+def export(tmp_path: pathlib.Path, name: str, ledger: str, *args: str):
+    bean_file_path = tmp_path / "main.bean"
+    bean_file_path.write_text(ledger)
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    result = CliRunner().invoke(
+        main,
+        [
+            str(bean_file_path),
+            "--base-path",
+            str(tmp_path),
+            "--format",
+            "PGCOPY",
+            "--output-dir",
+            str(output_dir),
+            "--id-strategy",
+            "CONTENT",
+            *args,
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    return output_dir
+
+
+def test_delta_from(tmp_path: pathlib.Path):
+    full_dir = export(tmp_path, "full", LEDGER, "--fingerprints")
+    assert (full_dir / FINGERPRINTS_FILENAME).exists()
+    assert not (full_dir / APPLY_DELTA_FILENAME).exists()
+
+    changed_ledger = LEDGER.replace("-3.49 USD", "-3.59 USD")
+    delta_dir = export(
+        tmp_path,
+        "delta",
+        changed_ledger,
+        "--delta-from",
+        str(full_dir / FINGERPRINTS_FILENAME),
+    )
+    assert len(read_rows((delta_dir / "entry_base.bin").read_bytes())) == 1
+    assert len(read_rows((delta_dir / DELETED_ENTRIES_FILENAME).read_bytes())) == 1
+    apply_delta = (delta_dir / APPLY_DELTA_FILENAME).read_text()
+    assert "\\copy \"delta_posting\" FROM 'posting.bin'" in apply_delta
+    manifest = orjson.loads((delta_dir / MANIFEST_FILENAME).read_bytes())
+    assert manifest["delta"]
+    assert (
+        manifest["delta_base"]
+        == hashlib.blake2b(
+            (full_dir / FINGERPRINTS_FILENAME).read_bytes(), digest_size=16
+        ).hexdigest()
+    )
+    assert not orjson.loads((full_dir / MANIFEST_FILENAME).read_bytes())["delta"]
+    result = CliRunner().invoke(load_plan_main, [str(delta_dir)])
+    assert result.exit_code == 2
+    assert "is a delta export" in result.output
+
+    # a full export into the same directory leaves no delta files behind
+    result = CliRunner().invoke(
+        main,
+        [
+            str(tmp_path / "main.bean"),
+            "--base-path",
+            str(tmp_path),
+            "--format",
+            "PGCOPY",
+            "--output-dir",
+            str(delta_dir),
+            "--id-strategy",
+            "CONTENT",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert not (delta_dir / DELETED_ENTRIES_FILENAME).exists()
+    assert not (delta_dir / APPLY_DELTA_FILENAME).exists()
+    assert not orjson.loads((delta_dir / MANIFEST_FILENAME).read_bytes())["delta"]
+
+    # missing fingerprints fall back to full export
+    fallback_dir = export(
+        tmp_path,
+        "fallback",
+        changed_ledger,
+        "--delta-from",
+        str(tmp_path / "missing.json"),
+    )
+    assert len(read_rows((fallback_dir / "entry_base.bin").read_bytes())) == 5
+    assert not (fallback_dir / APPLY_DELTA_FILENAME).exists()
+    assert (fallback_dir / FINGERPRINTS_FILENAME).exists()
+
+
+def run_psql_script(cursor, output_dir: pathlib.Path, script: str):
+    """Run a script generated for psql without requiring psql"""
+    for line in script.splitlines():
+        copy = re.fullmatch(r"\\copy (\S+) FROM '(.+)' WITH \(FORMAT BINARY\)", line)
+        if copy is not None:
+            table, filename = copy.groups()
+            with open(output_dir / filename, "rb") as fo:
+                cursor.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT BINARY)", fo)
+        elif line and not line.startswith(("\\", "--", "BEGIN", "COMMIT")):
+            cursor.execute(line)
+
+
+def load_tables(cursor, output_dir: pathlib.Path, schema: str):
+    """Load a full export into a new schema, like the load script of load_plan"""
+    result = CliRunner().invoke(
+        load_plan_main, [str(output_dir), "--database-schema", schema]
+    )
+    assert result.exit_code == 0, result.output
+    cursor.execute((output_dir / CREATE_TABLES_FILENAME).read_text())
+    manifest = orjson.loads((output_dir / MANIFEST_FILENAME).read_bytes())
+    for table, filename in list_table_files(make_table_schemas(), manifest):
+        with open(output_dir / filename, "rb") as fo:
+            cursor.copy_expert(
+                f'COPY {schema}."{table}" FROM STDIN WITH (FORMAT BINARY)', fo
+            )
+    cursor.execute((output_dir / BUILD_CONSTRAINTS_FILENAME).read_text())
+
+
+def test_apply_delta(tmp_path: pathlib.Path):
+    database_url = os.environ.get("DATABASE_URL")
+    if database_url is None:
+        pytest.skip("DATABASE_URL is not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    schema = f"test_{uuid.uuid4().hex}"
+    expected_schema = f"test_{uuid.uuid4().hex}"
+    full_dir = export(tmp_path, "full", LEDGER, "--fingerprints")
+    # lines inserted above existing entries, along with a changed and a new entry
+    changed_ledger = "1970-01-01 open Assets:Bank\n\n" + LEDGER.replace(
+        "-3.49 USD", "-3.59 USD"
+    )
+    delta_dir = export(
+        tmp_path,
+        "delta",
+        changed_ledger,
+        "--database-schema",
+        schema,
+        "--delta-from",
+        str(full_dir / FINGERPRINTS_FILENAME),
+    )
+    expected_dir = export(tmp_path, "expected", changed_ledger)
+
+    connection = psycopg2.connect(database_url)
+    try:
+        with connection.cursor() as cursor:
+            load_tables(cursor, full_dir, schema)
+            run_psql_script(
+                cursor, delta_dir, (delta_dir / APPLY_DELTA_FILENAME).read_text()
+            )
+            load_tables(cursor, expected_dir, expected_schema)
+            for table_schema in make_table_schemas():
+                rows = []
+                for name in (schema, expected_schema):
+                    cursor.execute(
+                        f'SELECT * FROM {name}."{table_schema.name}" ORDER BY id'
+                    )
+                    rows.append(cursor.fetchall())
+                assert rows[0] == rows[1], table_schema.name
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def test_delta_from_incompatible(tmp_path: pathlib.Path):
+    full_dir = export(tmp_path, "full", LEDGER, "--fingerprints")
+    fallback_dir = export(
+        tmp_path,
+        "fallback",
+        LEDGER,
+        "--disable-path-stripping",
+        "--delta-from",
+        str(full_dir / FINGERPRINTS_FILENAME),
+    )
+    assert len(read_rows((fallback_dir / "entry_base.bin").read_bytes())) == 5
+    assert not (fallback_dir / APPLY_DELTA_FILENAME).exists()
+
+
+def test_unchanged_tables(tmp_path: pathlib.Path):
+    first_dir = export(tmp_path, "first", LEDGER)
+    second_dir = export(tmp_path, "second", LEDGER.replace("-3.49 USD", "-3.59 USD"))
+    first, second = (
+        orjson.loads((output_dir / MANIFEST_FILENAME).read_bytes())
+        for output_dir in (first_dir, second_dir)
+    )
+    assert first["id_strategy"] == "CONTENT"
+    assert unchanged_tables(first, second) == {
+        table
+        for table in second["tables"]
+        if table not in {"entry_base", "transaction", "posting"}
+    }
+    assert unchanged_tables(first, first) == set(first["tables"])
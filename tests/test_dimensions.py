@@ -0,0 +1,106 @@
+import io
+import pathlib
+import struct
+
+import pytest
+
+from .helpers import export_tables
+from .helpers import read_rows
+from beancount_exporter.formats.pgcopy_processor import dimensions
+from beancount_exporter.formats.pgcopy_processor.delta import make_apply_delta_sql
+from beancount_exporter.formats.pgcopy_processor.dimensions import Dimension
+from beancount_exporter.formats.pgcopy_processor.dimensions import dimension_key
+from beancount_exporter.formats.pgcopy_processor.dimensions import (
+    DimensionDictionary,
+)
+from beancount_exporter.formats.pgcopy_processor.schema import make_table_schemas
+
+
+def encode_key(name: str) -> bytes:
+    return struct.pack(">q", dimension_key(name))
+
+
+def test_dimension_key():
+    assert dimension_key("Assets:Cash") == dimension_key("Assets:Cash")
+    assert dimension_key("Assets:Cash") != dimension_key("Assets:Bank")
+    dictionary = DimensionDictionary()
+    assert dictionary.key("USD") == dimension_key("USD")
+    assert dictionary.key("USD") == dimension_key("USD")
+    assert list(dictionary.keys) == ["USD"]
+
+
+def test_dimension_key_collision(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(dimensions, "dimension_key", lambda name: 42)
+    dictionary = DimensionDictionary()
+    dictionary.key("USD")
+    with pytest.raises(ValueError):
+        dictionary.key("TWD")
+
+
+def export_normalized(
+    tmp_path: pathlib.Path, **kwargs
+) -> tuple[dict, dict[Dimension, io.BytesIO]]:
+    dimension_files = {dimension: io.BytesIO() for dimension in Dimension}
+    files = export_tables(
+        tmp_path, normalize=True, dimension_files=dimension_files, **kwargs
+    )
+    return files, dimension_files
+
+
+def test_processor_normalize(tmp_path: pathlib.Path):
+    files, dimension_files = export_normalized(tmp_path)
+    account_rows = read_rows(dimension_files[Dimension.ACCOUNT].getvalue())
+    assert account_rows == [
+        [encode_key("Assets:Cash"), b"Assets:Cash"],
+        [encode_key("Expenses:Grocery"), b"Expenses:Grocery"],
+    ]
+    currency_rows = read_rows(dimension_files[Dimension.CURRENCY].getvalue())
+    assert [row[1] for row in currency_rows] == [b"USD", b"BTC"]
+    (source_file_row,) = read_rows(dimension_files[Dimension.SOURCE_FILE].getvalue())
+
+    posting_rows = read_rows(files["posting"].getvalue())
+    assert posting_rows[0][2] == encode_key("Assets:Cash")
+    assert posting_rows[0][4] == encode_key("USD")
+    assert posting_rows[0][-1] == source_file_row[0]
+    assert b"filename" not in posting_rows[0][-2]
+    entry_rows = read_rows(files["entry_base"].getvalue())
+    assert all(row[-1] == source_file_row[0] for row in entry_rows)
+    assert all(b"filename" not in row[-2] for row in entry_rows)
+    (price_row,) = read_rows(files["price"].getvalue())
+    assert price_row[1] == encode_key("BTC")
+    assert price_row[3] == encode_key("USD")
+
+
+def test_processor_normalize_jobs(tmp_path: pathlib.Path):
+    files, dimension_files = export_normalized(tmp_path)
+    parallel_files, parallel_dimension_files = export_normalized(tmp_path, jobs=2)
+    for name, file in files.items():
+        assert parallel_files[name].getvalue() == file.getvalue()
+    for dimension, file in dimension_files.items():
+        assert parallel_dimension_files[dimension].getvalue() == file.getvalue()
+
+
+def test_normalized_table_schemas():
+    table_schemas = make_table_schemas(normalized=True)
+    assert [table_schema.name for table_schema in table_schemas[:3]] == [
+        "account",
+        "currency",
+        "source_file",
+    ]
+    posting = table_schemas[-1]
+    assert posting.foreign_keys[0] == ("transaction_id", "transaction")
+    assert ("account_id", "account") in posting.foreign_keys
+    assert ("account_id",) in posting.indexes
+    (open_schema,) = (
+        table_schema for table_schema in table_schemas if table_schema.name == "open"
+    )
+    # arrays of keys can't have foreign keys
+    assert open_schema.foreign_keys == (("id", "entry_base"), ("account_id", "account"))
+
+    sql = make_apply_delta_sql(
+        table_schemas, [("account", "account.bin"), ("posting", "posting.bin")]
+    )
+    assert 'DELETE FROM "account"' not in sql
+    assert 'INSERT INTO "account" SELECT * FROM "delta_account" ON CONFLICT' in sql
+    assert 'DELETE FROM "open" WHERE "id" IN' in sql
+    assert 'DELETE FROM "posting" WHERE "transaction_id" IN' in sql
@@ -0,0 +1,242 @@
+import datetime
+import decimal
+import struct
+import uuid
+from random import Random
+
+import pgcopy.copy
+import pytest
+
+from beancount_exporter.formats.pgcopy_processor.cache import EncodedValueCache
+from beancount_exporter.formats.pgcopy_processor.encoders import compile_row_encoder
+from beancount_exporter.formats.pgcopy_processor.numeric import encode_numeric
+from beancount_exporter.formats.pgcopy_processor.options import PgCopyOptions
+from beancount_exporter.formats.pgcopy_processor.processor import PgCopyProcessor
+from beancount_exporter.formats.pgcopy_processor.tables import BALANCE_TABLE
+from beancount_exporter.formats.pgcopy_processor.tables import CUSTOM_TABLE
+from beancount_exporter.formats.pgcopy_processor.tables import DOCUMENT_TABLE
+from beancount_exporter.formats.pgcopy_processor.tables import ENTRY_BASE_TABLE
+from beancount_exporter.formats.pgcopy_processor.tables import OPEN_TABLE
+from beancount_exporter.formats.pgcopy_processor.tables import POSTING_TABLE
+from beancount_exporter.formats.pgcopy_processor.tables import PRICE_TABLE
+from beancount_exporter.formats.pgcopy_processor.tables import TRANSACTION_TABLE
+from beancount_exporter.formats.pgcopy_processor.utils import compile_formatter
+from beancount_exporter.formats.pgcopy_processor.utils import serialize_row
+
+MOCK_ID = uuid.UUID("6d1f2c77-29c5-4a6b-9a57-1c0c1d6f1b4e")
+MOCK_TXN_ID = uuid.UUID("0b5c9a0e-52e1-4b5b-8f44-25f3e1ad0c67")
+
+
+def serialize_row_generic(table, values) -> bytes:
+    formatters = [compile_formatter("utf8", column) for column in table]
+    return serialize_row(formatters, values)
+
+
+@pytest.mark.parametrize(
+    "table, values",
+    [
+        (
+            ENTRY_BASE_TABLE,
+            (MOCK_ID, "OPEN", datetime.date(2023, 3, 22), b'{"lineno":1}'),
+        ),
+        (
+            ENTRY_BASE_TABLE,
+            (MOCK_ID, "TRANSACTION", datetime.date(1970, 1, 1), b"{}"),
+        ),
+        (OPEN_TABLE, (MOCK_ID, "Assets:Checking", ["USD", "TWD"], "FIFO")),
+        (OPEN_TABLE, (MOCK_ID, "Equity:Opening-Balances", None, None)),
+        (OPEN_TABLE, (MOCK_ID, "Assets:Cash", ["USD", None], None)),
+        (
+            BALANCE_TABLE,
+            (
+                MOCK_ID,
+                "Assets:Checking",
+                decimal.Decimal("623.44"),
+                "USD",
+                decimal.Decimal("0.05"),
+                None,
+                None,
+            ),
+        ),
+        (TRANSACTION_TABLE, (MOCK_ID, "*", None, "Buy milk", set(), set())),
+        (
+            TRANSACTION_TABLE,
+            (MOCK_ID, "!", "Wholefood ☕", "牛奶", {"trip"}, {"ref-001"}),
+        ),
+        (
+            POSTING_TABLE,
+            (
+                MOCK_ID,
+                MOCK_TXN_ID,
+                "Assets:TSLA",
+                decimal.Decimal("10.0"),
+                "TSLA",
+                decimal.Decimal("200.00"),
+                "USD",
+                decimal.Decimal("123.45"),
+                "USD",
+                datetime.date(1970, 1, 2),
+                "ref-001",
+                None,
+                None,
+                True,
+                "*",
+                b'{"filename":"main.bean","lineno":3}',
+            ),
+        ),
+        (
+            POSTING_TABLE,
+            (MOCK_ID, MOCK_TXN_ID, "Expenses:Grocery", None, "USD", *([None] * 11)),
+        ),
+        (PRICE_TABLE, (MOCK_ID, "BTC", decimal.Decimal("-123.45"), "USD")),
+        (DOCUMENT_TABLE, (MOCK_ID, "Assets:Checking", "invoice.pdf", [], [])),
+        (CUSTOM_TABLE, (MOCK_ID, "budget", ['"string"', "2022-04-01", "true"])),
+    ],
+)
+def test_compiled_encoder_output(table, values):
+    encoder = compile_row_encoder("utf8", table)
+    assert encoder(values) == serialize_row_generic(table, values)
+
+
+def test_compiled_encoder_fallback():
+    # bytes don't have `encode`, pgcopy passes them through as is
+    values = (MOCK_ID, b"OPEN", datetime.date(2023, 3, 22), b"{}")
+    encoder = compile_row_encoder("utf8", ENTRY_BASE_TABLE)
+    assert encoder(values) == serialize_row_generic(ENTRY_BASE_TABLE, values)
+
+
+def test_compiled_encoder_null_error():
+    encoder = compile_row_encoder("utf8", ENTRY_BASE_TABLE)
+    with pytest.raises(ValueError, match='null value in column "date" not allowed'):
+        encoder((MOCK_ID, "OPEN", None, b"{}"))
+
+
+def test_processor_use_row_encoders(tmp_path):
+    processor = PgCopyProcessor(
+        base_path=tmp_path,
+        option_maps_file=None,
+        errors_file=None,
+        entry_base_file=None,
+        posting_file=None,
+        entry_files={},
+        options=PgCopyOptions(use_row_encoders=False),
+    )
+    values = (MOCK_ID, "OPEN", datetime.date(2023, 3, 22), b"{}")
+    assert processor._entry_base_encoder(values) == serialize_row_generic(
+        ENTRY_BASE_TABLE, values
+    )
+
+
+def make_numeric_corpus(size: int) -> list[decimal.Decimal]:
+    random = Random(20240101)
+    corpus = [
+        decimal.Decimal(value)
+        for value in [
+            "0",
+            "-0",
+            "0.00",
+            "0E-8",
+            "0E+5",
+            "1",
+            "-1",
+            "10000",
+            "100000000",
+            "1E+4",
+            "1.000",
+            "0.0001",
+            "-0.00001",
+            "123.45",
+            "-5.99",
+            "1234.500",
+            "99999999.9999",
+            "100000000.00000001",
+            "NaN",
+            "-NaN",
+            "sNaN",
+            "Infinity",
+            "-Infinity",
+        ]
+    ]
+    while len(corpus) < size:
+        number_of_digits = random.choice([1, 2, 3, 4, 5, 8, random.randint(1, 60)])
+        digits = tuple(random.randint(0, 9) for _ in range(number_of_digits))
+        if random.random() < 0.3:
+            # trailing zeros
+            digits += (0,) * random.randint(1, 9)
+        exponent = random.choice([0, -1, -2, -3, -4, -8, random.randint(-40, 40)])
+        corpus.append(decimal.Decimal((random.randint(0, 1), digits, exponent)))
+    return corpus
+
+
+def test_encode_numeric():
+    for value in make_numeric_corpus(100000):
+        fmt, values = pgcopy.copy.numeric(value)
+        assert encode_numeric(value) == struct.pack(">" + fmt, *values), value
+
+
+def test_encode_numeric_lower_case_exponent():
+    with decimal.localcontext() as context:
+        context.capitals = 0
+        for value in make_numeric_corpus(1000):
+            fmt, values = pgcopy.copy.numeric(value)
+            assert encode_numeric(value) == struct.pack(">" + fmt, *values), value
+
+
+def test_encode_numeric_non_decimal():
+    with pytest.raises(TypeError):
+        encode_numeric(1.5)
+
+
+def test_cached_encoder_output():
+    cache = EncodedValueCache(maxsize=16)
+    encoder = compile_row_encoder("utf8", POSTING_TABLE, value_cache=cache)
+    rows = [
+        (
+            uuid.uuid4(),
+            MOCK_TXN_ID,
+            "Assets:Cash",
+            decimal.Decimal(number),
+            "USD",
+            *([None] * 5),
+            None,
+            None,
+            None,
+            None,
+            None,
+            b"{}",
+        )
+        # equal decimals with different exponent must not share cached value
+        for number in ["1", "1.0", "1.00", "1", "-5.99", "1.0"]
+    ]
+    for values in rows:
+        assert encoder(values) == serialize_row_generic(POSTING_TABLE, values)
+    stats = cache.stats()
+    # account, units number and units currency columns
+    assert stats.hits + stats.misses == len(rows) * 3
+    assert stats.misses == 2 + 4
+    assert stats.size == stats.misses
+
+
+def test_cached_encoder_shares_columns():
+    cache = EncodedValueCache(maxsize=16)
+    transaction_encoder = compile_row_encoder(
+        "utf8", TRANSACTION_TABLE, value_cache=cache
+    )
+    document_encoder = compile_row_encoder("utf8", DOCUMENT_TABLE, value_cache=cache)
+    values = (MOCK_ID, "*", None, "Buy milk", {"trip"}, set())
+    assert transaction_encoder(values) == serialize_row_generic(
+        TRANSACTION_TABLE, values
+    )
+    values = (MOCK_ID, "Assets:Checking", "invoice.pdf", {"trip"}, set())
+    assert document_encoder(values) == serialize_row_generic(DOCUMENT_TABLE, values)
+    # tags and links arrays are cached across the two tables
+    assert cache.stats().hits == 2
+
+
+def test_cached_encoder_eviction():
+    cache = EncodedValueCache(maxsize=2)
+    encoder = compile_row_encoder("utf8", PRICE_TABLE, value_cache=cache)
+    for number in range(10):
+        values = (MOCK_ID, "BTC", decimal.Decimal(number), "USD")
+        assert encoder(values) == serialize_row_generic(PRICE_TABLE, values)
+    assert cache.stats().size == 2
@@ -0,0 +1,109 @@
+import os
+import pathlib
+import stat
+import textwrap
+import threading
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from beancount_exporter.formats.pgcopy_processor.fifo import FifoWriter
+from beancount_exporter.main import main
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(os, "mkfifo"), reason="FIFO is not supported"
+)
+
+LEDGER = "1970-01-01 open Assets:Cash\n1970-01-01 open Expenses:Grocery\n" + "".join(
+    f'1970-01-02 * "Buy milk {index}" "Wholefood"\n'
+    "    Assets:Cash     -5.99 USD\n"
+    "    Expenses:Grocery\n"
+    for index in range(2000)
+)
+
+
+def wait_for_fifo(path: pathlib.Path, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not (path.exists() and stat.S_ISFIFO(path.stat().st_mode)):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def read_fifo(path: pathlib.Path, results: dict[str, bytes]):
+    wait_for_fifo(path)
+    with open(path, "rb") as fo:
+        results[path.name] = fo.read()
+
+
+def export(bean_file_path: pathlib.Path, output_dir: pathlib.Path, *args: str):
+    output_dir.mkdir()
+    return CliRunner().invoke(
+        main,
+        [
+            str(bean_file_path),
+            "--base-path",
+            str(bean_file_path.parent),
+            "--format",
+            "PGCOPY",
+            "--output-dir",
+            str(output_dir),
+            "--id-strategy",
+            "CONTENT",
+            *args,
+        ],
+    )
+
+
+def test_fifo_output(tmp_path: pathlib.Path):
+    bean_file_path = tmp_path / "main.bean"
+    bean_file_path.write_text(textwrap.dedent(LEDGER))
+    result = export(bean_file_path, tmp_path / "files")
+    assert result.exit_code == 0, result.output
+    files = {
+        path.name: path.read_bytes() for path in (tmp_path / "files").glob("*.bin")
+    }
+    assert len(files["posting.bin"]) > 1 << 16
+
+    output_dir = tmp_path / "fifos"
+    results: dict[str, bytes] = {}
+
+    def consume():
+        # read tables one after another, in the reversed order they are written
+        for name in sorted(files, reverse=True):
+            read_fifo(output_dir / name, results)
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    result = export(bean_file_path, output_dir, "--fifo", "--fifo-timeout", "10")
+    assert result.exit_code == 0, result.output
+    consumer.join(timeout=10)
+    assert results == files
+
+
+def test_fifo_open_timeout(tmp_path: pathlib.Path):
+    fifo = FifoWriter(tmp_path / "posting.bin", timeout=0.1)
+    fifo.write(b"data")
+    with pytest.raises(TimeoutError, match="No consumer opened"):
+        fifo.close()
+
+
+def test_fifo_consumer_closed(tmp_path: pathlib.Path):
+    path = tmp_path / "posting.bin"
+    fifo = FifoWriter(path, timeout=10)
+    fifo.write(b"x" * (1 << 20))
+    with open(path, "rb") as fo:
+        fo.read(1)
+    with pytest.raises(BrokenPipeError, match="closed it before reading all data"):
+        fifo.close()
+
+
+def test_fifo_abort_after_finish(tmp_path: pathlib.Path):
+    fifo = FifoWriter(tmp_path / "posting.bin", timeout=60)
+    fifo.write(b"data")
+    fifo.finish()
+    started = time.monotonic()
+    fifo.abort()
+    assert time.monotonic() - started < 10
+    assert not fifo._thread.is_alive()
+    assert isinstance(fifo.error, InterruptedError)
@@ -0,0 +1,195 @@
+import datetime
+import pathlib
+import uuid
+
+from beancount import loader
+from beancount.core import data
+from click.testing import CliRunner
+
+from beancount_exporter.formats.pgcopy_processor.ids import ContentAllocator
+from beancount_exporter.formats.pgcopy_processor.ids import SequenceAllocator
+from beancount_exporter.formats.pgcopy_processor.ids import Uuid4Allocator
+from beancount_exporter.formats.pgcopy_processor.ids import Uuid7Allocator
+from beancount_exporter.formats.pgcopy_processor.processor import PgCopyProcessor
+from beancount_exporter.main import main
+
+
+def make_transaction(date: datetime.date, number_of_postings: int) -> data.Transaction:
+    return data.Transaction(
+        meta={},
+        date=date,
+        flag="*",
+        payee=None,
+        narration="",
+        tags=frozenset(),
+        links=frozenset(),
+        postings=[
+            data.Posting(
+                account="Assets:Cash",
+                units=None,
+                cost=None,
+                price=None,
+                flag=None,
+                meta=None,
+            )
+        ]
+        * number_of_postings,
+    )
+
+
+def test_uuid4_allocator():
+    allocator = Uuid4Allocator(batch_size=4)
+    entry = make_transaction(datetime.date(2023, 1, 1), 3)
+    ids = []
+    for _ in range(5):
+        ids.append(allocator.entry_id(entry))
+        ids.extend(allocator.posting_ids(entry, ids[-1]))
+    assert len(set(ids)) == len(ids) == 20
+    for id in ids:
+        assert id.version == 4
+        assert id.variant == uuid.RFC_4122
+
+
+def test_uuid7_allocator():
+    allocator = Uuid7Allocator()
+    ids = []
+    for date in [
+        datetime.date(1960, 1, 1),
+        datetime.date(2023, 1, 1),
+        datetime.date(2023, 1, 1),
+        datetime.date(2023, 1, 2),
+    ]:
+        entry = make_transaction(date, 2)
+        ids.append(allocator.entry_id(entry))
+        ids.extend(allocator.posting_ids(entry, ids[-1]))
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    for id in ids:
+        assert id.version == 7
+        assert id.variant == uuid.RFC_4122
+    assert ids[0].int >> 80 == 0
+    assert ids[-1].int >> 80 == int(
+        datetime.datetime(2023, 1, 2, tzinfo=datetime.timezone.utc).timestamp() * 1000
+    )
+
+
+def test_sequence_allocator():
+    allocator = SequenceAllocator()
+    entry = make_transaction(datetime.date(2023, 1, 1), 2)
+    assert allocator.entry_id(entry) == 1
+    assert allocator.posting_ids(entry, 1) == [2, 3]
+    assert allocator.entry_id(entry) == 4
+
+
+def test_processor_sequence_id_tables(tmp_path: pathlib.Path):
+    processor = PgCopyProcessor(
+        base_path=tmp_path,
+        option_maps_file=None,
+        errors_file=None,
+        entry_base_file=None,
+        posting_file=None,
+        entry_files={},
+        id_allocator=SequenceAllocator(),
+    )
+    assert processor.entry_base_table[0].type_name == "int8"
+    assert [column.type_name for column in processor.posting_table[:2]] == [
+        "int8",
+        "int8",
+    ]
+    for config in processor.entry_configs.values():
+        assert config.table[0].type_name == "int8"
+
+
+CONTENT_LEDGER = """\
+plugin "beancount.plugins.auto_accounts"
+
+2023-02-10 pad Assets:Checking Equity:Opening-Balances
+2023-03-22 balance Assets:Checking 123.45 USD
+2023-03-23 * "Coffee" #morning
+    Assets:Checking  -4.50 USD
+    Expenses:Coffee
+2023-03-23 * "Coffee" #morning
+    Assets:Checking  -4.50 USD
+    Expenses:Coffee
+"""
+
+
+def allocate_content_ids(ledger: str) -> list[tuple]:
+    entries, errors, _ = loader.load_string(ledger)
+    assert not errors
+    allocator = ContentAllocator()
+    ids = []
+    for entry in entries:
+        entry_id = allocator.entry_id(entry)
+        posting_ids = ()
+        if isinstance(entry, data.Transaction):
+            posting_ids = tuple(allocator.posting_ids(entry, entry_id))
+        ids.append((entry_id, posting_ids))
+    return ids
+
+
+def test_content_allocator_stable_ids():
+    ids = allocate_content_ids(CONTENT_LEDGER)
+    # moving lines around doesn't change the ids
+    assert allocate_content_ids("\n\n\n" + CONTENT_LEDGER) == ids
+    entry_ids = [entry_id for entry_id, _ in ids]
+    posting_ids = [id for _, posting_ids in ids for id in posting_ids]
+    assert len(set(entry_ids)) == len(entry_ids)
+    assert len(set(posting_ids)) == len(posting_ids)
+
+
+def test_content_allocator_changed_entry():
+    ids = allocate_content_ids(CONTENT_LEDGER)
+    changed_ids = allocate_content_ids(
+        CONTENT_LEDGER.replace("#morning", "#evening", 1)
+    )
+    # only the first coffee transaction changes, the second one is no longer a
+    # duplicate so that it gets the content id
+    assert changed_ids[:-2] == ids[:-2]
+    assert changed_ids[-2] not in ids
+    assert changed_ids[-1] == ids[-2]
+
+
+def test_content_allocator_duplicates():
+    allocator = ContentAllocator()
+    entry = make_transaction(datetime.date(2023, 1, 1), 2)
+    first_id = allocator.entry_id(entry)
+    second_id = allocator.entry_id(entry)
+    assert first_id == allocator.content_id(entry)
+    assert second_id != first_id
+    allocator = ContentAllocator()
+    assert allocator.entry_id(entry) == first_id
+    assert allocator.entry_id(entry) == second_id
+
+
+def test_content_allocator_document_base_path(tmp_path: pathlib.Path):
+    documents = []
+    for name in ("first", "second"):
+        ledger_dir = tmp_path / name
+        (ledger_dir / "statements").mkdir(parents=True)
+        (ledger_dir / "statements" / "2023-01.pdf").write_bytes(b"")
+        (ledger_dir / "main.bean").write_text(
+            "2023-01-01 open Assets:Checking\n"
+            '2023-01-31 document Assets:Checking "statements/2023-01.pdf"\n'
+        )
+        output_dir = tmp_path / f"{name}_output"
+        output_dir.mkdir()
+        result = CliRunner().invoke(
+            main,
+            [
+                str(ledger_dir / "main.bean"),
+                "--base-path",
+                str(ledger_dir),
+                "--format",
+                "PGCOPY",
+                "--output-dir",
+                str(output_dir),
+                "--id-strategy",
+                "CONTENT",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        documents.append((output_dir / "document.bin").read_bytes())
+    assert b"statements/2023-01.pdf" in documents[0]
+    # the same ledger checked out in another directory gets the same ids
+    assert documents[0] == documents[1]
@@ -0,0 +1,134 @@
+import os
+import pathlib
+import uuid
+
+import orjson
+import pytest
+from click.testing import CliRunner
+from sqlalchemy import create_engine
+from sqlalchemy import Engine
+from sqlalchemy import text
+
+from .helpers import LEDGER
+from beancount_exporter.formats.pgcopy_processor.shadow import manifest_row_counts
+from beancount_exporter.load import main as load_main
+from beancount_exporter.main import main
+
+
+def export(tmp_path: pathlib.Path, name: str, ledger: str, *args: str) -> pathlib.Path:
+    bean_file_path = tmp_path / "main.bean"
+    bean_file_path.write_text(ledger)
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    result = CliRunner().invoke(
+        main,
+        [
+            str(bean_file_path),
+            "--base-path",
+            str(tmp_path),
+            "--format",
+            "PGCOPY",
+            "--output-dir",
+            str(output_dir),
+            *args,
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    return output_dir
+
+
+def test_manifest_row_counts(tmp_path: pathlib.Path):
+    output_dir = export(tmp_path, "output", LEDGER, "--shards", "2")
+    row_counts = manifest_row_counts(
+        orjson.loads((output_dir / "manifest.json").read_bytes())
+    )
+    assert row_counts["entry_base"] == 5
+    assert row_counts["posting"] == 4
+    assert row_counts["close"] == 0
+
+
+def test_load_delta_export(tmp_path: pathlib.Path):
+    full_dir = export(
+        tmp_path, "full", LEDGER, "--id-strategy", "CONTENT", "--fingerprints"
+    )
+    delta_dir = export(
+        tmp_path,
+        "delta",
+        LEDGER,
+        "--id-strategy",
+        "CONTENT",
+        "--delta-from",
+        str(full_dir / "fingerprints.json"),
+    )
+    result = CliRunner().invoke(
+        load_main, [str(delta_dir), "--database-url", "postgresql://unused"]
+    )
+    assert result.exit_code != 0
+    assert "delta export" in result.output
+
+
+@pytest.fixture
+def engine() -> Engine:
+    return create_engine(os.environ["DATABASE_URL"], pool_pre_ping=True)
+
+
+@pytest.fixture
+def schema(engine: Engine) -> str:
+    name = f"test_{uuid.uuid4().hex}"
+    try:
+        yield name
+    finally:
+        with engine.begin() as connection:
+            for suffix in ("", "_shadow", "_previous"):
+                connection.execute(
+                    text(f"DROP SCHEMA IF EXISTS {name}{suffix} CASCADE")
+                )
+
+
+def load(output_dir: pathlib.Path | None, schema: str, *args: str):
+    result = CliRunner().invoke(
+        load_main,
+        [
+            *([str(output_dir)] if output_dir is not None else []),
+            "--database-url",
+            os.environ["DATABASE_URL"],
+            "--database-schema",
+            schema,
+            *args,
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+
+def count_rows(engine: Engine, schema: str, table: str) -> int:
+    with engine.connect() as connection:
+        return connection.execute(
+            text(f'SELECT count(*) FROM {schema}."{table}"')
+        ).scalar()
+
+
+def test_shadow_load(tmp_path: pathlib.Path, engine: Engine, schema: str):
+    first_dir = export(tmp_path, "first", LEDGER, "--shards", "2")
+    load(first_dir, schema)
+    assert count_rows(engine, schema, "entry_base") == 5
+    assert count_rows(engine, schema, "posting") == 4
+
+    second_dir = export(
+        tmp_path, "second", LEDGER.replace("1970-01-04 price BTC 123.45 USD\n", "")
+    )
+    load(second_dir, schema)
+    assert count_rows(engine, schema, "price") == 0
+    assert count_rows(engine, f"{schema}_previous", "price") == 1
+    with engine.connect() as connection:
+        orphans = connection.execute(
+            text(
+                f"SELECT count(*) FROM {schema}.posting AS posting "
+                f'LEFT JOIN {schema}."transaction" AS txn '
+                "ON posting.transaction_id = txn.id WHERE txn.id IS NULL"
+            )
+        ).scalar()
+    assert orphans == 0
+
+    load(None, schema, "--rollback")
+    assert count_rows(engine, schema, "price") == 1
+    assert count_rows(engine, f"{schema}_previous", "price") == 0
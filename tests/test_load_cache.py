@@ -0,0 +1,136 @@
+import pathlib
+
+import beancount
+import pytest
+from beancount import loader
+from beancount.ops import validation
+from beancount.utils import encryption
+
+from .helpers import assert_same_result
+from beancount_exporter.load_cache import LoadCache
+from beancount_exporter.loading import load_file
+from beancount_exporter.loading import parse_files
+from beancount_exporter.parse_cache import CacheKey
+
+MAIN = """\
+plugin "beancount.plugins.auto_accounts"
+include "months/*.bean"
+
+1970-01-01 commodity USD
+"""
+MONTH = """\
+1970-{month}-02 * "Buy milk" "Wholefood"
+  Assets:Cash     -5.99 USD
+  Expenses:Grocery
+"""
+
+
+@pytest.fixture
+def ledger(tmp_path: pathlib.Path) -> pathlib.Path:
+    ledger_dir = tmp_path / "ledger"
+    (ledger_dir / "months").mkdir(parents=True)
+    (ledger_dir / "main.bean").write_text(MAIN)
+    (ledger_dir / "months" / "01.bean").write_text(MONTH.format(month="01"))
+    return ledger_dir / "main.bean"
+
+
+def load_ledger(
+    ledger: pathlib.Path,
+) -> tuple[tuple, list[str], list[tuple[str, str]]]:
+    parsed_filenames = []
+    include_globs = []
+    result = load_file(
+        str(ledger),
+        parse_files=parse_files,
+        include_globs=include_globs,
+        parsed_filenames=parsed_filenames,
+    )
+    assert_same_result(result, loader.load_file(str(ledger)))
+    return result, parsed_filenames, include_globs
+
+
+def load_cached(load_cache: LoadCache, ledger: pathlib.Path, **kwargs):
+    messages = []
+    result = load_cache.load(str(ledger), log_timings=messages.append, **kwargs)
+    return result, messages
+
+
+@pytest.mark.parametrize("key", CacheKey)
+def test_load_cache(
+    tmp_path: pathlib.Path,
+    ledger: pathlib.Path,
+    key: CacheKey,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    load_cache = LoadCache(tmp_path / "cache", key=key)
+    result, messages = load_cached(load_cache, ledger)
+    assert result is None
+    assert any("miss" in message for message in messages)
+
+    expected, parsed_filenames, include_globs = load_ledger(ledger)
+    load_cache.dump(str(ledger), expected, parsed_filenames, include_globs)
+    result, messages = load_cached(load_cache, ledger)
+    assert any("hit" in message for message in messages)
+    assert_same_result(result, expected)
+
+    # so is the version of beancount
+    monkeypatch.setattr(beancount, "__version__", "0.0.0")
+    result, messages = load_cached(load_cache, ledger)
+    assert result is None
+    assert any("stale" in message for message in messages)
+    monkeypatch.undo()
+
+    # extra validations are part of the key
+    result, _ = load_cached(
+        load_cache, ledger, extra_validations=validation.HARDCORE_VALIDATIONS
+    )
+    assert result is None
+
+    # new files matched by the include glob
+    (ledger.parent / "months" / "02.bean").write_text(MONTH.format(month="02"))
+    result, messages = load_cached(load_cache, ledger)
+    assert result is None
+    assert any("stale" in message for message in messages)
+
+    expected, parsed_filenames, include_globs = load_ledger(ledger)
+    load_cache.dump(str(ledger), expected, parsed_filenames, include_globs)
+    result, _ = load_cached(load_cache, ledger)
+    assert_same_result(result, expected)
+    (ledger.parent / "months" / "02.bean").write_text(MONTH.format(month="03"))
+    result, _ = load_cached(load_cache, ledger)
+    assert result is None
+
+
+def test_load_cache_encrypted(
+    tmp_path: pathlib.Path, ledger: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+):
+    # encrypted files are read in plain text, without requiring gpg
+    monkeypatch.setattr(
+        encryption,
+        "read_encrypted_file",
+        lambda filename: pathlib.Path(filename).read_text(),
+    )
+    secret = ledger.parent / "secret.bean.gpg"
+    secret.write_text(MONTH.format(month="02"))
+    ledger.write_text(MAIN + 'include "secret.bean.gpg"\n')
+    load_cache = LoadCache(tmp_path / "cache")
+    expected, parsed_filenames, include_globs = load_ledger(ledger)
+    assert str(secret) not in expected[2]["include"]
+    load_cache.dump(str(ledger), expected, parsed_filenames, include_globs)
+    result, _ = load_cached(load_cache, ledger)
+    assert_same_result(result, expected)
+
+    secret.write_text(MONTH.format(month="03"))
+    result, messages = load_cached(load_cache, ledger)
+    assert result is None
+    assert any("stale" in message for message in messages)
+
+
+def test_load_cache_corrupted(tmp_path: pathlib.Path, ledger: pathlib.Path):
+    load_cache = LoadCache(tmp_path / "cache")
+    load_cache.dump(str(ledger), *load_ledger(ledger))
+    cache_path = load_cache.cache_path(str(ledger))
+    data = cache_path.read_bytes()
+    for corrupted in (data[:2], data[:10], data[:-1]):
+        cache_path.write_bytes(corrupted)
+        assert load_cache.load(str(ledger)) is None
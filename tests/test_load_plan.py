@@ -0,0 +1,194 @@
+import os
+import pathlib
+import subprocess
+import textwrap
+import uuid
+
+import orjson
+import pytest
+from click.testing import CliRunner
+
+from .helpers import LEDGER
+from beancount_exporter.formats.pgcopy_processor.load_plan import (
+    BUILD_CONSTRAINTS_FILENAME,
+)
+from beancount_exporter.formats.pgcopy_processor.load_plan import (
+    CREATE_TABLES_FILENAME,
+)
+from beancount_exporter.formats.pgcopy_processor.load_plan import list_table_files
+from beancount_exporter.formats.pgcopy_processor.load_plan import (
+    LOAD_SCRIPT_FILENAME,
+)
+from beancount_exporter.formats.pgcopy_processor.manifest import MANIFEST_FILENAME
+from beancount_exporter.formats.pgcopy_processor.schema import column_type
+from beancount_exporter.formats.pgcopy_processor.schema import make_table_schemas
+from beancount_exporter.load_plan import main as load_plan_main
+from beancount_exporter.main import main
+
+
+def export(tmp_path: pathlib.Path, *args: str) -> pathlib.Path:
+    bean_file_path = tmp_path / "main.bean"
+    bean_file_path.write_text(textwrap.dedent(LEDGER))
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    result = CliRunner().invoke(
+        main,
+        [
+            str(bean_file_path),
+            "--base-path",
+            str(tmp_path),
+            "--format",
+            "PGCOPY",
+            "--output-dir",
+            str(output_dir),
+            *args,
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    return output_dir
+
+
+def test_column_types():
+    tables = {
+        table_schema.name: {
+            column.attname: column_type(column, "ledger")
+            for column in table_schema.table
+        }
+        for table_schema in make_table_schemas("int8")
+    }
+    assert tables["entry_base"] == dict(
+        id="int8", entry_type='"ledger"."entrytype"', date="date", meta="jsonb"
+    )
+    assert tables["open"]["currencies"] == "varchar[]"
+    assert tables["posting"]["transaction_id"] == "int8"
+    assert tables["posting"]["units_number"] == "numeric"
+
+
+def test_list_table_files_from_manifest(tmp_path: pathlib.Path):
+    output_dir = export(tmp_path, "--shards", "2", "--partition-by", "YEAR")
+    result = CliRunner().invoke(load_plan_main, [str(output_dir)])
+    assert result.exit_code == 0, result.output
+    script = (output_dir / LOAD_SCRIPT_FILENAME).read_text()
+    assert "posting.1970.1.bin" in script
+    subprocess.run(["sh", "-n", str(output_dir / LOAD_SCRIPT_FILENAME)], check=True)
+
+    table_files = list_table_files(make_table_schemas())
+    assert table_files[0] == ("entry_base", "entry_base.bin")
+    assert table_files[-1] == ("posting", "posting.bin")
+
+
+FAKE_PSQL = """\
+#!/bin/sh
+# records the commands in the order they are done, copying the file named in
+# $SLOW takes a while, and copying the one named in $FAIL fails
+for arg; do command="$arg"; done
+case "$command" in
+    *"'${SLOW:-}'"*) [ -z "${SLOW:-}" ] || sleep 1 ;;
+esac
+printf '%s\\n' "$command" >> psql.log
+case "$command" in
+    *"'${FAIL:-}'"*) [ -z "${FAIL:-}" ] || exit 1 ;;
+esac
+"""
+
+
+def test_load_script(tmp_path: pathlib.Path):
+    output_dir = export(tmp_path, "--shards", "2")
+    result = CliRunner().invoke(load_plan_main, [str(output_dir), "--jobs", "3"])
+    assert result.exit_code == 0, result.output
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "psql").write_text(FAKE_PSQL)
+    (bin_dir / "psql").chmod(0o755)
+    env = dict(os.environ, PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    subprocess.run(
+        [str(output_dir / LOAD_SCRIPT_FILENAME)],
+        env=dict(env, SLOW="entry_base.0.bin"),
+        check=True,
+    )
+    commands = (output_dir / "psql.log").read_text().splitlines()
+    table_files = list_table_files(
+        make_table_schemas(),
+        orjson.loads((output_dir / MANIFEST_FILENAME).read_bytes()),
+    )
+    assert commands[0] == CREATE_TABLES_FILENAME
+    assert commands[-1] == BUILD_CONSTRAINTS_FILENAME
+    # every file is copied once, whichever copy is done first
+    assert sorted(commands[1:-1]) == sorted(
+        f"\\copy \"{table}\" FROM '{filename}' WITH (FORMAT BINARY)"
+        for table, filename in table_files
+    )
+    # the other files are copied while the first one is slow, instead of waiting
+    # for it in batches of jobs
+    assert "'entry_base.0.bin'" in commands[-2]
+
+    (output_dir / "psql.log").unlink()
+    result = subprocess.run(
+        [str(output_dir / LOAD_SCRIPT_FILENAME)],
+        env=dict(env, FAIL="posting.1.bin"),
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 1
+    assert "Loading tables failed" in result.stderr
+    commands = (output_dir / "psql.log").read_text().splitlines()
+    assert BUILD_CONSTRAINTS_FILENAME not in commands
+
+
+def test_load_plan_id_strategy_from_manifest(tmp_path: pathlib.Path):
+    output_dir = export(tmp_path, "--id-strategy", "SEQUENCE")
+    result = CliRunner().invoke(load_plan_main, [str(output_dir)])
+    assert result.exit_code == 0, result.output
+    create_tables = (output_dir / CREATE_TABLES_FILENAME).read_text()
+    assert "uuid" not in create_tables
+    assert "int8" in create_tables
+
+    result = CliRunner().invoke(
+        load_plan_main, [str(output_dir), "--id-strategy", "UUID4"]
+    )
+    assert result.exit_code == 2
+
+
+def test_load_plan(tmp_path: pathlib.Path):
+    database_url = os.environ.get("DATABASE_URL")
+    if database_url is None:
+        pytest.skip("DATABASE_URL is not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    output_dir = export(tmp_path, "--id-strategy", "SEQUENCE")
+    schema = f"test_{uuid.uuid4().hex}"
+    result = CliRunner().invoke(
+        load_plan_main,
+        [
+            str(output_dir),
+            "--database-schema",
+            schema,
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    connection = psycopg2.connect(database_url)
+    try:
+        with connection.cursor() as cursor:
+            # same steps as the load script, without requiring psql
+            cursor.execute((output_dir / CREATE_TABLES_FILENAME).read_text())
+            for table, filename in list_table_files(make_table_schemas("int8")):
+                with open(output_dir / filename, "rb") as fo:
+                    cursor.copy_expert(
+                        f'COPY {schema}."{table}" FROM STDIN WITH (FORMAT BINARY)', fo
+                    )
+            cursor.execute((output_dir / BUILD_CONSTRAINTS_FILENAME).read_text())
+            cursor.execute(
+                f"SELECT count(*) FROM {schema}.posting AS posting "
+                f'JOIN {schema}."transaction" AS txn ON posting.transaction_id = txn.id'
+            )
+            assert cursor.fetchone()[0] == 4
+            cursor.execute(
+                "SELECT relpersistence FROM pg_class "
+                "WHERE relname = 'posting' AND relnamespace = %s::regnamespace",
+                (schema,),
+            )
+            assert cursor.fetchone()[0] == "p"
+    finally:
+        connection.rollback()
+        connection.close()
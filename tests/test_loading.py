@@ -0,0 +1,73 @@
+import pathlib
+
+from beancount import loader
+
+from .helpers import assert_same_result
+from beancount_exporter.loading import load_file
+from beancount_exporter.loading import ParallelParser
+from beancount_exporter.parse_cache import ParseCache
+from beancount_exporter.parse_cache import ParseCacheStats
+
+MAIN = """\
+option "title" "Main"
+include "accounts.bean"
+include "months/*.bean"
+include "months/1970-01.bean"
+include "missing.bean"
+
+1970-01-01 commodity USD
+"""
+ACCOUNTS = """\
+option "title" "Accounts"
+option "operating_currency" "USD"
+include "main.bean"
+
+1970-01-01 open Assets:Cash
+1970-01-01 open Expenses:Grocery
+"""
+MONTH = """\
+include "{month}/*.bean"
+
+1970-{month}-01 * "Rent"
+  Assets:Cash     -100 USD
+  Expenses:Rent
+"""
+DAY = """\
+1970-{month}-{day} * "Buy milk" "Wholefood"
+  Assets:Cash     -5.99 USD
+  Expenses:Grocery
+"""
+
+
+def make_ledger(ledger_dir: pathlib.Path) -> pathlib.Path:
+    (ledger_dir / "months").mkdir(parents=True)
+    (ledger_dir / "main.bean").write_text(MAIN)
+    (ledger_dir / "accounts.bean").write_text(ACCOUNTS)
+    for month in ("01", "02", "03"):
+        (ledger_dir / "months" / f"1970-{month}.bean").write_text(
+            MONTH.format(month=month)
+        )
+        (ledger_dir / "months" / month).mkdir()
+        for day in ("03", "02", "01"):
+            (ledger_dir / "months" / month / f"{day}.bean").write_text(
+                DAY.format(month=month, day=day)
+            )
+    return ledger_dir / "main.bean"
+
+
+def test_parallel_parser(tmp_path: pathlib.Path):
+    ledger = make_ledger(tmp_path / "ledger")
+    expected = loader.load_file(str(ledger))
+    assert expected[1]
+    for jobs in (1, 3):
+        with ParallelParser(jobs) as parallel_parser:
+            result = load_file(str(ledger), parse_files=parallel_parser.parse_files)
+        assert_same_result(result, expected)
+
+    with ParallelParser(3) as parallel_parser:
+        parse_cache = ParseCache(
+            tmp_path / "cache", parse_misses=parallel_parser.parse_files
+        )
+        result = load_file(str(ledger), parse_files=parse_cache.parse_files)
+    assert parse_cache.stats() == ParseCacheStats(hits=0, misses=14, invalidations=0)
+    assert_same_result(result, expected)
@@ -124,3 +124,23 @@ def test_custom_values(tmp_path: pathlib.Path):
         "MOCK_STR_VALUE",
         "678.9",
     ]
+
+
+def test_pgcopy_options_with_json(tmp_path: pathlib.Path):
+    bean_file_path = tmp_path / "main.bean"
+    bean_file_path.write_text("1970-01-01 open Assets:Cash\n")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        main,
+        [
+            str(bean_file_path),
+            "--background-writes",
+            "--jobs",
+            "2",
+        ],
+    )
+    assert result.exit_code == 2
+    assert "--background-writes, --jobs can only be used with --format PGCOPY" in (
+        result.output
+    )
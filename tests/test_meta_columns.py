@@ -0,0 +1,118 @@
+import datetime
+import decimal
+import pathlib
+import struct
+
+import pytest
+
+from .helpers import export_tables
+from .helpers import read_rows
+from beancount_exporter.formats.pgcopy_processor.meta_columns import (
+    DEFAULT_META_COLUMNS,
+)
+from beancount_exporter.formats.pgcopy_processor.meta_columns import make_meta_table
+from beancount_exporter.formats.pgcopy_processor.meta_columns import MetaColumn
+from beancount_exporter.formats.pgcopy_processor.meta_columns import MetaSplitter
+from beancount_exporter.formats.pgcopy_processor.meta_columns import (
+    parse_meta_column,
+)
+from beancount_exporter.formats.pgcopy_processor.tables import ENTRY_BASE_TABLE
+
+LEDGER = """\
+1970-01-01 open Assets:Cash
+1970-01-01 open Expenses:Grocery
+1970-01-02 * "Buy milk" "Wholefood"
+  receipt: "r-1"
+  count: 3
+    Assets:Cash     -5.99 USD
+      reviewed: TRUE
+    Expenses:Grocery
+1970-01-03 * "Buy eggs" "Wholefood"
+  count: "many"
+    Assets:Cash     -3.49 USD
+    Expenses:Grocery
+"""
+META_COLUMNS = (
+    *DEFAULT_META_COLUMNS,
+    MetaColumn("receipt", "varchar"),
+    MetaColumn("count", "int4"),
+    MetaColumn("reviewed", "bool"),
+)
+
+
+def test_parse_meta_column():
+    assert parse_meta_column("count = int4") == MetaColumn("count", "int4")
+    for value in ("count", "=int4", "count=float"):
+        with pytest.raises(ValueError):
+            parse_meta_column(value)
+
+
+def test_make_meta_table():
+    table = make_meta_table(ENTRY_BASE_TABLE, DEFAULT_META_COLUMNS)
+    assert [column.attname for column in table] == [
+        "id",
+        "entry_type",
+        "date",
+        "meta",
+        "filename",
+        "lineno",
+    ]
+    assert not table[3].not_null
+    assert make_meta_table(ENTRY_BASE_TABLE, ()) == ENTRY_BASE_TABLE
+    with pytest.raises(ValueError):
+        make_meta_table(ENTRY_BASE_TABLE, (MetaColumn("date", "date"),))
+
+
+def test_meta_splitter():
+    splitter = MetaSplitter(
+        (
+            MetaColumn("count", "int4"),
+            MetaColumn("amount", "numeric"),
+            MetaColumn("due", "date"),
+            MetaColumn("missing", "varchar"),
+        )
+    )
+    meta = dict(
+        count=decimal.Decimal("3"),
+        amount=decimal.Decimal("1.5"),
+        due=datetime.date(1970, 1, 1),
+        other="x",
+    )
+    assert splitter.split(meta) == (
+        3,
+        decimal.Decimal("1.5"),
+        datetime.date(1970, 1, 1),
+        None,
+    )
+    assert meta == dict(other="x")
+    # values not fitting the type stay in meta
+    for value in ("3", decimal.Decimal("3.5"), 1 << 40, True):
+        meta = dict(count=value)
+        assert splitter.split(meta) == (None, None, None, None)
+        assert meta == dict(count=value)
+
+
+def test_processor_meta_columns(tmp_path: pathlib.Path):
+    files = export_tables(tmp_path, ledger=LEDGER, meta_columns=META_COLUMNS)
+    entry_rows = read_rows(files["entry_base"].getvalue())
+    # nothing is left in meta of the open entries
+    assert entry_rows[0][3] is None
+    assert entry_rows[0][4] == b"<string>"
+    assert entry_rows[0][5] == struct.pack(">i", 1)
+    milk = entry_rows[2]
+    assert b"receipt" not in milk[3]
+    assert milk[6:9] == [b"r-1", struct.pack(">i", 3), None]
+    eggs = entry_rows[3]
+    assert b'"count":"many"' in eggs[3]
+    assert eggs[7] is None
+
+    posting_rows = read_rows(files["posting"].getvalue())
+    assert posting_rows[0][15] is None
+    assert posting_rows[0][-1] == b"\x01"
+    assert b"__automatic__" in posting_rows[1][15]
+
+    parallel_files = export_tables(
+        tmp_path, ledger=LEDGER, meta_columns=META_COLUMNS, jobs=2
+    )
+    for name, file in files.items():
+        assert parallel_files[name].getvalue() == file.getvalue()
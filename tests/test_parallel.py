@@ -0,0 +1,93 @@
+import pathlib
+
+import pytest
+from beancount import loader
+from click.testing import CliRunner
+
+from .helpers import export_tables
+from beancount_exporter.formats.pgcopy_processor.ids import IdStrategy
+from beancount_exporter.formats.pgcopy_processor.ids import make_id_allocator
+from beancount_exporter.formats.pgcopy_processor.parallel import make_tasks
+from beancount_exporter.formats.pgcopy_processor.parallel import split_chunks
+from beancount_exporter.main import main
+
+LEDGER = """\
+2023-01-01 open Assets:Cash
+2023-01-01 open Expenses:Coffee
+2023-01-01 open Expenses:Grocery
+2023-01-02 * "Coffee"
+    Assets:Cash  -4.50 USD
+    Expenses:Coffee
+2023-01-02 * "Coffee"
+    Assets:Cash  -4.50 USD
+    Expenses:Coffee
+2023-01-02 * "Coffee"
+    Assets:Cash  -4.50 USD
+    Expenses:Coffee
+2023-01-03 * "Milk"
+    Assets:Cash  -2.50 USD
+    Expenses:Grocery
+2023-01-04 price BTC 123.45 USD
+2023-01-05 * "Eggs"
+    Assets:Cash  -3.50 USD
+    Expenses:Grocery
+2023-01-06 note Assets:Cash "Counted"
+2023-01-07 close Assets:Cash
+"""
+
+
+def test_split_chunks():
+    entries, _, _ = loader.load_string(LEDGER)
+    # the opens and the coffee transactions on the same dates are not split
+    chunks = split_chunks(entries, 6)
+    assert chunks == [(0, 3), (3, 6), (6, 8), (8, 10), (10, 11)]
+    tasks = make_tasks(entries, 6, ship_entries=True)
+    assert [task.id_offset for task in tasks] == [0, 3, 12, 16, 20]
+    assert [len(task.entries) for task in tasks] == [3, 3, 2, 2, 1]
+
+
+@pytest.mark.parametrize(
+    "strategy", [IdStrategy.SEQUENCE, IdStrategy.UUID7, IdStrategy.CONTENT]
+)
+def test_process_entries_jobs(tmp_path: pathlib.Path, strategy: IdStrategy):
+    files = export_tables(
+        tmp_path, ledger=LEDGER, id_allocator=make_id_allocator(strategy)
+    )
+    parallel_files = export_tables(
+        tmp_path, ledger=LEDGER, id_allocator=make_id_allocator(strategy), jobs=3
+    )
+    for name, file in files.items():
+        if strategy == IdStrategy.UUID7:
+            # the random bits differ, but the sizes and the order of rows don't
+            assert len(parallel_files[name].getvalue()) == len(file.getvalue())
+            continue
+        assert parallel_files[name].getvalue() == file.getvalue()
+
+
+def test_process_entries_jobs_threads(tmp_path: pathlib.Path):
+    # worker processes can't be forked while the writer thread runs
+    with pytest.raises(ValueError):
+        export_tables(tmp_path, ledger=LEDGER, background_writes=True, jobs=2)
+
+    bean_file_path = tmp_path / "main.bean"
+    bean_file_path.write_text(LEDGER)
+    for args in (
+        ("--background-writes",),
+        ("--fifo",),
+        ("--database-url", "postgresql://invalid"),
+    ):
+        result = CliRunner().invoke(
+            main,
+            [
+                str(bean_file_path),
+                "--format",
+                "PGCOPY",
+                "--output-dir",
+                str(tmp_path),
+                "--jobs",
+                "2",
+                *args,
+            ],
+        )
+        assert result.exit_code == 2, args
+        assert "--jobs can't be used with" in result.output
@@ -0,0 +1,83 @@
+import pathlib
+
+import pytest
+from beancount import loader
+
+from .helpers import assert_same_result
+from beancount_exporter.loading import load_file
+from beancount_exporter.parse_cache import CacheKey
+from beancount_exporter.parse_cache import ParseCache
+from beancount_exporter.parse_cache import ParseCacheStats
+
+MAIN = """\
+option "operating_currency" "USD"
+plugin "beancount.plugins.auto_accounts"
+include "accounts.bean"
+include "transactions/*.bean"
+include "missing/*.bean"
+
+1970-01-01 commodity USD
+"""
+ACCOUNTS = """\
+option "operating_currency" "TWD"
+include "main.bean"
+
+1970-01-01 open Assets:Cash
+"""
+JANUARY = """\
+1970-01-02 * "Buy milk" "Wholefood"
+  Assets:Cash     -5.99 USD
+  Expenses:Grocery
+
+1970-01-10 balance Assets:Cash  100 USD
+"""
+FEBRUARY = """\
+1970-02-02 * "Buy eggs" "Wholefood"
+  Assets:Cash     -3.49 USD
+  Expenses:Grocery
+"""
+
+
+@pytest.fixture
+def ledger(tmp_path: pathlib.Path) -> pathlib.Path:
+    ledger_dir = tmp_path / "ledger"
+    (ledger_dir / "transactions").mkdir(parents=True)
+    (ledger_dir / "main.bean").write_text(MAIN)
+    (ledger_dir / "accounts.bean").write_text(ACCOUNTS)
+    (ledger_dir / "transactions" / "1970-01.bean").write_text(JANUARY)
+    (ledger_dir / "transactions" / "1970-02.bean").write_text(FEBRUARY)
+    return ledger_dir / "main.bean"
+
+
+@pytest.mark.parametrize("key", CacheKey)
+def test_parse_cache(tmp_path: pathlib.Path, ledger: pathlib.Path, key: CacheKey):
+    parse_cache = ParseCache(tmp_path / "cache", key=key)
+    result = load_file(str(ledger), parse_files=parse_cache.parse_files)
+    assert parse_cache.stats() == ParseCacheStats(hits=0, misses=4, invalidations=0)
+    expected = loader.load_file(str(ledger))
+    assert expected[1]
+    assert_same_result(result, expected)
+
+    parse_cache = ParseCache(tmp_path / "cache", key=key)
+    assert_same_result(
+        load_file(str(ledger), parse_files=parse_cache.parse_files), expected
+    )
+    assert parse_cache.stats() == ParseCacheStats(hits=4, misses=0, invalidations=0)
+
+    january = ledger.parent / "transactions" / "1970-01.bean"
+    january.write_text(JANUARY.replace("100 USD", "-5.99 USD"))
+    parse_cache = ParseCache(tmp_path / "cache", key=key)
+    result = load_file(str(ledger), parse_files=parse_cache.parse_files)
+    assert parse_cache.stats() == ParseCacheStats(hits=3, misses=1, invalidations=1)
+    assert_same_result(result, loader.load_file(str(ledger)))
+
+
+def test_parse_cache_corrupted(tmp_path: pathlib.Path, ledger: pathlib.Path):
+    parse_cache = ParseCache(tmp_path / "cache")
+    load_file(str(ledger), parse_files=parse_cache.parse_files)
+    parse_cache.cache_path(str(ledger)).write_bytes(b"garbage")
+
+    parse_cache = ParseCache(tmp_path / "cache")
+    result = load_file(str(ledger), parse_files=parse_cache.parse_files)
+    assert parse_cache.stats() == ParseCacheStats(hits=3, misses=1, invalidations=1)
+    assert_same_result(result, loader.load_file(str(ledger)))
@@ -0,0 +1,66 @@
+import os
+import pathlib
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+LEDGER = """\
+option "operating_currency" "USD"
+option "operating_currency" "TWD"
+1970-01-01 open Assets:Cash USD,TWD,BTC
+1970-01-01 open Expenses:Grocery
+1970-01-01 commodity BTC
+  name: "Bitcoin"
+  precision: 8
+1970-01-02 * "Buy milk" "Wholefood" #food #daily #shop ^receipt-1 ^receipt-2
+  store: "Union Square"
+  city: "New York"
+    Assets:Cash     -5.99 USD
+    Expenses:Grocery
+1970-01-03 * "Buy eggs" #food #daily #unknown
+    Assets:Cash     -3.49 USD
+    Expenses:Unknown
+"""
+
+
+def export(tmp_path: pathlib.Path, name: str, hash_seed: str, *args: str) -> dict:
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "beancount_exporter.main",
+            str(tmp_path / "main.bean"),
+            "--base-path",
+            str(tmp_path),
+            "--format",
+            "PGCOPY",
+            "--output-dir",
+            str(output_dir),
+            *args,
+        ],
+        env=dict(os.environ, PYTHONHASHSEED=hash_seed),
+        cwd=pathlib.Path(__file__).parent.parent,
+        capture_output=True,
+    )
+    return {path.name: path.read_bytes() for path in output_dir.iterdir()}
+
+
+@pytest.mark.parametrize("args", [(), ("--id-strategy", "SEQUENCE", "--jobs", "2")])
+def test_reproducible(tmp_path: pathlib.Path, args: tuple[str, ...]):
+    (tmp_path / "main.bean").write_text(textwrap.dedent(LEDGER))
+    first = export(tmp_path, "first", "1", "--reproducible", *args)
+    second = export(tmp_path, "second", "2", "--reproducible", *args)
+    assert len(first["transaction.bin"]) > 21
+    assert first["errors.json"] != b'{"errors":[]}'
+    assert first == second
+
+
+def test_not_reproducible(tmp_path: pathlib.Path):
+    (tmp_path / "main.bean").write_text(textwrap.dedent(LEDGER))
+    first = export(tmp_path, "first", "1")
+    second = export(tmp_path, "second", "2")
+    assert first["transaction.bin"] != second["transaction.bin"]
@@ -0,0 +1,96 @@
+import io
+import pathlib
+
+import pytest
+from beancount import loader
+from click.testing import CliRunner
+
+from .helpers import assert_same_result
+from beancount_exporter import snapshot
+from beancount_exporter.main import main
+from beancount_exporter.snapshot import dump_snapshot
+from beancount_exporter.snapshot import load_snapshot
+
+LEDGER = """\
+1970-01-01 open Assets:Cash
+1970-01-01 open Expenses:Grocery
+1970-01-02 * "Buy milk" "Wholefood"
+    Assets:Cash     -5.99 USD
+    Expenses:Grocery
+1970-01-03 balance Assets:Cash  100 USD
+"""
+
+
+def make_snapshot(tmp_path: pathlib.Path) -> tuple[tuple, bytes]:
+    ledger = tmp_path / "main.bean"
+    ledger.write_text(LEDGER)
+    result = loader.load_file(str(ledger))
+    file = io.BytesIO()
+    dump_snapshot(file, result)
+    return result, file.getvalue()
+
+
+def test_snapshot(tmp_path: pathlib.Path):
+    result, data = make_snapshot(tmp_path)
+    assert result[1]
+    assert_same_result(load_snapshot(io.BytesIO(data)), result)
+
+
+def test_snapshot_rejected(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch):
+    _, data = make_snapshot(tmp_path)
+    with pytest.raises(ValueError, match="too short"):
+        load_snapshot(io.BytesIO(data[:4]))
+    with pytest.raises(ValueError, match="magic"):
+        load_snapshot(io.BytesIO(b"X" + data[1:]))
+    with pytest.raises(ValueError, match="digest"):
+        load_snapshot(io.BytesIO(data[:-1] + bytes([data[-1] ^ 1])))
+    with pytest.raises(ValueError, match="digest"):
+        load_snapshot(io.BytesIO(data[:-1]))
+
+    monkeypatch.setattr(snapshot, "SNAPSHOT_VERSION", snapshot.SNAPSHOT_VERSION + 1)
+    with pytest.raises(ValueError, match="version"):
+        load_snapshot(io.BytesIO(data))
+    monkeypatch.undo()
+    monkeypatch.setattr(snapshot.beancount, "__version__", "0.0.0")
+    with pytest.raises(ValueError, match="beancount"):
+        load_snapshot(io.BytesIO(data))
+
+
+def test_main_from_snapshot(tmp_path: pathlib.Path):
+    ledger = tmp_path / "main.bean"
+    ledger.write_text(LEDGER)
+    snapshot_path = tmp_path / "main.snapshot"
+    runner = CliRunner()
+    result = runner.invoke(snapshot.main, [str(ledger), str(snapshot_path)])
+    assert result.exit_code == 0, result.output
+
+    output_dirs = []
+    for args in ([str(ledger)], [str(snapshot_path), "--from-snapshot"]):
+        output_dir = tmp_path / f"output{len(output_dirs)}"
+        output_dir.mkdir()
+        output_dirs.append(output_dir)
+        result = runner.invoke(
+            main,
+            [
+                *args,
+                "--base-path",
+                str(tmp_path),
+                "--output-dir",
+                str(output_dir),
+                "--format",
+                "PGCOPY",
+                "--reproducible",
+            ],
+        )
+        # the balance assertion fails
+        assert result.exit_code == 1, result.output
+    expected_dir, snapshot_dir = output_dirs
+    assert sorted(path.name for path in snapshot_dir.iterdir()) == sorted(
+        path.name for path in expected_dir.iterdir()
+    )
+    for path in expected_dir.iterdir():
+        assert (snapshot_dir / path.name).read_bytes() == path.read_bytes(), path.name
+
+    result = runner.invoke(main, [str(ledger), "--from-snapshot"])
+    assert result.exit_code == 2
+    assert "Invalid snapshot" in result.output
@@ -0,0 +1,136 @@
+import datetime
+import pathlib
+
+import orjson
+import pytest
+from click.testing import CliRunner
+
+from .helpers import export_tables
+from .helpers import LEDGER
+from .helpers import read_rows
+from beancount_exporter.formats.pgcopy_processor.manifest import MANIFEST_FILENAME
+from beancount_exporter.formats.pgcopy_processor.schema import make_table_schemas
+from beancount_exporter.formats.pgcopy_processor.sorting import check_sort_keys
+from beancount_exporter.formats.pgcopy_processor.sorting import make_sort_key_getter
+from beancount_exporter.formats.pgcopy_processor.sorting import parse_sort_key
+from beancount_exporter.formats.pgcopy_processor.sorting import record_size
+from beancount_exporter.formats.pgcopy_processor.sorting import SortingTableWriter
+from beancount_exporter.formats.pgcopy_processor.tables import ENTRY_BASE_TABLE
+from beancount_exporter.formats.pgcopy_processor.tables import POSTING_TABLE
+from beancount_exporter.formats.pgcopy_processor.writers import TableWriter
+from beancount_exporter.main import main
+
+
+def test_parse_sort_key():
+    assert parse_sort_key("posting=account, date") == ("posting", ("account", "date"))
+    for value in ("posting", "=account", "posting="):
+        with pytest.raises(ValueError):
+            parse_sort_key(value)
+
+
+def test_sort_key_getter():
+    get_sort_key = make_sort_key_getter(POSTING_TABLE, ("account", "date"))
+    values = (1, 2, "Assets:Cash")
+    date = datetime.date(1970, 1, 1)
+    assert get_sort_key(values, date) == ((False, "Assets:Cash"), (False, date))
+    get_sort_key = make_sort_key_getter(ENTRY_BASE_TABLE, ("date",))
+    # nulls go last
+    assert get_sort_key((1, "OPEN", None), date) > get_sort_key((1, "OPEN", date), date)
+    with pytest.raises(ValueError):
+        make_sort_key_getter(POSTING_TABLE, ("unknown",))
+
+
+@pytest.mark.parametrize(
+    "buffer_size, run_count",
+    [(1, 7), (record_size(b"00", ((False, 1),)) * 3, 2), (1 << 20, 0)],
+)
+def test_sorting_table_writer(tmp_path: pathlib.Path, buffer_size: int, run_count: int):
+    plain_writer = TableWriter(tmp_path.joinpath("plain.bin").open("wb"))
+    writer = SortingTableWriter(
+        plain_writer, buffer_size=buffer_size, spill_dir=str(tmp_path)
+    )
+    writer.start()
+    keys = [3, 1, 2, 1, 0, 3, 2]
+    for index, key in enumerate(keys):
+        writer.write(f"{key}{index}".encode(), sort_key=((False, key),))
+    assert len(writer.runs) == run_count
+    writer.stop()
+    plain_writer.file.close()
+    assert writer.runs == []
+    assert writer.row_count == len(keys)
+    body = tmp_path.joinpath("plain.bin").read_bytes()[19:-2]
+    # equal keys keep their order
+    assert body == b"04" + b"11" + b"13" + b"22" + b"26" + b"30" + b"35"
+
+
+def test_processor_sort_keys(tmp_path: pathlib.Path):
+    files = export_tables(
+        tmp_path,
+        sort_keys={
+            "posting": ("account", "date"),
+            "entry_base": ("date", "entry_type"),
+        },
+        sort_buffer_size=64,
+        spill_dir=str(tmp_path),
+    )
+    posting_rows = read_rows(files["posting"].getvalue())
+    accounts = [row[2] for row in posting_rows]
+    assert accounts == sorted(accounts)
+    assert len(posting_rows) == 4
+    unsorted_files = export_tables(tmp_path)
+    assert sorted(read_rows(unsorted_files["posting"].getvalue())) == sorted(
+        posting_rows
+    )
+    entry_rows = read_rows(files["entry_base"].getvalue())
+    assert [row[2] for row in entry_rows] == sorted(row[2] for row in entry_rows)
+
+
+def test_processor_sort_keys_invalid(tmp_path: pathlib.Path):
+    with pytest.raises(ValueError):
+        export_tables(tmp_path, sort_keys={"unknown": ("id",)})
+    with pytest.raises(ValueError):
+        export_tables(tmp_path, sort_keys={"posting": ("unknown",)})
+    with pytest.raises(ValueError):
+        export_tables(tmp_path, sort_keys={"posting": ("account",)}, jobs=2)
+
+    # keys of dimensions don't sort like the names
+    normalized_tables = {
+        table_schema.name: table_schema.table
+        for table_schema in make_table_schemas(normalized=True)
+    }
+    for columns in (("account",), ("account_id", "date"), ("filename",)):
+        with pytest.raises(ValueError, match="normalized"):
+            check_sort_keys({"posting": columns}, normalized_tables)
+    check_sort_keys({"posting": ("date", "units_number")}, normalized_tables)
+
+
+def test_sort_key_option(tmp_path: pathlib.Path):
+    bean_file_path = tmp_path / "main.bean"
+    bean_file_path.write_text(LEDGER)
+    args = [
+        str(bean_file_path),
+        "--base-path",
+        str(tmp_path),
+        "--format",
+        "PGCOPY",
+        "--output-dir",
+        str(tmp_path),
+    ]
+    result = CliRunner().invoke(
+        main,
+        [*args, "--sort-key", "posting=account,date", "--spill-dir", str(tmp_path)],
+    )
+    assert result.exit_code == 0, result.output
+    manifest = orjson.loads((tmp_path / MANIFEST_FILENAME).read_bytes())
+    assert manifest["sort_keys"] == {"posting": ["account", "date"]}
+
+    result = CliRunner().invoke(main, [*args, "--sort-key", "posting=unknown"])
+    assert result.exit_code == 2
+    assert "Unknown sort key column" in result.output
+
+    # checked before loading, the ledger is not a valid snapshot
+    result = CliRunner().invoke(
+        main, [*args, "--sort-key", "posting=unknown", "--from-snapshot"]
+    )
+    assert result.exit_code == 2
+    assert "Unknown sort key column" in result.output
@@ -0,0 +1,82 @@
+import pathlib
+
+from beancount import loader
+from beancount.ops import validation
+from click.testing import CliRunner
+
+from beancount_exporter.main import main
+from beancount_exporter.validations import BackgroundValidator
+from beancount_exporter.validations import get_extra_validations
+from beancount_exporter.validations import ValidationLevel
+
+LEDGER = """\
+1970-01-01 open Assets:Cash
+1970-01-01 open Expenses:Grocery
+1970-01-02 * "Buy milk" "Wholefood"
+    Assets:Cash     -5.99 USD
+    Expenses:Grocery
+1970-01-03 balance Assets:Cash  100 USD
+1970-01-04 * "Buy bread" "Bakery"
+    Assets:Cash     -1.99 USD
+    Expenses:Bakery
+"""
+
+
+def test_background_validator():
+    entries, _, options_map = loader.load_string(LEDGER)
+    # narration has to be a string
+    entries[2] = entries[2]._replace(narration=42)
+    validations = get_extra_validations(ValidationLevel.HARDCORE)
+    with BackgroundValidator(entries, options_map, validations) as validator:
+        errors = validator.errors()
+    expected = validation.validate_data_types(entries, options_map)
+    assert len(expected) == 1
+    assert [(error.message, error.entry) for error in errors] == [
+        (error.message, error.entry) for error in expected
+    ]
+
+
+def export(tmp_path: pathlib.Path, name: str, *args: str) -> pathlib.Path:
+    ledger = tmp_path / "main.bean"
+    if not ledger.exists():
+        ledger.write_text(LEDGER)
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    result = CliRunner().invoke(
+        main,
+        [
+            str(ledger),
+            "--base-path",
+            str(tmp_path),
+            "--output-dir",
+            str(output_dir),
+            "--format",
+            "PGCOPY",
+            "--reproducible",
+            *args,
+        ],
+    )
+    # the balance assertion of the balance plugin fails at all levels
+    assert result.exit_code == 1, result.output
+    return output_dir
+
+
+def test_main_background_validation(tmp_path: pathlib.Path):
+    expected_dir = export(tmp_path, "expected")
+    output_dir = export(tmp_path, "background", "--background-validation")
+    for path in expected_dir.iterdir():
+        assert (output_dir / path.name).read_bytes() == path.read_bytes(), path.name
+
+    output_dir = export(tmp_path, "none", "--validation-level", "none")
+    assert b"unknown account" in (expected_dir / "errors.json").read_bytes()
+    errors = (output_dir / "errors.json").read_bytes()
+    assert b"unknown account" not in errors
+    assert b"Balance failed" in errors
+    assert (output_dir / "entry_base.bin").read_bytes() == (
+        expected_dir / "entry_base.bin"
+    ).read_bytes()
+
+    result = CliRunner().invoke(
+        main, [str(tmp_path / "main.bean"), "--background-validation"]
+    )
+    assert result.exit_code == 2
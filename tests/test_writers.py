@@ -0,0 +1,195 @@
+import hashlib
+import io
+import pathlib
+
+import pgcopy.copy
+import pytest
+from beancount import loader
+
+from .helpers import CountingBytesIO
+from .helpers import export_tables
+from .helpers import read_rows
+from beancount_exporter.formats.pgcopy_processor.manifest import make_manifest
+from beancount_exporter.formats.pgcopy_processor.options import PgCopyOptions
+from beancount_exporter.formats.pgcopy_processor.processor import PgCopyProcessor
+from beancount_exporter.formats.pgcopy_processor.writers import BackgroundWriter
+from beancount_exporter.formats.pgcopy_processor.writers import PartitionBy
+from beancount_exporter.formats.pgcopy_processor.writers import ShardedTableWriter
+from beancount_exporter.formats.pgcopy_processor.writers import ShardKey
+from beancount_exporter.formats.pgcopy_processor.writers import TableWriter
+
+
+def test_table_writer_flush_size():
+    file = CountingBytesIO()
+    writer = TableWriter(file, flush_size=64)
+    writer.start()
+    assert file.write_count == 0
+    for _ in range(10):
+        writer.write(b"x" * 16)
+    # header (19 bytes) + 3 rows, then 4 rows, the rest is left in the buffer
+    assert file.write_count == 2
+    writer.stop()
+    assert file.write_count == 3
+    assert file.getvalue() == (
+        pgcopy.copy.BINCOPY_HEADER + b"x" * 160 + pgcopy.copy.BINCOPY_TRAILER
+    )
+
+
+def test_processor_flush_size(tmp_path: pathlib.Path):
+    files = export_tables(tmp_path)
+    small_buffer_files = export_tables(tmp_path, flush_size=1)
+    for name, file in files.items():
+        assert file.write_count == 1
+        assert small_buffer_files[name].getvalue() == file.getvalue()
+    # one write for each of the 4 postings (the header goes with the first one) and
+    # the trailer
+    assert small_buffer_files["posting"].write_count == 5
+
+
+def test_processor_background_writes(tmp_path: pathlib.Path):
+    files = export_tables(tmp_path)
+    background_files = export_tables(
+        tmp_path, flush_size=1, background_writes=True, max_pending_chunks=1
+    )
+    for name, file in files.items():
+        assert background_files[name].getvalue() == file.getvalue()
+
+
+class FailingBytesIO(io.BytesIO):
+    def write(self, data: bytes) -> int:
+        raise OSError("No space left on device")
+
+
+def test_background_writer_error():
+    background_writer = BackgroundWriter(max_pending_chunks=1)
+    file = FailingBytesIO()
+    writer = TableWriter(file, flush_size=1, background_writer=background_writer)
+    background_writer.start()
+    writer.start()
+    with pytest.raises(OSError, match="No space left on device"):
+        for _ in range(10):
+            writer.write(b"x")
+        writer.stop()
+        background_writer.stop()
+    # stopping again after the failure is fine
+    background_writer.stop()
+
+
+def blake2b(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def test_sharded_table_writer_round_robin():
+    files = [io.BytesIO() for _ in range(3)]
+    writer = ShardedTableWriter(
+        [TableWriter(file) for file in files], ShardKey.ROUND_ROBIN
+    )
+    writer.start()
+    for index in range(7):
+        writer.write(bytes([index]), key="ignored")
+    writer.stop()
+    assert [shard.row_count for shard in writer.shards] == [3, 2, 2]
+    assert writer.row_count == 7
+    assert make_manifest([("t", None, writer)]) == dict(
+        hash_algorithm="blake2b-128",
+        tables=dict(
+            t=[
+                dict(
+                    file=f"t.{index}.bin",
+                    row_count=row_count,
+                    byte_size=len(file.getvalue()),
+                    content_hash=blake2b(file.getvalue()),
+                )
+                for index, (file, row_count) in enumerate(zip(files, [3, 2, 2]))
+            ]
+        ),
+    )
+    for file in files:
+        assert file.getvalue().startswith(pgcopy.copy.BINCOPY_HEADER)
+        assert file.getvalue().endswith(pgcopy.copy.BINCOPY_TRAILER)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_processor_shards_by_transaction_id(tmp_path: pathlib.Path, jobs: int):
+    ledger = (
+        "1970-01-01 open Assets:Cash\n1970-01-01 open Expenses:Grocery\n"
+        + "".join(
+            f'1970-01-{day:02} * "Buy milk"\n'
+            "    Assets:Cash     -5.99 USD\n"
+            "    Expenses:Grocery\n"
+            for day in range(2, 30)
+        )
+    )
+    files = export_tables(tmp_path, ledger=ledger, shards=4, jobs=jobs)
+    transaction_ids = [
+        {row[0] for row in read_rows(file.getvalue())} for file in files["transaction"]
+    ]
+    posting_transaction_ids = [
+        {row[1] for row in read_rows(file.getvalue())} for file in files["posting"]
+    ]
+    assert posting_transaction_ids == transaction_ids
+    assert sum(map(len, transaction_ids)) == 28
+    assert all(transaction_ids)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_processor_partition_by_year(tmp_path: pathlib.Path, jobs: int):
+    ledger = "".join(
+        f'{year}-06-01 * "Buy milk"\n'
+        "    Assets:Cash     -5.99 USD\n"
+        "    Expenses:Grocery\n"
+        for year in (2021, 2022, 2022, 2023)
+    )
+    entries, errors, _ = loader.load_string(
+        "2021-01-01 open Assets:Cash\n2021-01-01 open Expenses:Grocery\n" + ledger
+    )
+    assert not errors
+    files: dict[tuple[str, str], io.BytesIO] = {}
+
+    def open_partition_files(table: str, partition: str) -> io.BytesIO:
+        file = files[table, partition] = io.BytesIO()
+        return file
+
+    processor = PgCopyProcessor(
+        base_path=tmp_path,
+        option_maps_file=None,
+        errors_file=None,
+        options=PgCopyOptions(partition_by=PartitionBy.YEAR, jobs=jobs),
+        open_partition_files=open_partition_files,
+    )
+    processor.start()
+    processor.process_entries(entries)
+    processor.stop()
+    assert sorted(files) == [
+        ("entry_base", "2021"),
+        ("entry_base", "2022"),
+        ("entry_base", "2023"),
+        ("open", "2021"),
+        ("posting", "2021"),
+        ("posting", "2022"),
+        ("posting", "2023"),
+        ("transaction", "2021"),
+        ("transaction", "2022"),
+        ("transaction", "2023"),
+    ]
+    for partition, count in [("2021", 1), ("2022", 2), ("2023", 1)]:
+        transaction_ids = {
+            row[0] for row in read_rows(files["transaction", partition].getvalue())
+        }
+        posting_transaction_ids = [
+            row[1] for row in read_rows(files["posting", partition].getvalue())
+        ]
+        assert len(transaction_ids) == count
+        assert len(posting_transaction_ids) == count * 2
+        assert set(posting_transaction_ids) == transaction_ids
+    manifest = make_manifest(processor.table_writers)
+    assert manifest["tables"]["posting"] == [
+        dict(
+            file=f"posting.{partition}.bin",
+            row_count=row_count,
+            byte_size=len(files["posting", partition].getvalue()),
+            content_hash=blake2b(files["posting", partition].getvalue()),
+            partition=partition,
+        )
+        for partition, row_count in [("2021", 2), ("2022", 4), ("2023", 2)]
+    ]